@@ -0,0 +1,185 @@
+from dataclasses import dataclass
+import heapq
+import itertools
+import threading
+import time
+from typing import Any, Callable, Optional
+
+def debug(*args, **kwargs):
+    # print(*args, **kwargs)
+    pass
+
+# Requests with lower priority values run first. Requests with at least
+# PRIORITY_SPECULATIVE are speculative, and don't use every worker.
+PRIORITY_PLAY = 0
+PRIORITY_SPECULATIVE = 10
+
+
+@dataclass
+class AIExecutorStats:
+    submitted: int = 0
+    completed: int = 0
+    # Requests that were superseded before they started, or whose results were dropped.
+    skipped: int = 0
+    failed: int = 0
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+    # Seconds between submitting a request and a worker starting it.
+    total_wait_time: float = 0.0
+    # Seconds spent running requests.
+    total_run_time: float = 0.0
+    last_run_time: float = 0.0
+
+    def mean_wait_time(self):
+        n = self.completed + self.failed
+        return self.total_wait_time / n if n else 0.0
+
+    def mean_run_time(self):
+        n = self.completed + self.failed
+        return self.total_run_time / n if n else 0.0
+
+
+@dataclass
+class _Request:
+    generation: int
+    fn: Callable[[], Any]
+    callback: Callable[[Any, float], None]
+    submit_time: float
+
+
+class AIExecutor:
+    '''Runs AI computations on a fixed set of long-lived worker threads.
+
+    Every request is tagged with the executor's current generation. Calling
+    `advance_generation` supersedes all earlier requests: ones that haven't
+    started are skipped, and results of ones that are running are dropped.
+    Results are passed to the request's callback on the worker thread, along
+    with the time in seconds since the request was submitted. Queued requests
+    run in order of priority, and in submission order for equal priorities.
+
+    Priority only orders the queue, and a running request can't be stopped,
+    so at most `max_speculative` speculative requests run at once. By default
+    that's all but one worker (but at least one), so a play request can start
+    right away even while speculative ones are running.
+    '''
+    def __init__(self, num_workers: int = 1, time_fn=time.time,
+                 max_speculative: Optional[int] = None):
+        self.time_fn = time_fn
+        self.generation = 0
+        self.max_speculative = (
+            max_speculative if max_speculative is not None else max(1, num_workers - 1))
+        # Heap of (priority, sequence number, request), guarded by _lock.
+        self._queue = []
+        self._running_speculative = 0
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._stats = AIExecutorStats()
+        self._workers = []
+        for i in range(num_workers):
+            t = threading.Thread(target=self._run_worker, name=f'ai-worker-{i}')
+            t.daemon = True
+            t.start()
+            self._workers.append(t)
+
+    def advance_generation(self) -> int:
+        with self._lock:
+            self.generation += 1
+            return self.generation
+
+    def is_current(self, generation: int) -> bool:
+        return generation == self.generation
+
+    def submit(self, fn: Callable[[], Any], callback: Callable[[Any, float], None],
+               priority: int = PRIORITY_PLAY) -> int:
+        '''Queues `fn` to run on a worker thread and returns the generation of
+        the request. `callback(result, elapsed)` is called if the request is
+        still current when `fn` finishes.
+        '''
+        with self._lock:
+            req = _Request(
+                generation=self.generation, fn=fn, callback=callback, submit_time=self.time_fn())
+            self._stats.submitted += 1
+            heapq.heappush(self._queue, (priority, next(self._sequence), req))
+            self._stats.max_queue_depth = max(self._stats.max_queue_depth, len(self._queue))
+            self._ready.notify()
+            return req.generation
+
+    def stats(self) -> AIExecutorStats:
+        with self._lock:
+            s = AIExecutorStats(**vars(self._stats))
+            s.queue_depth = len(self._queue)
+        return s
+
+    def shutdown(self):
+        self.advance_generation()
+        with self._lock:
+            for _ in self._workers:
+                heapq.heappush(self._queue, (-1, next(self._sequence), None))
+            self._ready.notify_all()
+
+    def _can_start(self) -> bool:
+        # The first request in the heap has the lowest priority value, so if it
+        # has to wait for a speculative slot, so does everything behind it.
+        if not self._queue:
+            return False
+        priority = self._queue[0][0]
+        return (priority < PRIORITY_SPECULATIVE or
+                self._running_speculative < self.max_speculative)
+
+    def _next_request(self):
+        '''Waits for a request that can start, and returns it with whether
+        it's speculative.'''
+        with self._lock:
+            while True:
+                self._ready.wait_for(self._can_start)
+                priority, _, req = heapq.heappop(self._queue)
+                if req is None:
+                    return None, False
+                if not self.is_current(req.generation):
+                    debug(f'Skipping request from generation {req.generation}')
+                    self._stats.skipped += 1
+                    continue
+                speculative = priority >= PRIORITY_SPECULATIVE
+                if speculative:
+                    self._running_speculative += 1
+                return req, speculative
+
+    def _run_worker(self):
+        while True:
+            req, speculative = self._next_request()
+            if req is None:
+                return
+            try:
+                self._run_request(req)
+            finally:
+                if speculative:
+                    with self._lock:
+                        self._running_speculative -= 1
+                        self._ready.notify()
+
+    def _run_request(self, req: _Request):
+        start = self.time_fn()
+        try:
+            result = req.fn()
+        except Exception as ex:
+            print(f'AI request failed: {ex}')
+            with self._lock:
+                self._stats.failed += 1
+                self._stats.total_wait_time += start - req.submit_time
+            return
+        end = self.time_fn()
+        with self._lock:
+            self._stats.total_wait_time += start - req.submit_time
+            self._stats.total_run_time += end - start
+            self._stats.last_run_time = end - start
+            if self.is_current(req.generation):
+                self._stats.completed += 1
+            else:
+                self._stats.skipped += 1
+                return
+        try:
+            req.callback(result, end - req.submit_time)
+        except Exception as ex:
+            # Don't let a bad callback kill the worker.
+            print(f'AI request callback failed: {ex}')
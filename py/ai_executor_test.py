@@ -0,0 +1,92 @@
+import threading
+import unittest
+
+from ai_executor import AIExecutor, PRIORITY_SPECULATIVE
+
+class TestAIExecutor(unittest.TestCase):
+
+    def test_runs_requests_in_order(self):
+        executor = AIExecutor()
+        results = []
+        done = threading.Event()
+
+        def callback(result, elapsed):
+            results.append(result)
+            if len(results) == 3:
+                done.set()
+
+        for i in range(3):
+            executor.submit(lambda i=i: i * 10, callback)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(results, [0, 10, 20])
+        stats = executor.stats()
+        self.assertEqual(stats.submitted, 3)
+        self.assertEqual(stats.completed, 3)
+        self.assertEqual(stats.skipped, 0)
+        executor.shutdown()
+
+    def test_skips_superseded_requests(self):
+        executor = AIExecutor()
+        started = threading.Event()
+        release = threading.Event()
+        done = threading.Event()
+        results = []
+
+        def blocking():
+            started.set()
+            release.wait(5)
+            return 'stale'
+
+        def callback(result, elapsed):
+            results.append(result)
+            done.set()
+
+        executor.submit(blocking, callback)
+        self.assertTrue(started.wait(5))
+        # Queued behind the running request, and superseded before it starts.
+        executor.submit(lambda: 'queued', callback)
+        executor.advance_generation()
+        executor.submit(lambda: 'current', callback)
+        release.set()
+        self.assertTrue(done.wait(5))
+        self.assertEqual(results, ['current'])
+        stats = executor.stats()
+        self.assertEqual(stats.completed, 1)
+        self.assertEqual(stats.skipped, 2)
+        executor.shutdown()
+
+    def test_reserves_worker_for_play_requests(self):
+        executor = AIExecutor(num_workers=3)
+        release = threading.Event()
+        started = []
+        two_started = threading.Event()
+        done = threading.Event()
+        results = []
+
+        def speculative(i):
+            started.append(i)
+            if len(started) == 2:
+                two_started.set()
+            release.wait(5)
+            return i
+
+        def callback(result, elapsed):
+            results.append(result)
+            if result == 'play':
+                done.set()
+
+        for i in range(4):
+            executor.submit(lambda i=i: speculative(i), callback, priority=PRIORITY_SPECULATIVE)
+        self.assertTrue(two_started.wait(5))
+        # Two speculative requests occupy two workers, and the play request
+        # starts on the third without waiting for them.
+        executor.submit(lambda: 'play', callback)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(results, ['play'])
+        self.assertEqual(sorted(started), [0, 1])
+        release.set()
+        executor.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,7 +13,7 @@ package.domain = com.dozingcatsoftware.hearts
 source.dir = .
 
 # (list) Source files to include (let empty to include all the files)
-source.include_exts = py,png,jpg,kv,atlas,so,json,txt
+source.include_exts = py,png,jpg,kv,atlas,so,json,txt,bin
 
 # (list) List of inclusions using pattern matching
 #source.include_patterns = assets/*,images/*.png
@@ -0,0 +1,172 @@
+'''Simulates large numbers of rounds or matches in the shared library, for
+data analysis. Deals, seeds and results are NumPy arrays that the library
+reads and writes in place, so the cost per game is the simulation itself
+rather than creating requests and Python objects. Requires NumPy, which the
+app doesn't need.
+
+A deal matrix has a row of 52 uint8 values per game, where column i is the
+seat (0 to 3) holding the card with index i: clubs 2 to A are 0 to 12,
+followed by diamonds, hearts and spades. See hearts_bulk.rs for how games
+are played. For example:
+    deals = bulk_sim.random_deals(1000000)
+    results = bulk_sim.simulate_rounds(deals, strategy='mixed')
+    shot_moon = results.shooters >= 0
+'''
+
+from ctypes import POINTER, c_double, c_int8, c_int32, c_uint8, c_uint32, c_uint64
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+import capi
+from cards import Card, Rank, Suit
+from hearts import RuleSet
+
+NUM_PLAYERS = 4
+DEAL_SIZE = 52
+
+STRATEGY_CODES = {
+    'random': 0,
+    'avoid_points': 1,
+    'mixed': 2,
+    'linear': 3,
+}
+
+SUITS = [Suit.CLUBS, Suit.DIAMONDS, Suit.HEARTS, Suit.SPADES]
+RANKS = list(Rank)
+
+
+def card_index(card: Card) -> int:
+    return SUITS.index(card.suit) * 13 + RANKS.index(card.rank)
+
+
+def card_from_index(index: int) -> Card:
+    return Card(RANKS[index % 13], SUITS[index // 13])
+
+
+def rules_block(rules: RuleSet) -> np.ndarray:
+    return np.array([
+        rules.point_limit,
+        rules.points_on_first_trick,
+        rules.queen_breaks_hearts,
+        rules.jd_minus_10,
+        rules.shooting_disabled,
+    ], dtype=np.int32)
+
+
+def random_deals(num_games: int, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    '''Returns a deal matrix with `num_games` uniformly random deals.'''
+    rng = rng or np.random.default_rng()
+    positions = rng.random((num_games, DEAL_SIZE)).argsort(axis=1)
+    return (positions // (DEAL_SIZE // NUM_PLAYERS)).astype(np.uint8)
+
+
+def _ptr(arr: Optional[np.ndarray], ctype):
+    return arr.ctypes.data_as(POINTER(ctype)) if arr is not None else None
+
+
+def _input_array(arr, dtype, shape) -> np.ndarray:
+    # Only copies if the array isn't already contiguous with the right type.
+    arr = np.ascontiguousarray(arr, dtype=dtype)
+    if arr.shape != shape:
+        raise ValueError(f'Expected shape {shape}, got {arr.shape}')
+    return arr
+
+
+def _output_array(arr, dtype, shape) -> np.ndarray:
+    if arr is None:
+        return np.empty(shape, dtype=dtype)
+    if arr.dtype != dtype or arr.shape != shape or not arr.flags.c_contiguous:
+        raise ValueError(f'Output must be a contiguous {dtype} array with shape {shape}')
+    return arr
+
+
+def _seeds(seeds, num_games: int) -> np.ndarray:
+    if seeds is None:
+        seeds = np.random.default_rng().integers(0, 2**63, size=num_games, dtype=np.uint64)
+    return _input_array(seeds, np.uint64, (num_games,))
+
+
+def _lib():
+    lib = capi.get_lib()
+    if not lib:
+        raise RuntimeError('Shared library not available')
+    return lib
+
+
+@dataclass
+class RoundResults:
+    # Points taken by each player, shape (N, 4).
+    points: np.ndarray
+    # Seat that shot the moon, or -1, shape (N,).
+    shooters: np.ndarray
+    # Card indices in the order they were played, shape (N, 52), or None.
+    plays: Optional[np.ndarray]
+
+
+@dataclass
+class MatchResults:
+    # Final scores, shape (N, 4).
+    scores: np.ndarray
+    # Number of rounds, shape (N,).
+    rounds: np.ndarray
+    # Number of times each player shot the moon, shape (N, 4).
+    moon_shots: np.ndarray
+
+
+def simulate_rounds(deals, rules: RuleSet = RuleSet(), strategy: str = 'mixed',
+                    p_random: float = 0.1, pass_direction: int = 0, seeds=None,
+                    record_plays: bool = False, out: Optional[RoundResults] = None,
+                    num_threads: int = 0) -> RoundResults:
+    '''Plays a round for each row of `deals`, after passing in
+    `pass_direction` if it's not 0. `seeds` has a uint64 seed per game, and
+    the same deals and seeds give the same results. Results are written to
+    the arrays of `out` if given, so repeated batches can reuse them.
+    `num_threads` of 0 uses one thread per core.'''
+    num_games = len(deals)
+    deals = _input_array(deals, np.uint8, (num_games, DEAL_SIZE))
+    seeds = _seeds(seeds, num_games)
+    rules_arr = rules_block(rules)
+    plays_out = out.plays if out else None
+    if record_plays or plays_out is not None:
+        plays_out = _output_array(plays_out, np.uint8, (num_games, DEAL_SIZE))
+    results = RoundResults(
+        points=_output_array(out.points if out else None, np.int32, (num_games, NUM_PLAYERS)),
+        shooters=_output_array(out.shooters if out else None, np.int8, (num_games,)),
+        plays=plays_out,
+    )
+    status = _lib().simulate_rounds(
+        _ptr(deals, c_uint8), _ptr(seeds, c_uint64), c_uint32(num_games),
+        _ptr(rules_arr, c_int32), c_int32(STRATEGY_CODES[strategy]), c_double(p_random),
+        c_uint32(pass_direction), c_uint32(num_threads),
+        _ptr(results.points, c_int32), _ptr(results.shooters, c_int8),
+        _ptr(results.plays, c_uint8))
+    if status != 0:
+        raise ValueError('Invalid deals or pass direction')
+    return results
+
+
+def simulate_matches(deals, rules: RuleSet = RuleSet(), strategy: str = 'mixed',
+                     p_random: float = 0.1, seeds=None, out: Optional[MatchResults] = None,
+                     num_threads: int = 0) -> MatchResults:
+    '''Plays a match for each row of `deals`, which is the deal for the first
+    round. Later rounds are dealt randomly from the game's seed.'''
+    num_games = len(deals)
+    deals = _input_array(deals, np.uint8, (num_games, DEAL_SIZE))
+    seeds = _seeds(seeds, num_games)
+    rules_arr = rules_block(rules)
+    results = MatchResults(
+        scores=_output_array(out.scores if out else None, np.int32, (num_games, NUM_PLAYERS)),
+        rounds=_output_array(out.rounds if out else None, np.int32, (num_games,)),
+        moon_shots=_output_array(
+            out.moon_shots if out else None, np.int32, (num_games, NUM_PLAYERS)),
+    )
+    status = _lib().simulate_matches(
+        _ptr(deals, c_uint8), _ptr(seeds, c_uint64), c_uint32(num_games),
+        _ptr(rules_arr, c_int32), c_int32(STRATEGY_CODES[strategy]), c_double(p_random),
+        c_uint32(num_threads), _ptr(results.scores, c_int32), _ptr(results.rounds, c_int32),
+        _ptr(results.moon_shots, c_int32))
+    if status != 0:
+        raise ValueError('Invalid deals or rules')
+    return results
@@ -0,0 +1,68 @@
+import unittest
+
+# capi has to be imported before hearts because they import each other.
+import capi
+from cards import Card
+from hearts import RuleSet
+
+try:
+    import numpy as np
+    import bulk_sim
+except ImportError:
+    np = None
+
+
+@unittest.skipUnless(np is not None and capi.get_lib(), 'NumPy or shared library not available')
+class TestBulkSim(unittest.TestCase):
+
+    def test_card_index(self):
+        self.assertEqual(bulk_sim.card_index(Card.parse('2C')), 0)
+        self.assertEqual(bulk_sim.card_index(Card.parse('QS')), 49)
+        for i in range(52):
+            self.assertEqual(bulk_sim.card_index(bulk_sim.card_from_index(i)), i)
+
+    def test_random_deals(self):
+        deals = bulk_sim.random_deals(100, np.random.default_rng(1))
+        self.assertEqual(deals.shape, (100, 52))
+        for seat in range(4):
+            self.assertTrue(((deals == seat).sum(axis=1) == 13).all())
+
+    def test_simulate_rounds(self):
+        rng = np.random.default_rng(2)
+        deals = bulk_sim.random_deals(200, rng)
+        seeds = np.arange(200, dtype=np.uint64)
+        results = bulk_sim.simulate_rounds(
+            deals, seeds=seeds, pass_direction=1, record_plays=True, num_threads=2)
+        totals = results.points.sum(axis=1)
+        shot = results.shooters >= 0
+        self.assertTrue((totals[shot] == 78).all())
+        self.assertTrue((totals[~shot] == 26).all())
+        self.assertTrue((results.plays[:, 0] == bulk_sim.card_index(Card.parse('2C'))).all())
+        self.assertTrue((np.sort(results.plays, axis=1) == np.arange(52)).all())
+
+        # Results go into the given arrays, and the same seeds give the same results.
+        out = bulk_sim.RoundResults(
+            points=np.zeros_like(results.points), shooters=np.zeros_like(results.shooters),
+            plays=None)
+        again = bulk_sim.simulate_rounds(deals, seeds=seeds, pass_direction=1, out=out)
+        self.assertIs(again.points, out.points)
+        np.testing.assert_array_equal(out.points, results.points)
+        np.testing.assert_array_equal(out.shooters, results.shooters)
+
+    def test_simulate_matches(self):
+        deals = bulk_sim.random_deals(20, np.random.default_rng(3))
+        results = bulk_sim.simulate_matches(deals, rules=RuleSet(point_limit=50, jd_minus_10=True))
+        self.assertTrue((results.scores.max(axis=1) >= 50).all())
+        self.assertTrue((results.rounds >= 2).all())
+
+    def test_invalid_deals(self):
+        deals = bulk_sim.random_deals(2)
+        deals[1, 0] = (deals[1, 0] + 1) % 4
+        with self.assertRaises(ValueError):
+            bulk_sim.simulate_rounds(deals)
+        with self.assertRaises(ValueError):
+            bulk_sim.simulate_matches(deals[:, :40])
+
+
+if __name__ == '__main__':
+    unittest.main()
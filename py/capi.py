@@ -1,7 +1,16 @@
-from ctypes import cdll, c_char, c_int32
+from collections import OrderedDict
+from ctypes import byref, cdll, c_char, c_float, c_int32, c_uint64
+import hashlib
 import json
+import os
+import subprocess
+import threading
+from typing import Dict, List, Optional, Tuple
 
-from hearts import Round, RuleSet
+from cards import Card
+from hearts import PassInfo, Round, RuleSet
+from instrumentation import timed
+import pass_table
 
 def load_shared_lib():
     # TODO: Windows support, presumably libhearts.dll.
@@ -19,7 +28,206 @@ def load_shared_lib():
     print('Unable to load hearts shared library')
     return None
 
-lib = load_shared_lib()
+_lib = None
+_lib_loaded = False
+_lib_lock = threading.Lock()
+
+def get_lib():
+    '''Returns the shared library, loading it on first use, or None if it
+    can't be loaded. Loading happens at most once even if called from
+    several threads.'''
+    global _lib, _lib_loaded
+    if not _lib_loaded:
+        with _lib_lock:
+            if not _lib_loaded:
+                _lib = load_shared_lib()
+                _lib_loaded = True
+    return _lib
+
+
+# Seconds that JsonServer.call waits for a response by default. Searches
+# normally take well under a second.
+DEFAULT_TIMEOUT = 60
+
+
+class JsonServer:
+    '''Runs the hearts_json binary as a server in a subprocess and sends it
+    requests, for when the shared library can't be loaded; see
+    hearts_server.rs. Can be called from several threads, and their requests
+    are handled concurrently.'''
+    def __init__(self, path: str, args: List[str] = ()):
+        self._process = subprocess.Popen(
+            [path, '--serve', *args], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self._lock = threading.Lock()
+        self._next_id = 0
+        # Request IDs mapped to an event that's set when the response arrives,
+        # and a dict that the response is stored in.
+        self._waiting: Dict[int, Tuple[threading.Event, dict]] = {}
+        self._closed = False
+        self._reader = threading.Thread(target=self._read_responses, daemon=True)
+        self._reader.start()
+
+    @timed('capi.server_call')
+    def call(self, op: str, req: dict, timeout: Optional[float] = DEFAULT_TIMEOUT) -> dict:
+        '''Sends `req` with the operation `op`, such as "card_to_play", and
+        returns the response. Raises ValueError if the server rejects the
+        request, and RuntimeError if the server has exited or doesn't respond
+        within `timeout` seconds.'''
+        done = threading.Event()
+        result = {}
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('hearts_json server has exited')
+            self._next_id += 1
+            req_id = self._next_id
+            self._waiting[req_id] = (done, result)
+            line = json.dumps({**req, 'id': req_id, 'op': op}) + '\n'
+            try:
+                self._process.stdin.write(line.encode('utf-8'))
+                self._process.stdin.flush()
+            except (OSError, ValueError):
+                # The server exited before the reader thread noticed, or was closed.
+                del self._waiting[req_id]
+                raise RuntimeError('hearts_json server has exited')
+        if not done.wait(timeout):
+            with self._lock:
+                self._waiting.pop(req_id, None)
+            raise RuntimeError(f'hearts_json server did not respond in {timeout} seconds')
+        response = result.get('response')
+        if response is None:
+            raise RuntimeError('hearts_json server has exited')
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return response
+
+    def _read_responses(self):
+        try:
+            for line in self._process.stdout:
+                try:
+                    response = json.loads(line)
+                    req_id = response['id']
+                except (ValueError, TypeError, KeyError):
+                    print(f'Unexpected output from hearts_json server: {line!r}')
+                    continue
+                with self._lock:
+                    waiter = self._waiting.pop(req_id, None)
+                if waiter is None:
+                    # The request timed out, or the ID is one we never sent.
+                    print(f'Unexpected response from hearts_json server: {line!r}')
+                    continue
+                done, result = waiter
+                result['response'] = response
+                done.set()
+        finally:
+            # However the reader stopped, mark the server closed and wake any
+            # callers still waiting.
+            self._process.stdout.close()
+            with self._lock:
+                self._closed = True
+                for (done, _) in self._waiting.values():
+                    done.set()
+                self._waiting.clear()
+
+    def close(self):
+        self._process.stdin.close()
+        self._process.wait()
+        self._reader.join()
+
+
+def start_json_server() -> Optional[JsonServer]:
+    # TODO: Windows support, presumably hearts_json.exe.
+    paths = [
+        '../rust/target/release/hearts_json',
+    ]
+    for path in paths:
+        if os.path.isfile(path):
+            args = []
+            if os.path.isdir(EQUITY_TABLE_DIR):
+                for name in sorted(os.listdir(EQUITY_TABLE_DIR)):
+                    if name.endswith('.bin'):
+                        args += ['--equity-table', os.path.join(EQUITY_TABLE_DIR, name)]
+            if os.path.isfile(ROLLOUT_POLICY_PATH):
+                args += ['--rollout-policy', ROLLOUT_POLICY_PATH]
+            return JsonServer(path, args)
+    print('Unable to start hearts_json server')
+    return None
+
+_server = None
+_server_started = False
+
+def get_server() -> Optional[JsonServer]:
+    '''Returns the hearts_json server, starting it on first use, or None if
+    the binary can't be found. Callers should prefer the shared library.'''
+    global _server, _server_started
+    if not _server_started:
+        with _lib_lock:
+            if not _server_started:
+                _server = start_json_server()
+                _server_started = True
+    return _server
+
+
+# Match equity tables written by the hearts_equity_table binary; see hearts_equity.rs.
+EQUITY_TABLE_DIR = 'assets/equity_tables'
+
+@timed('capi.load_equity_tables')
+def load_equity_tables(table_dir: Optional[str] = None) -> int:
+    '''Loads the match equity tables in `table_dir` or EQUITY_TABLE_DIR into
+    the shared library, so that searches use them for matching rules instead
+    of estimating equities from scores. Returns the number of tables loaded.'''
+    lib = get_lib()
+    table_dir = table_dir or EQUITY_TABLE_DIR
+    if not lib or not os.path.isdir(table_dir):
+        return 0
+    num_loaded = 0
+    for name in sorted(os.listdir(table_dir)):
+        if not name.endswith('.bin'):
+            continue
+        with open(os.path.join(table_dir, name), 'rb') as f:
+            data = f.read()
+        if lib.load_match_equity_table(data, len(data)) == 0:
+            num_loaded += 1
+        else:
+            print(f'Invalid match equity table: {name}')
+    return num_loaded
+
+
+# Rollout policy weights written by train_rollout_policy.py; see hearts_policy.rs.
+ROLLOUT_POLICY_PATH = 'assets/rollout_policy.bin'
+
+@timed('capi.load_rollout_policy')
+def load_rollout_policy(path: Optional[str] = None) -> bool:
+    '''Loads the rollout policy at `path` or ROLLOUT_POLICY_PATH into the
+    shared library, replacing its built-in weights. Returns whether a policy
+    was loaded.'''
+    lib = get_lib()
+    path = path or ROLLOUT_POLICY_PATH
+    if not lib or not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        data = f.read()
+    if lib.load_rollout_policy(data, len(data)) != 0:
+        print(f'Invalid rollout policy: {path}')
+        return False
+    return True
+
+
+def warm_up():
+    '''Loads the shared library, the match equity tables and the rollout
+    policy, and makes a trivial call into the library, so that the first real
+    request doesn't pay for loading. Starts the hearts_json server instead if
+    the library can't be loaded. Intended to run on a background thread at
+    startup.'''
+    lib = get_lib()
+    if lib:
+        load_equity_tables()
+        load_rollout_policy()
+        req_bytes = json.dumps({'tricks': []}).encode('utf-8')
+        nump = 4
+        score_buffer = (c_int32 * nump).from_buffer(bytearray(nump * 4))
+        lib.points_taken_from_json(req_bytes, len(req_bytes), score_buffer, nump)
+    else:
+        get_server()
 
 
 def serialize_cards(cards):
@@ -45,17 +253,51 @@ def serialize_rules(rules: RuleSet):
     }
 
 
-def cards_to_pass(rnd: Round, player_index: int):
-    if not lib:
-        return rnd.current_player().hand[:rnd.pass_info.num_cards]
+@timed('capi.cards_to_pass')
+def cards_to_pass(rnd: Round, player_index: int, strategy: Optional[dict] = None):
+    '''Calls cards_to_pass_for_hand, or uses a pass table if there's one for
+    the round's rules and `strategy` isn't given. Tables are generated with
+    pass_table.STRATEGY at scores of 0, so they're skipped if any score isn't
+    0. Hands that aren't in the table use pass_table.STRATEGY directly, so the
+    strategy doesn't depend on which hands the table covers.'''
     hand = rnd.players[player_index].hand
+    use_table = (
+        strategy is None and
+        not any(rnd.scores_before_round) and
+        rnd.pass_info.num_cards == pass_table.NUM_CARDS)
+    if use_table:
+        table = pass_table.table_for_rules(rnd.rules)
+        if table:
+            cards = table.lookup(hand, rnd.pass_info.direction)
+            if cards:
+                return cards
+            strategy = pass_table.STRATEGY
+    return cards_to_pass_for_hand(
+        rnd.rules, rnd.scores_before_round, player_index, hand, rnd.pass_info, strategy)
+
+
+@timed('capi.cards_to_pass_for_hand')
+def cards_to_pass_for_hand(rules: RuleSet, scores_before_round: List[int], player_index: int,
+                           hand: List[Card], pass_info: PassInfo, strategy: Optional[dict] = None):
+    '''`strategy` selects how to choose the cards, for example
+    {'name': 'simulation', 'time_limit_ms': 500} to play out rounds with
+    candidate passes. See hearts_json.rs for the options.'''
+    lib = get_lib()
+    server = get_server() if not lib else None
+    if not lib and not server:
+        return hand[:pass_info.num_cards]
     req = {
-        'rules': serialize_rules(rnd.rules),
-        'scores_before_round': rnd.scores_before_round,
+        'rules': serialize_rules(rules),
+        'scores_before_round': scores_before_round,
+        'player_index': player_index,
         'hand': serialize_cards(hand),
-        'direction': rnd.pass_info.direction,
-        'num_cards': rnd.pass_info.num_cards,
+        'direction': pass_info.direction,
+        'num_cards': pass_info.num_cards,
     }
+    if strategy is not None:
+        req['strategy'] = strategy
+    if not lib:
+        return cards_from_str(server.call('cards_to_pass', req)['cards'])
     req_bytes = json.dumps(req).encode('utf-8')
     buf_len = len(hand)
     arr_type = c_char * buf_len
@@ -65,7 +307,17 @@ def cards_to_pass(rnd: Round, player_index: int):
     return [card for (card, passed) in zip(hand, pass_buffer) if ord(passed)]
 
 
-def json_bytes_for_round(rnd: Round):
+def cards_from_str(s: str) -> List[Card]:
+    return [Card.parse(c) for c in s.split()]
+
+
+def json_bytes_for_round(rnd: Round, strategy: Optional[dict] = None):
+    '''`strategy` selects the AI used by `best_play`, for example
+    {'name': 'monte_carlo', 'num_hands': 100}. See hearts_json.rs for the options.'''
+    return json.dumps(request_for_round(rnd, strategy)).encode('utf-8')
+
+
+def request_for_round(rnd: Round, strategy: Optional[dict] = None) -> dict:
     p = rnd.current_player()
     r = {
         'rules': serialize_rules(rnd.rules),
@@ -76,12 +328,90 @@ def json_bytes_for_round(rnd: Round):
         'pass_direction': rnd.pass_info.direction,
         'passed_cards': serialize_cards(p.passed_cards),
         'received_cards': serialize_cards(p.received_cards),
+        'round_id': rnd.round_id,
+    }
+    if strategy is not None:
+        r['strategy'] = strategy
+    return r
+
+
+def info_set_key(rnd: Round, strategy: Optional[dict] = None) -> bytes:
+    '''Returns a hash of what the current player in `rnd` knows, and the
+    strategy. Positions reached by different deals or in different rounds
+    have the same key if the player can't tell them apart, so unlike
+    `json_bytes_for_round` it ignores the round ID and the order of cards
+    in the hand.'''
+    def sorted_cards(cards):
+        return serialize_cards(sorted(cards, key=lambda c: (c.suit.letter, c.rank.rank_val)))
+
+    p = rnd.current_player()
+    rules = serialize_rules(rnd.rules)
+    rules['removed_cards'] = sorted_cards(rnd.rules.removed_cards)
+    r = {
+        'rules': rules,
+        'scores_before_round': rnd.scores_before_round,
+        'hand': sorted_cards(p.hand),
+        'prev_tricks': [serialize_trick(t) for t in rnd.prev_tricks],
+        'current_trick': serialize_trick(rnd.current_trick),
+        'pass_direction': rnd.pass_info.direction,
+        'passed_cards': sorted_cards(p.passed_cards),
+        'received_cards': sorted_cards(p.received_cards),
+        'strategy': strategy,
     }
-    return json.dumps(r).encode('utf-8')
+    return hashlib.sha256(json.dumps(r, sort_keys=True).encode('utf-8')).digest()
+
+
+class DecisionCache:
+    '''Remembers the AI's plays for recent positions, keyed by
+    `info_set_key`, so that positions that come up again, such as in replays
+    and autoplay, get the same play without searching again. Holds at most
+    `max_size` positions and drops the least recently used one when full.
+    Safe to use from several threads.'''
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._plays: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
 
+    def get(self, key: bytes) -> Optional[Card]:
+        with self._lock:
+            card = self._plays.get(key)
+            if card is None:
+                self.misses += 1
+                return None
+            self._plays.move_to_end(key)
+            self.hits += 1
+            return card
 
+    def put(self, key: bytes, card: Card):
+        with self._lock:
+            self._plays[key] = card
+            self._plays.move_to_end(key)
+            while len(self._plays) > self.max_size:
+                self._plays.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._plays.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._plays)
+
+
+decision_cache = DecisionCache()
+
+
+@timed('capi.legal_plays')
 def legal_plays(rnd: Round):
+    lib = get_lib()
     if not lib:
+        server = get_server()
+        if server:
+            return cards_from_str(server.call('legal_plays', request_for_round(rnd))['cards'])
         return rnd.hands[rnd.current_player()][:]
     req_bytes = json_bytes_for_round(rnd)
     hand = rnd.current_player().hand
@@ -93,22 +423,74 @@ def legal_plays(rnd: Round):
     return [card for (card, legal) in zip(hand, legal_play_buffer) if ord(legal)]
 
 
-def best_play(rnd: Round):
+@timed('capi.best_play')
+def best_play(rnd: Round, strategy: Optional[dict] = None):
+    return best_play_with_rollouts(rnd, strategy)[0]
+
+
+@timed('capi.best_play_with_rollouts')
+def best_play_with_rollouts(rnd: Round, strategy: Optional[dict] = None):
+    '''Returns the best card to play and the number of rollouts the AI used to
+    choose it. Monte Carlo search stops early when one card is clearly best,
+    so the number of rollouts varies. Plays for positions in `decision_cache`
+    are returned from it, with no rollouts.'''
+    lib = get_lib()
+    server = get_server() if not lib else None
+    if not lib and not server:
+        return rnd.hands[rnd.current_player()][0], 0
+    key = info_set_key(rnd, strategy)
+    cached = decision_cache.get(key)
+    if cached is not None:
+        return cached, 0
     if not lib:
-        return rnd.hands[rnd.current_player()][0]
+        response = server.call('card_to_play', request_for_round(rnd, strategy))
+        card = rnd.current_player().hand[response['index']]
+        decision_cache.put(key, card)
+        return card, response['num_rollouts']
+    req_bytes = json_bytes_for_round(rnd, strategy)
+    hand = rnd.current_player().hand
+    num_rollouts = c_uint64(0)
+    best_card_index = lib.card_to_play_with_stats_from_json(
+        req_bytes, len(req_bytes), byref(num_rollouts))
+    card = hand[best_card_index]
+    decision_cache.put(key, card)
+    return card, num_rollouts.value
+
+
+# Upper bound on the number of rollout policy features, for sizing buffers.
+MAX_PLAY_FEATURES = 64
+
+@timed('capi.play_features')
+def play_features(rnd: Round) -> Optional[List[Tuple[Card, List[float]]]]:
+    '''Returns the legal plays for the current player and the rollout policy
+    features of each, or None if the shared library isn't available.'''
+    lib = get_lib()
+    if not lib:
+        return None
     req_bytes = json_bytes_for_round(rnd)
     hand = rnd.current_player().hand
-    best_card_index = lib.card_to_play_from_json(req_bytes, len(req_bytes))
-    return hand[best_card_index]
+    buf_len = len(hand) * MAX_PLAY_FEATURES
+    features_buffer = (c_float * buf_len).from_buffer(bytearray(buf_len * 4))
+    num_features = lib.play_features_from_json(req_bytes, len(req_bytes), features_buffer, buf_len)
+    if num_features < 0:
+        return None
+    legal = legal_plays(rnd)
+    return [(card, features_buffer[i * num_features:(i + 1) * num_features])
+            for (i, card) in enumerate(hand) if card in legal]
 
 
+@timed('capi.points_taken')
 def points_taken(rnd: Round):
-    if not lib:
+    lib = get_lib()
+    server = get_server() if not lib else None
+    if not lib and not server:
         return [0] * rnd.rules.num_players
     req = {
         'rules': serialize_rules(rnd.rules),
         'tricks': [serialize_trick(t) for t in rnd.prev_tricks],
     }
+    if not lib:
+        return server.call('points_taken', req)['points']
     req_bytes = json.dumps(req).encode('utf-8')
     nump = rnd.rules.num_players
     arr_type = c_int32 * nump
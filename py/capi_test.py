@@ -0,0 +1,159 @@
+import copy
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+# capi has to be imported before hearts because they import each other.
+import capi
+from cards import Card
+from hearts import PassInfo, Player, Round, RuleSet, Trick
+
+def cards(s):
+    return [Card.parse(c) for c in s.split()]
+
+
+class TestInfoSetKey(unittest.TestCase):
+
+    def make_round(self, hands):
+        rnd = Round(RuleSet(), PassInfo(direction=0, num_cards=0), [0, 0, 0, 0])
+        rnd.players = [Player(hand=cards(h)) for h in hands]
+        rnd.current_trick = Trick(leader=0, cards=cards('2C'))
+        return rnd
+
+    def test_same_for_indistinguishable_positions(self):
+        a = self.make_round(['AS', 'KC 3H', 'QD', 'JH'])
+        # Another round, with the hand in another order and other opponents' cards.
+        b = self.make_round(['QS', '3H KC', 'JD', '2H'])
+        self.assertNotEqual(a.round_id, b.round_id)
+        self.assertEqual(capi.info_set_key(a), capi.info_set_key(b))
+
+    def test_differs_for_strategy_and_scores(self):
+        rnd = self.make_round(['AS', 'KC 3H', 'QD', 'JH'])
+        key = capi.info_set_key(rnd)
+        self.assertNotEqual(key, capi.info_set_key(rnd, {'name': 'avoid_points'}))
+        other = copy.deepcopy(rnd)
+        other.scores_before_round = [10, 0, 0, 0]
+        self.assertNotEqual(key, capi.info_set_key(other))
+        other = copy.deepcopy(rnd)
+        other.players[1].hand = cards('KC 4H')
+        self.assertNotEqual(key, capi.info_set_key(other))
+
+
+class TestDecisionCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = capi.DecisionCache(max_size=2)
+        cache.put(b'a', Card.parse('AS'))
+        cache.put(b'b', Card.parse('KS'))
+        self.assertEqual(cache.get(b'a'), Card.parse('AS'))
+        cache.put(b'c', Card.parse('QS'))
+        self.assertIsNone(cache.get(b'b'))
+        self.assertEqual(cache.get(b'c'), Card.parse('QS'))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+
+SERVER_PATH = '../rust/target/release/hearts_json'
+
+@unittest.skipUnless(os.path.isfile(SERVER_PATH), 'hearts_json binary not built')
+class TestJsonServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = capi.JsonServer(SERVER_PATH, ['--threads', '2'])
+        self.addCleanup(self.server.close)
+
+    def test_requests_from_threads(self):
+        req = {
+            'hand': 'QS 9S 2S KH 3H 2H 9D 8D 7D 9C 8C 3C',
+            'scores_before_round': [0, 0, 0, 0],
+            'prev_tricks': [{'leader': 0, 'cards': '2C AC KC QC'}],
+            'current_trick': {'leader': 1, 'cards': '4S 8S'},
+            'pass_direction': 0,
+            'passed_cards': '',
+            'received_cards': '',
+        }
+        results = {}
+
+        def call(name, op, req):
+            results[name] = self.server.call(op, req)
+
+        threads = [
+            threading.Thread(target=call, args=('legal', 'legal_plays', req)),
+            threading.Thread(target=call, args=('play', 'card_to_play', req)),
+            threading.Thread(target=call, args=(
+                'points', 'points_taken', {'tricks': [{'leader': 0, 'cards': '2C AC QS QC'}]})),
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results['legal']['cards'], 'QS 9S 2S')
+        self.assertIn(results['play']['card'], ['QS', '9S', '2S'])
+        self.assertEqual(results['points']['points'], [0, 13, 0, 0])
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            self.server.call('legal_plays', {'hand': 'QS'})
+
+    def test_inconsistent_request(self):
+        # All three opponents showed out of clubs but the player doesn't have
+        # the rest of them, so the search fails and falls back to avoiding
+        # points. Its diagnostics mustn't break later requests.
+        req = {
+            'hand': 'AS KS QS JS TS 9S 8S AH KH QH JH TH',
+            'scores_before_round': [0, 0, 0, 0],
+            'prev_tricks': [{'leader': 0, 'cards': '2C 2D 3D 4D'}],
+            'current_trick': {'leader': 0, 'cards': ''},
+            'pass_direction': 0,
+            'passed_cards': '',
+            'received_cards': '',
+        }
+        self.assertEqual(self.server.call('card_to_play', req, timeout=10)['card'], '8S')
+        response = self.server.call('points_taken', {'tricks': []}, timeout=10)
+        self.assertEqual(response['points'], [0, 0, 0, 0])
+
+    def test_skips_invalid_output(self):
+        # Runs the reader on output with lines that aren't responses to a
+        # waiting request, which are skipped.
+        done, result = threading.Event(), {}
+        self.server._waiting[1000] = (done, result)
+        with mock.patch.object(self.server, '_process') as process:
+            process.stdout.__iter__.return_value = [
+                b'MC failed\n', b'[]\n', b'{"id": 999}\n', b'{"id": 1000, "cards": ""}\n']
+            self.server._read_responses()
+        self.assertTrue(done.is_set())
+        self.assertEqual(result['response'], {'id': 1000, 'cards': ''})
+        # Reaching the end of the output closes the server.
+        with self.assertRaises(RuntimeError):
+            self.server.call('points_taken', {'tricks': []})
+
+    def test_timeout(self):
+        with mock.patch.object(self.server._process.stdin, 'write'):
+            with self.assertRaises(RuntimeError):
+                self.server.call('points_taken', {'tricks': []}, timeout=0.1)
+        self.assertEqual(self.server._waiting, {})
+
+    def test_skips_invalid_files(self):
+        with tempfile.NamedTemporaryFile(suffix='.bin') as f:
+            f.write(b'not a table')
+            f.flush()
+            server = capi.JsonServer(
+                SERVER_PATH, ['--equity-table', f.name, '--rollout-policy', f.name])
+            self.addCleanup(server.close)
+            response = server.call('points_taken', {'tricks': []})
+        self.assertEqual(response['points'], [0, 0, 0, 0])
+
+    def test_exited(self):
+        self.server._process.kill()
+        self.server._process.wait()
+        with self.assertRaises(RuntimeError):
+            self.server.call('points_taken', {'tricks': []})
+
+
+if __name__ == '__main__':
+    unittest.main()
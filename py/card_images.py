@@ -0,0 +1,87 @@
+import os
+from typing import Dict
+
+from kivy.atlas import Atlas
+from kivy.core.image import Image as CoreImage
+from kivy.graphics.opengl import GL_MAX_TEXTURE_SIZE, glGetIntegerv
+
+from cards import Card, all_cards
+
+def debug(*args, **kwargs):
+    # print(*args, **kwargs)
+    pass
+
+# Card images from https://code.google.com/archive/p/vector-playing-cards/, public domain.
+CARD_WIDTH_OVER_HEIGHT = 500.0 / 726
+
+CARD_IMAGE_DIR = 'assets/cards'
+# Generated by make_atlas.py. If it doesn't exist we fall back to the individual images.
+CARD_ATLAS_PATH = 'assets/card_atlas.atlas'
+
+
+def card_image_path(c: Card):
+    return f'{CARD_IMAGE_DIR}/{c.ascii_string()}.png'
+
+
+def card_atlas_key(c: Card):
+    return c.ascii_string()
+
+
+def max_texture_size() -> int:
+    '''Returns the GPU's maximum texture width and height, or 0 if it can't be
+    queried.'''
+    try:
+        return glGetIntegerv(GL_MAX_TEXTURE_SIZE)[0]
+    except Exception as ex:
+        debug(f'Unable to get maximum texture size: {ex}')
+        return 0
+
+
+class CardTextureCache:
+    '''Holds one texture per card so that every card widget showing the same
+    card shares a single GPU texture. Textures come from the card atlas if
+    it has been built, otherwise from the individual card images.
+    '''
+    def __init__(self, atlas_path: str = CARD_ATLAS_PATH):
+        self.atlas_path = atlas_path
+        self.atlas = None
+        self.textures: Dict[Card, object] = {}
+
+    def _load_atlas(self):
+        if self.atlas is None and os.path.isfile(self.atlas_path):
+            try:
+                atlas = Atlas(self.atlas_path)
+                # Pages larger than the GPU supports don't raise errors, but
+                # don't draw either.
+                max_size = max_texture_size()
+                page_size = max(max(tex.owner.size) for tex in atlas.textures.values())
+                if max_size and page_size > max_size:
+                    raise ValueError(f'Pages are {page_size} pixels, maximum is {max_size}')
+                self.atlas = atlas
+            except Exception as ex:
+                print(f'Failed to load card atlas: {ex}')
+                # Don't try again.
+                self.atlas_path = ''
+        return self.atlas
+
+    def _load_texture(self, card: Card):
+        atlas = self._load_atlas()
+        if atlas:
+            tex = atlas.textures.get(card_atlas_key(card))
+            if tex is not None:
+                return tex
+        return CoreImage(card_image_path(card)).texture
+
+    def texture(self, card: Card):
+        tex = self.textures.get(card)
+        if tex is None:
+            tex = self._load_texture(card)
+            self.textures[card] = tex
+        return tex
+
+    def preload(self):
+        '''Loads textures for every card so that the first render doesn't
+        have to upload them.'''
+        for card in all_cards:
+            self.texture(card)
+        debug(f'Preloaded {len(self.textures)} card textures, atlas: {self.atlas is not None}')
@@ -1,5 +1,6 @@
 from dataclasses import dataclass, field
 import itertools
+import random
 from typing import List, Set
 
 from cards import Card, Deck, Rank, Suit
@@ -62,6 +63,10 @@ class Round:
         self.players = [Player(hand=h) for h in hands]
         self.prev_tricks = []
         self.current_trick = None
+        # Lets the AI reuse work from earlier requests in the same round. Copies
+        # of the round keep the ID, which is fine because the AI only reuses
+        # work from positions that led to the current one.
+        self.round_id = random.getrandbits(53)
 
     def pass_cards(self, passes: List[List[Card]]):
         assert self.pass_info.direction > 0
@@ -148,6 +153,34 @@ class Round:
                 return False
         return True
 
+    def are_hearts_broken(self):
+        qb = self.rules.queen_breaks_hearts
+        tricks = self.prev_tricks + ([self.current_trick] if self.current_trick else [])
+        return any(
+            c.suit == Suit.HEARTS or (qb and c == QUEEN_OF_SPADES) for t in tricks for c in t.cards)
+
+    def _any_legal_play(self):
+        # Doesn't handle the first trick; see play_remaining_tricks.
+        hand = self.current_player().hand
+        ct = self.current_trick
+        if ct.cards:
+            following = [c for c in hand if c.suit == ct.cards[0].suit]
+            return following[0] if following else hand[0]
+        if not self.are_hearts_broken():
+            non_hearts = [c for c in hand if c.suit != Suit.HEARTS]
+            if non_hearts:
+                return non_hearts[0]
+        return hand[0]
+
+    def play_remaining_tricks(self):
+        '''Plays the rest of the round with an arbitrary legal card for each
+        play. This is only meaningful when the outcome no longer depends on
+        what's played, i.e. are_all_points_taken() or will_leader_take_all_tricks().
+        '''
+        assert self.prev_tricks, 'Cannot fast-forward the first trick'
+        while self.is_in_progress():
+            self.play_card(self._any_legal_play())
+
     def will_leader_take_all_tricks(self):
         assert self.current_trick and len(self.current_trick.cards) == 0
         # This could be optimized.
@@ -0,0 +1,48 @@
+import unittest
+
+# capi has to be imported before hearts because they import each other.
+import capi
+from cards import Card
+from hearts import PassInfo, Player, Round, RuleSet, Trick
+
+def cards(s):
+    return [Card.parse(c) for c in s.split()]
+
+
+class TestRound(unittest.TestCase):
+
+    def make_round(self, hands, prev_tricks, leader):
+        rnd = Round(RuleSet(), PassInfo(direction=0, num_cards=0), [0, 0, 0, 0])
+        rnd.players = [Player(hand=cards(h)) for h in hands]
+        rnd.prev_tricks = prev_tricks
+        rnd.current_trick = Trick(leader=leader)
+        return rnd
+
+    def test_play_remaining_tricks_high_cards(self):
+        # Player 2 has the highest card in every suit and hearts aren't broken,
+        # so they have to lead the spade first.
+        rnd = self.make_round(
+            ['2S 3H', '4D 5D', 'AH AS', '2H 3S'],
+            [Trick(leader=0, cards=cards('2C 3C 4C 5C'), winner=3)],
+            leader=2)
+        self.assertTrue(rnd.will_leader_take_all_tricks())
+        self.assertFalse(rnd.are_hearts_broken())
+        rnd.play_remaining_tricks()
+        self.assertTrue(rnd.is_finished())
+        self.assertEqual([t.winner for t in rnd.prev_tricks], [3, 2, 2])
+        self.assertEqual(rnd.prev_tricks[1].cards, cards('AS 3S 2S 4D'))
+        self.assertEqual(rnd.prev_tricks[2].cards, cards('AH 2H 3H 5D'))
+
+    def test_play_remaining_tricks_no_points_left(self):
+        rnd = self.make_round(
+            ['2S 3D', '4D 5D', 'AC AS', '2D 3S'],
+            [Trick(leader=0, cards=cards('2C 3C 4C 5C'), winner=1)],
+            leader=1)
+        self.assertTrue(rnd.are_all_points_taken())
+        rnd.play_remaining_tricks()
+        self.assertTrue(rnd.is_finished())
+        self.assertEqual(sum(len(t.cards) for t in rnd.prev_tricks), 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
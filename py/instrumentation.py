@@ -0,0 +1,119 @@
+'''Opt-in timing of rendering, AI and storage calls. Set the environment
+variable HEARTS_INSTRUMENTATION=1 to enable it; when it's disabled, timed
+functions only pay for checking a flag.
+'''
+
+import collections
+import contextlib
+import functools
+import json
+import math
+import os
+import threading
+import time
+from typing import Dict
+
+ENV_VAR = 'HEARTS_INSTRUMENTATION'
+
+# Percentiles are computed over the most recent samples for each timer.
+MAX_SAMPLES = 1000
+
+
+class Histogram:
+    def __init__(self, max_samples: int = MAX_SAMPLES):
+        self.samples = collections.deque(maxlen=max_samples)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        # Nearest-rank percentile.
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
+
+
+class Instrumentation:
+    def __init__(self, enabled: bool = False, time_fn=time.perf_counter):
+        self.enabled = enabled
+        self.time_fn = time_fn
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Histogram] = collections.OrderedDict()
+
+    def record(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            hist = self._histograms.get(name)
+            if hist is None:
+                hist = self._histograms[name] = Histogram()
+            hist.add(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        start = self.time_fn()
+        try:
+            yield
+        finally:
+            self.record(name, self.time_fn() - start)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {name: h.summary() for name, h in self._histograms.items()}
+
+    def summary_text(self) -> str:
+        '''Returns one line per timer with times in milliseconds.'''
+        lines = []
+        for name, s in self.summary().items():
+            lines.append('%s n=%d p50=%.1f p95=%.1f p99=%.1f max=%.1f' % (
+                name, s['count'], s['p50'] * 1000, s['p95'] * 1000, s['p99'] * 1000,
+                s['max'] * 1000))
+        return '\n'.join(lines)
+
+    def to_json(self) -> str:
+        return json.dumps(self.summary(), indent=2)
+
+    def export(self, path: str):
+        with open(path, 'w') as f:
+            f.write(self.to_json())
+
+
+instrumentation = Instrumentation(enabled=bool(os.environ.get(ENV_VAR)))
+
+
+def timed(name: str):
+    '''Decorator that records the duration of each call under `name` if
+    instrumentation is enabled.'''
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not instrumentation.enabled:
+                return fn(*args, **kwargs)
+            with instrumentation.timer(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,39 @@
+import json
+import unittest
+
+from instrumentation import Histogram, Instrumentation
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_percentiles(self):
+        h = Histogram()
+        for i in range(1, 101):
+            h.add(i / 1000)
+        s = h.summary()
+        self.assertEqual(s['count'], 100)
+        self.assertAlmostEqual(s['p50'], 0.050)
+        self.assertAlmostEqual(s['p95'], 0.095)
+        self.assertAlmostEqual(s['p99'], 0.099)
+        self.assertAlmostEqual(s['max'], 0.100)
+
+    def test_timer(self):
+        now = [0.0]
+        inst = Instrumentation(enabled=True, time_fn=lambda: now[0])
+        with inst.timer('a'):
+            now[0] += 0.25
+        with inst.timer('a'):
+            now[0] += 0.75
+        summary = json.loads(inst.to_json())
+        self.assertEqual(summary['a']['count'], 2)
+        self.assertAlmostEqual(summary['a']['mean'], 0.5)
+
+    def test_disabled(self):
+        inst = Instrumentation(enabled=False)
+        with inst.timer('a'):
+            pass
+        inst.record('b', 0.5)
+        self.assertEqual(inst.summary(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,17 @@
 #!/usr/bin/env python3
 
 import collections
+import copy
 from dataclasses import dataclass
 from enum import Enum, unique
+import os
 import random
 import threading
 import time
 from typing import Dict, Iterable, List, OrderedDict
-import webbrowser
+
+# As close to process start as we can get, for measuring time to first frame.
+STARTUP_TIME = time.time()
 
 from kivy.animation import Animation
 from kivy.app import App
@@ -19,13 +23,15 @@ from kivy.uix.image import Image
 from kivy.uix.label import Label
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.floatlayout import FloatLayout
-from kivy.uix.gridlayout import GridLayout
-from kivy.uix.scrollview import ScrollView
-from kivy.uix.settings import Settings
 
+from ai_executor import AIExecutor
 import capi
+from card_images import CARD_WIDTH_OVER_HEIGHT, CardTextureCache
 from cards import Card, Rank, Suit
 from hearts import Match, Round, RuleSet
+from instrumentation import instrumentation, timed
+from ponder import Ponderer
+from stats import MatchStats, RoundStats, StatsWithAndWithoutJD
 from storage import Storage
 import ui
 
@@ -33,14 +39,16 @@ def debug(*args, **kwargs):
     # print(*args, **kwargs)
     pass
 
-# Card images from https://code.google.com/archive/p/vector-playing-cards/, public domain.
-CARD_WIDTH_OVER_HEIGHT = 500.0 / 726
+MENU_ICON_PATH = 'assets/menu.png'
 
-def card_image_path(c: Card):
-    return f'assets/cards/{c.ascii_string()}.png'
+# Number of hand layouts to keep, enough to cover switching orientation back and forth.
+HAND_LAYOUT_CACHE_SIZE = 4
 
-BLACK_CARD_IMAGE_PATH = 'assets/cards/black.png'
-MENU_ICON_PATH = 'assets/menu.png'
+# Renders that take longer than this many seconds will cause dropped frames.
+RENDER_TIME_BUDGET = 1 / 60
+
+# If set, print the time to first frame and exit. Used by startup_benchmark.py.
+STARTUP_BENCHMARK_ENV_VAR = 'HEARTS_STARTUP_BENCHMARK'
 
 
 # https://kivy.org/doc/stable/api-kivy.uix.behaviors.html
@@ -133,17 +141,36 @@ class HeartsApp(App):
 
     def build(self):
         self.storage = Storage(self.user_data_dir)
+        # Card textures are shared by all card widgets. They're preloaded
+        # after the first frame so they don't delay it.
+        self.card_textures = CardTextureCache()
         self.time_fn = time.time
-        self.sleep_fn = time.sleep
+        # All AI moves run on this executor's worker threads so the UI stays
+        # responsive and animation timers work as expected. Multiple workers
+        # let the AI players choose cards to pass at the same time, and let
+        # pondering on the player's turn run in parallel while a worker stays
+        # free for real AI plays.
+        self.ai_executor = AIExecutor(num_workers=3, time_fn=self.time_fn)
+        self.ponderer = Ponderer(self.ai_executor)
         self.layout = FloatLayout()
         ui.set_rect_background(self.layout, [0, 0.3, 0, 1])
         Window.on_resize = lambda *args: Clock.schedule_once(lambda dt: self.do_resize())
         self.resize_render_event = None
         self.cards_to_pass = set()
+        # Cards chosen by AI players, indexed by player number. These are
+        # computed in the background as soon as a round is dealt.
+        self.ai_cards_to_pass = {}
+        # Set once the player has chosen their cards but AI players haven't.
+        self.confirmed_cards_to_pass = None
         self.ui_mode = UIMode.GAME
         self.autoplay_mode = AutoplayMode.NONE
+        # The most recently loaded stats, which are shown while newer ones load.
         self.round_stats = None
         self.match_stats = None
+        self.stats_stale = True
+        self.stats_loading = False
+        # Incremented when stats are cleared, to ignore loads in progress.
+        self.stats_generation = 0
         self.help_text = None
         self.use_kivy_settings = False
         # Keep track of the last animated card so we don't repeat the animation
@@ -152,35 +179,105 @@ class HeartsApp(App):
         # And where the card the player clicked on should animate from.
         self.played_card_position = None
         self.animating_trick_winner = None
-        self.match = self.storage.load_current_match()
+        self.animating_trick_winner_cards_played = None
+        self.render_trigger = Clock.create_trigger(lambda dt: self.render())
+        self.num_slow_renders = 0
+        # Hand layouts, keyed by hand contents, layout size and whether the
+        # hand is split into two rows. See _hand_card_positions.
+        self.hand_layout_cache = collections.OrderedDict()
+        self.sorted_hand = []
+        self.last_rendered_hand_positions = None
+        self.instrumentation_label = None
+        if instrumentation.enabled:
+            self.start_instrumentation()
+        # Show the empty table right away, and restore the match and load the
+        # AI library in the background. See finish_loading.
+        self.match = None
+        Window.bind(on_flip=self.on_first_frame)
+        threading.Thread(target=self._load_in_background, name='startup', daemon=True).start()
+        return self.layout
+
+    def on_first_frame(self, *args):
+        Window.unbind(on_flip=self.on_first_frame)
+        elapsed = time.time() - STARTUP_TIME
+        debug(f'First frame after {elapsed} seconds')
+        instrumentation.record('startup.first_frame', elapsed)
+        if os.environ.get(STARTUP_BENCHMARK_ENV_VAR):
+            print(f'first_frame_seconds={elapsed:.4f}', flush=True)
+            self.stop()
+            return
+        self.card_textures.preload()
+
+    def _load_in_background(self):
+        match = self.storage.load_current_match()
+        self.finish_loading(match)
+        # The library would be loaded on the first AI request anyway, but
+        # doing it now means that request doesn't have to wait for it.
+        capi.warm_up()
+
+    @mainthread
+    def finish_loading(self, match):
+        instrumentation.record('startup.match_loaded', time.time() - STARTUP_TIME)
         if self.match:
-            Clock.schedule_once(lambda dt: self.render(), 0)
+            # A match was started while loading.
+            return
+        if match:
+            self.match = match
+            self.request_render()
+            rnd = self.match.current_round
+            if rnd and rnd.is_awaiting_pass() and not rnd.players[0].received_cards:
+                self._start_ai_passes(rnd)
             # In case it's an AI opponent's turn.
             self.handle_next_play(1.0)
         else:
-            Clock.schedule_once(lambda dt: self.start_match(), 0)
-        return self.layout
+            self.start_match()
 
     def do_resize(self):
         # When running on a phone, this method is called when the screen
         # orientation changes. Calling render() right away doesn't correctly
         # update the UI; it seems we have to wait a bit for the orientation to
-        # be fully recongized. So we call render() immediately for desktop,
+        # be fully recongized. So we render on the next frame for desktop,
         # and again after a delay, and hopefully at least one of them will work.
-        # Also cancel any previous pending render() so we don't make redundant
+        # Also cancel any previous delayed render so we don't make redundant
         # calls if the size is rapidly changing.
         if self.resize_render_event:
             self.resize_render_event.cancel()
-        self.render()
-        self.resize_render_event = Clock.schedule_once(lambda dt: self.render(), 1)
+        self.request_render()
+        self.resize_render_event = Clock.schedule_once(lambda dt: self.request_render(), 1)
+
+    def start_instrumentation(self):
+        # Frame times, and a corner overlay showing the timing summary.
+        self.instrumentation_label = ui.make_label(
+            text='', font_size=12, halign='left', valign='top',
+            pos_hint={'x': 0.1, 'y': 0.6}, size_hint=(0.8, 0.4), color=[1, 1, 0, 1])
+        Clock.schedule_interval(lambda dt: instrumentation.record('frame', dt), 0)
+
+        def update_overlay(dt):
+            self.instrumentation_label.text = instrumentation.summary_text()
+        Clock.schedule_interval(update_overlay, 1)
+
+    def export_instrumentation(self):
+        if instrumentation.enabled:
+            path = os.path.join(self.user_data_dir, 'instrumentation.json')
+            instrumentation.export(path)
+            debug(f'Wrote instrumentation to {path}')
+
+    def render_instrumentation(self):
+        if self.instrumentation_label:
+            self.layout.add_widget(self.instrumentation_label)
 
     def on_pause(self):
         debug('Pause!')
-        self.storage.store_current_match(self.match)
+        if self.match:
+            self.storage.store_current_match(self.match)
+        self.export_instrumentation()
 
     def on_stop(self):
         debug('Stop!')
-        self.storage.store_current_match(self.match)
+        self.ai_executor.shutdown()
+        if self.match:
+            self.storage.store_current_match(self.match)
+        self.export_instrumentation()
 
     def on_resume(self):
         debug('Resume!')
@@ -203,14 +300,19 @@ class HeartsApp(App):
         self.start_round()
 
     def start_round(self):
+        # Any pending AI work is for the previous round.
+        self.ai_executor.advance_generation()
+        self.ponderer.clear()
         self.match.start_next_round()
         rnd = self.match.current_round
         self.cards_to_pass = set()
+        self.confirmed_cards_to_pass = None
         if rnd.is_awaiting_pass():
             debug(f'Pass direction={rnd.pass_info.direction}')
+            self._start_ai_passes(rnd)
         else:
             self.start_play()
-        self.render()
+        self.request_render()
 
     def player(self):
         return self.match.current_round.players[0]
@@ -227,9 +329,10 @@ class HeartsApp(App):
         # possible that the user could have made a play before the previous
         # animation finished, in which case we should skip this.
         if rnd is not None and rnd.num_cards_played() == expected_cards_played:
+            # render() clears this after animating.
             self.animating_trick_winner = winner
-            self.render()
-            self.animating_trick_winner = None
+            self.animating_trick_winner_cards_played = expected_cards_played
+            self.request_render()
 
     def card_play_animation_duration(self):
         return 0.25 if self.autoplay_mode == AutoplayMode.NONE else 0.1
@@ -271,15 +374,13 @@ class HeartsApp(App):
             self.handle_next_play(self.delay_between_tricks())
         else:
             self.handle_next_play(self.delay_between_cards_in_trick())
-        self.render()
+        self.request_render()
 
     def do_round_finished(self):
         assert self.match.current_round
-        self.round_stats = None
-        self.match_stats = None
+        self.stats_stale = True
         self.autoplay_mode = AutoplayMode.NONE
         self.storage.record_round_stats(self.match.current_round)
-        debug(f'Round stats: {self.storage.load_round_stats()}')
         debug('Round over')
         self.match.finish_round()
         round_scores = self.match.score_history[-1]
@@ -289,8 +390,7 @@ class HeartsApp(App):
             debug(f'Winners: {self.match.winners()}')
             self.storage.record_match_stats(self.match)
             self.storage.remove_current_match()
-            debug(f'Match stats: {self.storage.load_match_stats()}')
-        self.render()
+        self.request_render()
 
     # `min_delay` is the minimum number of seconds to wait before making the
     # next AI play. This is used to allow thinking while the animation for the
@@ -308,14 +408,44 @@ class HeartsApp(App):
             # Only do this on the first play; otherwise render() will
             # incorrectly redraw cards in the last trick that were already
             # animated to the trick winner.
-            self.render()
-        if pnum != 0 or self.autoplay_mode != AutoplayMode.NONE:
-            # Compute the best card to play in a separate thread so the UI
-            # stays responsive and animation timers work as expected.
-            self._make_ai_play_in_thread(rnd, min_delay)
+            self.request_render()
+        if self.autoplay_mode != AutoplayMode.NONE:
+            Clock.schedule_once(lambda dt: self._fast_forward_round(rnd), min_delay)
+        elif pnum != 0:
+            self._request_ai_play(rnd, min_delay)
+        else:
+            self._start_pondering(rnd)
 
-    def _make_ai_play_in_thread(self, rnd: Round, min_delay: float):
-        @mainthread
+    def _fast_forward_round(self, rnd: Round):
+        # The outcome of the round is already determined, so play all the
+        # remaining cards at once and only animate the last trick.
+        if self.match is None or self.match.current_round != rnd or not rnd.is_in_progress():
+            return
+        self.ai_executor.advance_generation()
+        self.ponderer.clear()
+        rnd.play_remaining_tricks()
+        last_trick = rnd.prev_tricks[-1]
+        self.last_animated_card = last_trick.cards[-1]
+        self.animating_trick_winner = last_trick.winner
+        self.animating_trick_winner_cards_played = rnd.num_cards_played()
+        self.request_render()
+        # Leave time to read the autoplay message.
+        def finish_round(dt):
+            if self.match and self.match.current_round == rnd:
+                self.do_round_finished()
+        Clock.schedule_once(finish_round, 1.0 + self.trick_winner_animation_duration())
+
+    def _start_pondering(self, rnd: Round):
+        # While the player is deciding, compute the next opponent's response
+        # to each card they could play.
+        self.ponderer.clear()
+        for card in capi.legal_plays(rnd):
+            hypo = copy.deepcopy(rnd)
+            hypo.play_card(card)
+            if hypo.is_in_progress() and hypo.current_player_index() != 0:
+                self.ponderer.ponder(hypo)
+
+    def _request_ai_play(self, rnd: Round, min_delay: float):
         def play_card_in_main_thread(card):
             debug(f'Main thread: playing {card.symbol_string()}')
             if self.match is None or self.match.current_round != rnd:
@@ -327,26 +457,68 @@ class HeartsApp(App):
                 return
             self.play_card(card)
 
-        def run_ai_thread():
-            t = self.time_fn()
+        def choose_card():
             pnum = rnd.current_player_index()
-            if self.autoplay_mode == AutoplayMode.NONE:
-                best = capi.best_play(rnd)
-            else:
-                lc = capi.legal_plays(rnd)
-                best = lc[0]
+            best = capi.best_play(rnd)
             debug(f'Player {pnum} plays {best.symbol_string()}')
-            elapsed = self.time_fn() - t
+            return best
+
+        @mainthread
+        def handle_ai_result(card, *args):
+            elapsed = self.time_fn() - request_time
             debug(f'AI took {elapsed} seconds')
-            if elapsed < min_delay:
-                self.sleep_fn(min_delay - elapsed)
-            play_card_in_main_thread(best)
+            instrumentation.record('ai.play_latency', elapsed)
+            if not self.ai_executor.is_current(generation):
+                debug(f'AI request superseded')
+                return
+            # Wait for the remainder of `min_delay` on the main thread rather
+            # than sleeping, so the worker can start on the next request.
+            Clock.schedule_once(
+                lambda dt: play_card_in_main_thread(card), max(0, min_delay - elapsed))
+
+        request_time = self.time_fn()
+        # Use the pondered play if we have it, or wait for it if it's in progress.
+        generation = self.ai_executor.generation
+        if self.ponderer.take(rnd, handle_ai_result):
+            debug(f'Using pondered play')
+            return
+        # A new play supersedes any AI request that's still pending.
+        self.ai_executor.advance_generation()
+        self.ponderer.clear()
+        generation = self.ai_executor.submit(choose_card, handle_ai_result)
 
-        t = threading.Thread(target=run_ai_thread)
-        t.daemon = True
-        t.start()
+    def _start_ai_passes(self, rnd: Round):
+        # Choose cards for all AI players concurrently while the player is
+        # choosing theirs.
+        self.ai_cards_to_pass = {}
+
+        @mainthread
+        def store_cards_to_pass(pnum, cards):
+            if self.match is None or self.match.current_round != rnd:
+                return
+            debug(f'Player {pnum} passes {" ".join(c.symbol_string() for c in cards)}')
+            self.ai_cards_to_pass[pnum] = cards
+            self._finish_pass_if_ready()
+
+        def choose_cards_to_pass(pnum):
+            # The executor drops requests that fail, which would leave the
+            # round waiting for this pass forever, so fall back to the same
+            # pass as when there's no shared library.
+            try:
+                return capi.cards_to_pass(rnd, pnum)
+            except Exception as ex:
+                print(f'Choosing cards to pass failed: {ex}')
+                return rnd.players[pnum].hand[:rnd.pass_info.num_cards]
+
+        for pnum in range(1, rnd.rules.num_players):
+            self.ai_executor.submit(
+                lambda pnum=pnum: choose_cards_to_pass(pnum),
+                lambda cards, elapsed, pnum=pnum: store_cards_to_pass(pnum, cards))
 
     def set_or_unset_card_to_pass(self, card):
+        if self.confirmed_cards_to_pass is not None:
+            # Waiting for AI players to choose.
+            return
         if card in self.cards_to_pass:
             self.cards_to_pass.remove(card)
         else:
@@ -354,24 +526,51 @@ class HeartsApp(App):
         if len(self.cards_to_pass) == self.match.current_round.pass_info.num_cards:
             self.pass_cards(self.cards_to_pass)
         else:
-            self.render()
+            self.request_render()
 
     def pass_cards(self, cards):
-        passed_cards = [list(self.cards_to_pass)]
-        for pnum in range(1, self.match.current_round.rules.num_players):
-            pcards = capi.cards_to_pass(self.match.current_round, pnum)
-            debug(f'Player {pnum} passes {" ".join(c.symbol_string() for c in pcards)}')
-            passed_cards.append(pcards)
-        self.match.current_round.pass_cards(passed_cards)
+        self.confirmed_cards_to_pass = list(cards)
+        if not self._finish_pass_if_ready():
+            debug('Waiting for AI players to pass')
+            self.request_render()
+
+    def _finish_pass_if_ready(self):
+        rnd = self.match.current_round
+        nump = rnd.rules.num_players
+        if self.confirmed_cards_to_pass is None or len(self.ai_cards_to_pass) < nump - 1:
+            return False
+        passed_cards = (
+            [self.confirmed_cards_to_pass] + [self.ai_cards_to_pass[p] for p in range(1, nump)])
+        self.confirmed_cards_to_pass = None
+        self.ai_cards_to_pass = {}
+        rnd.pass_cards(passed_cards)
         Clock.schedule_once(lambda dt: self.start_play(), 1.5)
-        self.render()
+        self.request_render()
+        return True
 
     def default_font_size(self):
         return min(self.layout.width, self.layout.height) * 0.07
 
+    def request_render(self):
+        '''Schedules a render for the next frame. Any number of requests before
+        then result in a single render.'''
+        self.render_trigger()
+
+    @timed('render')
     def render(self):
         debug(f'render: {self.layout.width} {self.layout.height}')
+        # Rendering now satisfies any pending request.
+        self.render_trigger.cancel()
+        start = self.time_fn()
+        rnd = self.match.current_round if self.match else None
+        if rnd is None or rnd.num_cards_played() != self.animating_trick_winner_cards_played:
+            # Another card was played since the animation was requested.
+            self.animating_trick_winner = None
         self.layout.clear_widgets()
+        if not self.match:
+            # Still loading, just show the table.
+            self.render_instrumentation()
+            return
         self.render_hand()
         self.render_trick()
         self.render_message()
@@ -379,6 +578,12 @@ class HeartsApp(App):
         self.render_stats()
         self.render_controls()
         self.render_help()
+        self.render_instrumentation()
+        self.animating_trick_winner = None
+        elapsed = self.time_fn() - start
+        if elapsed > RENDER_TIME_BUDGET:
+            self.num_slow_renders += 1
+            debug(f'render took {elapsed} seconds, budget is {RENDER_TIME_BUDGET}')
 
     def _hand_card_positions(self) -> OrderedDict[Card, Rect]:
 
@@ -412,11 +617,27 @@ class HeartsApp(App):
                 x = x_start + ((i + x_offset) * x_incr)
                 positions[c] = Rect(x=x, y=y, width=width_frac, height=height_frac)
 
-        positions = collections.OrderedDict()
         if not self.match.current_round:
+            return collections.OrderedDict()
+        hand = self.match.current_round.players[0].hand
+        two_rows = self.layout.height > self.layout.width and len(hand) > 7
+        key = (frozenset(hand), self.layout.width, self.layout.height, two_rows)
+        positions = self.hand_layout_cache.get(key)
+        if positions is not None:
+            self.hand_layout_cache.move_to_end(key)
             return positions
-        hand = sorted_cards_for_display(self.match.current_round.players[0].hand)
-        if self.layout.height > self.layout.width and len(hand) > 7:
+
+        hand_set = set(hand)
+        prev_sorted = self.sorted_hand
+        if len(prev_sorted) == len(hand) + 1 and hand_set.issubset(prev_sorted):
+            # One card left the hand, so the rest are still in display order.
+            hand = [c for c in prev_sorted if c in hand_set]
+        else:
+            hand = sorted_cards_for_display(hand)
+        self.sorted_hand = hand
+
+        positions = collections.OrderedDict()
+        if two_rows:
             # For an odd number of cards, the top row should have the extra card.
             odd = (len(hand) % 2 == 1)
             split = len(hand) // 2 + (1 if odd else 0)
@@ -428,6 +649,9 @@ class HeartsApp(App):
             add_card_positions(positions, bottom_cards, y=0.05, x_offset=0.5 if odd else 0)
         else:
             add_card_positions(positions, hand)
+        self.hand_layout_cache[key] = positions
+        while len(self.hand_layout_cache) > HAND_LAYOUT_CACHE_SIZE:
+            self.hand_layout_cache.popitem(last=False)
         return positions
 
     def _hand_card_opacities(self) -> Dict[Card, float]:
@@ -450,24 +674,40 @@ class HeartsApp(App):
                 return {c: 0.6 for c in self.player().hand}
         return {}
 
+    @timed('render.hand')
     def render_hand(self):
         if not self.match.current_round:
             return
         positions = self._hand_card_positions()
         opacities = self._hand_card_opacities()
+        # If a card was just removed from the hand, slide the remaining cards
+        # from where they were to their new positions.
+        prev_positions = self.last_rendered_hand_positions
+        slide = (
+            prev_positions is not None and
+            len(prev_positions) == len(positions) + 1 and
+            all(c in prev_positions for c in positions))
+        self.last_rendered_hand_positions = positions
         for card, rect in positions.items():
             pos = {'x': rect.x, 'y': rect.y}
             size = (rect.width, rect.height)
-            img_path = card_image_path(card)
+            # Dim by tinting the texture, which looks the same as drawing the
+            # card partially transparent over a black card but needs one widget.
             opacity = opacities.get(card, 1.0)
-            if opacity < 1.0:
-                black = Image(source=BLACK_CARD_IMAGE_PATH, size_hint=size, pos_hint=pos)
-                self.layout.add_widget(black)
-            img = ImageButton(source=img_path, size_hint=size, pos_hint=pos)
-            img.opacity = opacity
+            start_rect = prev_positions[card] if slide else rect
+            img = ImageButton(
+                texture=self.card_textures.texture(card),
+                size_hint=(start_rect.width, start_rect.height),
+                pos_hint={'x': start_rect.x, 'y': start_rect.y},
+                color=[opacity, opacity, opacity, 1])
             img.bind(on_press=lambda b, c=card: self.handle_card_click(c))
             self.layout.add_widget(img)
+            if start_rect != rect:
+                anim = Animation(pos_hint=pos, size_hint=size, t='out_cubic',
+                    duration=self.card_play_animation_duration())
+                anim.start(img)
 
+    @timed('render.trick')
     def render_trick(self):
         if not self.match.current_round:
             return
@@ -486,7 +726,7 @@ class HeartsApp(App):
             ]
             end_positions = [[0.4, 0.35], [0.1, 0.55], [0.4, 0.75], [0.7, 0.55]]
             for i, card in enumerate(ct.cards):
-                img_path = card_image_path(card)
+                texture = self.card_textures.texture(card)
                 pnum = (ct.leader + i) % self.match.current_round.rules.num_players
                 end_pos = (
                     end_positions[pnum][0] * self.layout.width,
@@ -499,14 +739,14 @@ class HeartsApp(App):
                     start_pos = (
                         start_positions[pnum][0]() * self.layout.width,
                         start_positions[pnum][1]() * self.layout.height)
-                    img = ImageButton(source=img_path, pos=start_pos, size_hint=(0.2, 0.2))
+                    img = ImageButton(texture=texture, pos=start_pos, size_hint=(0.2, 0.2))
                     self.layout.add_widget(img)
                     anim = Animation(x=end_pos[0], y=end_pos[1], t='out_cubic',
                         duration=self.card_play_animation_duration())
                     anim.start(img)
                     self.last_animated_card = card
                 else:
-                    img = ImageButton(source=img_path, pos=end_pos, size_hint=(0.2, 0.2))
+                    img = ImageButton(texture=texture, pos=end_pos, size_hint=(0.2, 0.2))
                     self.layout.add_widget(img)
                     if self.animating_trick_winner is not None:
                         # Animate to trick winner's position.
@@ -521,6 +761,7 @@ class HeartsApp(App):
                         anim.start(img)
 
 
+    @timed('render.message')
     def render_message(self):
         def get_message():
             if self.ui_mode != UIMode.GAME:
@@ -545,6 +786,7 @@ class HeartsApp(App):
             ui.set_round_rect_background(pass_label, [0, 0, 0, 0.5], 20)
             self.layout.add_widget(pass_label)
 
+    @timed('render.score')
     def render_score(self):
         if self.ui_mode != UIMode.GAME:
             return
@@ -627,6 +869,7 @@ class HeartsApp(App):
                         debug(f'Illegal play!')
         return True
 
+    @timed('render.controls')
     def render_controls(self):
         if self.ui_mode == UIMode.MENU:
             self.render_menu()
@@ -675,7 +918,7 @@ class HeartsApp(App):
 
         def show_stats():
             self.ui_mode = UIMode.STATS
-            self.render()
+            self.request_render()
 
         resume_button = Button(text=localize('Statistics'), font_size=font_size)
         resume_button.bind(on_release=lambda *args: show_stats())
@@ -683,24 +926,57 @@ class HeartsApp(App):
 
         def show_help():
             self.ui_mode = UIMode.HELP
-            self.render()
+            self.request_render()
 
         help_button = Button(text=localize('About / Help'), font_size=font_size)
         help_button.bind(on_release=lambda *args: show_help())
         menu_container.add_widget(help_button)
 
 
+    def start_loading_stats(self):
+        # Reading the history files can take a while, so do it in the
+        # background and update the stats screen as results come in.
+        self.stats_stale = False
+        self.stats_loading = True
+        generation = self.stats_generation
+
+        def load():
+            match_stats = self.storage.load_match_stats(
+                on_progress=lambda s: self.update_stats(generation, match_stats=s))
+            self.update_stats(generation, match_stats=match_stats)
+            round_stats = self.storage.load_round_stats(
+                on_progress=lambda s: self.update_stats(generation, round_stats=s))
+            self.update_stats(generation, round_stats=round_stats, done=True)
+
+        threading.Thread(target=load, name='stats', daemon=True).start()
+
+    @mainthread
+    def update_stats(self, generation, round_stats=None, match_stats=None, done=False):
+        if generation != self.stats_generation:
+            return
+        if round_stats:
+            self.round_stats = round_stats
+        if match_stats:
+            self.match_stats = match_stats
+        if done:
+            self.stats_loading = False
+        if self.ui_mode in [UIMode.STATS, UIMode.STATS_CLEARING]:
+            self.request_render()
+
+    @timed('render.stats')
     def render_stats(self):
         if self.ui_mode != UIMode.STATS and self.ui_mode != UIMode.STATS_CLEARING:
             return
-        if self.round_stats is None:
-            self.round_stats = self.storage.load_round_stats()
-        if self.match_stats is None:
-            self.match_stats = self.storage.load_match_stats()
-        round_jd = self.round_stats.stats_with_jd
-        round_nojd = self.round_stats.stats_without_jd
-        match_jd = self.match_stats.stats_with_jd
-        match_nojd = self.match_stats.stats_without_jd
+        if self.stats_stale and not self.stats_loading:
+            self.start_loading_stats()
+        # Show zeros until the first results arrive, which is normally right
+        # away since the totals are cached.
+        round_stats = self.round_stats or StatsWithAndWithoutJD(RoundStats(), RoundStats())
+        match_stats = self.match_stats or StatsWithAndWithoutJD(MatchStats(), MatchStats())
+        round_jd = round_stats.stats_with_jd
+        round_nojd = round_stats.stats_without_jd
+        match_jd = match_stats.stats_with_jd
+        match_nojd = match_stats.stats_without_jd
 
         def avg_str(fmt, n, d):
             return '--' if d == 0 else (fmt % (n / d))
@@ -795,22 +1071,25 @@ class HeartsApp(App):
 
         def close_stats():
             self.ui_mode = UIMode.GAME
-            self.render()
+            self.request_render()
 
         def ask_to_clear_stats():
             self.ui_mode = UIMode.STATS_CLEARING
-            self.render()
+            self.request_render()
 
         def cancel_clear_stats():
             self.ui_mode = UIMode.STATS
-            self.render()
+            self.request_render()
 
         def confirm_clear_stats():
             self.storage.clear_stats()
+            self.stats_generation += 1
             self.round_stats = None
             self.match_stats = None
+            self.stats_stale = False
+            self.stats_loading = False
             self.ui_mode = UIMode.STATS
-            self.render()
+            self.request_render()
 
         button_y_pos = button_height_frac / 6
         button_height = button_height_frac * 2 / 3
@@ -863,12 +1142,13 @@ class HeartsApp(App):
 
     def show_menu(self):
         self.ui_mode = UIMode.MENU
-        self.render()
+        self.request_render()
 
     def return_to_game(self):
         self.ui_mode = UIMode.GAME
-        self.render()
+        self.request_render()
 
+    @timed('render.help')
     def render_help(self):
         if self.ui_mode != UIMode.HELP:
             return
@@ -886,6 +1166,10 @@ class HeartsApp(App):
             with open('assets/about.txt') as f:
                 self.help_text = f.read()
 
+        # Only needed for the help screen, so not imported at startup.
+        from kivy.uix.scrollview import ScrollView
+        import webbrowser
+
         def handle_ref_click(instance, ref):
             debug(f'Clicked on ref: {ref}')
             if ref == 'source':
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+# Packs the card images into a Kivy atlas so that the app can load all cards
+# with a few texture uploads instead of one per card. Run from the `py`
+# directory before running the app or building with buildozer:
+#   python make_atlas.py
+# The output files are assets/card_atlas.atlas and assets/card_atlas-N.png.
+
+import argparse
+import sys
+
+from kivy.atlas import Atlas
+
+from card_images import CARD_ATLAS_PATH, card_atlas_key, card_image_path
+from cards import Card, Rank, Suit
+
+def main():
+    parser = argparse.ArgumentParser()
+    # Many older Android GPUs can't use textures larger than 2048x2048. That fits
+    # 8 cards per page at full resolution, so the deck needs 7 pages.
+    parser.add_argument('--size', type=int, default=2048, help='Width and height of atlas pages')
+    parser.add_argument('--padding', type=int, default=2)
+    args = parser.parse_args()
+
+    cards = [Card(rank=r, suit=s) for s in Suit for r in Rank]
+    # Atlas keys are file names without the extension, which card_atlas_key relies on.
+    assert all(card_image_path(c).endswith(f'/{card_atlas_key(c)}.png') for c in cards)
+    outname = CARD_ATLAS_PATH[:-len('.atlas')]
+    result = Atlas.create(
+        outname, [card_image_path(c) for c in cards], args.size, padding=args.padding)
+    if not result:
+        print('Failed to create card atlas')
+        sys.exit(1)
+    filename, meta = result
+    print(f'Wrote {filename} with {len(meta)} pages')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# Generates the pass table that capi.cards_to_pass uses for a rule set; see
+# pass_table.py. Samples random hands and runs the simulation pass strategy
+# for each hand class that hasn't been seen yet, so the classes that come up
+# most often are covered first. Requires the shared library. Run from the
+# `py` directory, for example:
+#   python make_pass_table.py --hands 200000 --jd-minus-10
+# With the default of 200000 hands per direction there are about 55000
+# classes per direction, which covers about 87% of hands. That takes many
+# hours, so use --threads on a machine with more cores.
+#
+# Afterwards the table is checked on new hands that it covers: each table
+# pass is compared with a simulation for the hand itself, and for reference
+# two simulations for the same hand are compared with each other, since the
+# simulation doesn't always choose the same cards. In a trial with 1500 hands
+# per direction and 200 deals per pass, table passes shared 53% of their cards
+# with a simulation, against 72% for two simulations, so a table is faster
+# than simulating but not as good.
+
+import argparse
+import os
+import sys
+import time
+
+import capi
+from cards import Deck
+from hearts import PassInfo, RuleSet
+import pass_table
+
+def random_hand(rules):
+    deck = Deck()
+    deck.shuffle()
+    return deck.deal(rules.num_players)[0]
+
+
+def cards_in_common(a, b) -> int:
+    return len(set(a) & set(b))
+
+
+def validate(table, rules, strategy, num_hands: int):
+    '''Prints how often the table's passes for `num_hands` random hands that
+    it covers agree with simulations for the hands.'''
+    table_matches = 0
+    sim_matches = 0
+    num_checked = 0
+    scores = [0] * rules.num_players
+    while num_checked < num_hands:
+        direction = num_checked % (rules.num_players - 1) + 1
+        pass_info = PassInfo(direction=direction, num_cards=pass_table.NUM_CARDS)
+        hand = random_hand(rules)
+        table_cards = table.lookup(hand, direction)
+        if not table_cards:
+            continue
+        sim1 = capi.cards_to_pass_for_hand(rules, scores, 0, hand, pass_info, strategy)
+        sim2 = capi.cards_to_pass_for_hand(rules, scores, 0, hand, pass_info, strategy)
+        table_matches += cards_in_common(table_cards, sim1)
+        sim_matches += cards_in_common(sim1, sim2)
+        num_checked += 1
+    num_cards = num_hands * pass_table.NUM_CARDS
+    print(f'Checked {num_hands} new hands: {100 * table_matches / num_cards:.1f}% of table '
+          f'cards match a simulation, and {100 * sim_matches / num_cards:.1f}% of cards '
+          f'match between two simulations')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hands', type=int, default=200000, help='Hands to sample per direction')
+    parser.add_argument('--deals', type=int, default=1000, help='Deals to simulate for each pass')
+    parser.add_argument('--threads', type=int, default=0, help='Simulation threads, 0 for one per core')
+    parser.add_argument('--points-on-first-trick', action='store_true')
+    parser.add_argument('--queen-breaks-hearts', action='store_true')
+    parser.add_argument('--jd-minus-10', action='store_true')
+    parser.add_argument('--shooting-disabled', action='store_true')
+    parser.add_argument('--output-dir', default=pass_table.PASS_TABLE_DIR)
+    parser.add_argument('--validate-hands', type=int, default=300,
+                        help='New hands to check the table on, 0 to skip')
+    args = parser.parse_args()
+
+    if not capi.get_lib():
+        sys.exit(1)
+    rules = RuleSet(
+        points_on_first_trick=args.points_on_first_trick,
+        queen_breaks_hearts=args.queen_breaks_hearts,
+        jd_minus_10=args.jd_minus_10,
+        shooting_disabled=args.shooting_disabled,
+    )
+    strategy = {**pass_table.STRATEGY, 'num_deals': args.deals, 'threads': args.threads,
+                'time_limit_ms': 0}
+    entries = {}
+    num_unencodable = 0
+    start_time = time.time()
+    for direction in range(1, rules.num_players):
+        pass_info = PassInfo(direction=direction, num_cards=pass_table.NUM_CARDS)
+        seen = set()
+        for _ in range(args.hands):
+            hand = random_hand(rules)
+            key = pass_table.hand_key(hand, direction)
+            if key in seen:
+                continue
+            seen.add(key)
+            cards = capi.cards_to_pass_for_hand(
+                rules, [0] * rules.num_players, 0, hand, pass_info, strategy)
+            encoded = pass_table.encode_pass(hand, cards)
+            if encoded is None:
+                num_unencodable += 1
+            else:
+                entries[key] = encoded
+            if len(seen) % 1000 == 0:
+                print(f'Direction {direction}: {len(seen)} classes, {time.time() - start_time:.0f} seconds')
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, pass_table.table_filename(rules))
+    pass_table.write_table(path, entries)
+    print(f'Wrote {len(entries)} passes to {path}, skipped {num_unencodable} that only apply to one hand')
+    if args.validate_hands > 0:
+        validate(pass_table.PassTable(path), rules, strategy, args.validate_hands)
+
+
+if __name__ == '__main__':
+    main()
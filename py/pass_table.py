@@ -0,0 +1,182 @@
+'''Precomputed passes for classes of similar hands, so that passing doesn't
+need a search. make_pass_table.py generates a table for a rule set by running
+STRATEGY on sampled hands, and capi.cards_to_pass looks hands up in it before
+running STRATEGY itself in the shared library.
+
+A hand's class keeps the exact ranks of its high cards in each suit and the
+number of lower cards, up to LOW_CARD_LIMIT, along with whether it has 2C.
+Passes are stored as positions within suits counting down from the highest
+card, so a pass for one hand applies to every hand in its class. Tables only
+cover 4 players passing 3 cards with a full deck, and assume scores of 0.
+
+File format, little-endian: the 4 bytes MAGIC, a uint32 record count, then
+records sorted by key. Each record is a uint32 hand class key followed by one
+byte per passed card, (suit index * 16 + position), and a padding byte.
+'''
+
+import mmap
+import os
+import struct
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from cards import Card, Rank, Suit
+
+MAGIC = b'HPT2'
+HEADER = struct.Struct('<4sI')
+RECORD = struct.Struct('<I3Bx')
+
+NUM_PLAYERS = 4
+NUM_CARDS = 3
+
+PASS_TABLE_DIR = 'assets/pass_tables'
+
+# The pass strategy that tables are generated with, and that's used for
+# hands whose class isn't in the table.
+STRATEGY = {'name': 'simulation'}
+
+SUITS = [Suit.SPADES, Suit.HEARTS, Suit.DIAMONDS, Suit.CLUBS]
+# Cards at or above these ranks are part of the hand class exactly. The
+# queen and everything above it matter for spades and hearts, while in the
+# minor suits only the cards that are likely to win tricks are kept.
+MIN_HIGH_RANK = {
+    Suit.SPADES: Rank.QUEEN,
+    Suit.HEARTS: Rank.QUEEN,
+    Suit.DIAMONDS: Rank.KING,
+    Suit.CLUBS: Rank.KING,
+}
+# Lower cards are counted up to this many, so a suit with 6 low cards is in the
+# same class as one with more. Suit length matters a lot for passing, for
+# example whether QS is safe to keep. Must fit in 3 bits.
+LOW_CARD_LIMIT = 6
+
+
+def table_filename(rules) -> str:
+    '''Returns the name of the table file for `rules`, without the directory.
+    The point limit doesn't matter because tables are generated with scores of 0.'''
+    flags = []
+    if rules.points_on_first_trick:
+        flags.append('p1')
+    if rules.queen_breaks_hearts:
+        flags.append('qb')
+    if rules.jd_minus_10:
+        flags.append('jd')
+    if rules.shooting_disabled:
+        flags.append('sd')
+    return '_'.join(['pass_table'] + flags) + '.bin'
+
+
+def applies_to_rules(rules) -> bool:
+    return rules.num_players == NUM_PLAYERS and not rules.removed_cards
+
+
+def _suit_ranks(hand: Iterable[Card], suit: Suit) -> List[Rank]:
+    return sorted((c.rank for c in hand if c.suit == suit), reverse=True)
+
+
+def _num_high_cards(ranks: List[Rank], suit: Suit) -> int:
+    return sum(1 for r in ranks if r >= MIN_HIGH_RANK[suit])
+
+
+def hand_key(hand: Iterable[Card], direction: int) -> int:
+    '''Returns the key for the class of `hand` when passing in `direction`.'''
+    hand = list(hand)
+    key = direction
+    for suit in SUITS:
+        ranks = _suit_ranks(hand, suit)
+        high_bits = 0
+        for r in ranks:
+            if r >= MIN_HIGH_RANK[suit]:
+                high_bits |= 1 << (Rank.ACE.rank_val - r.rank_val)
+        num_low = min(len(ranks) - _num_high_cards(ranks, suit), LOW_CARD_LIMIT)
+        key = (key << 6) | (high_bits << 3) | num_low
+    has_2c = any(c.suit == Suit.CLUBS and c.rank == Rank.TWO for c in hand)
+    return (key << 1) | int(has_2c)
+
+
+def encode_pass(hand: Iterable[Card], cards: Iterable[Card]) -> Optional[bytes]:
+    '''Returns the stored form of passing `cards` from `hand`, or None if the
+    pass can't be applied to every hand in the class, which happens when it
+    includes a low card below the ones that are counted.'''
+    hand = list(hand)
+    encoded = []
+    for c in cards:
+        ranks = _suit_ranks(hand, c.suit)
+        position = ranks.index(c.rank)
+        if position >= _num_high_cards(ranks, c.suit) + LOW_CARD_LIMIT:
+            return None
+        encoded.append(SUITS.index(c.suit) * 16 + position)
+    return bytes(encoded)
+
+
+def decode_pass(hand: Iterable[Card], encoded: bytes) -> List[Card]:
+    hand = list(hand)
+    cards = []
+    for b in encoded:
+        suit = SUITS[b // 16]
+        cards.append(Card(rank=_suit_ranks(hand, suit)[b % 16], suit=suit))
+    return cards
+
+
+def write_table(path: str, entries: Dict[int, bytes]):
+    '''Writes `entries`, which map hand class keys to encoded passes.'''
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(entries)))
+        for key in sorted(entries):
+            f.write(RECORD.pack(key, *entries[key]))
+
+
+class PassTable:
+    '''A table file that's memory mapped, so opening it is fast and it takes
+    no memory beyond the pages that lookups touch.'''
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.num_records = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or len(self.data) != HEADER.size + self.num_records * RECORD.size:
+            self.data.close()
+            raise ValueError(f'Invalid pass table: {path}')
+
+    def close(self):
+        self.data.close()
+
+    def _record(self, index: int):
+        return RECORD.unpack_from(self.data, HEADER.size + index * RECORD.size)
+
+    def lookup(self, hand: List[Card], direction: int) -> Optional[List[Card]]:
+        '''Returns the cards to pass from `hand`, or None if its class isn't in the table.'''
+        if len(hand) != 52 // NUM_PLAYERS:
+            return None
+        key = hand_key(hand, direction)
+        lo, hi = 0, self.num_records
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._record(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self.num_records:
+            return None
+        record = self._record(lo)
+        if record[0] != key:
+            return None
+        return decode_pass(hand, bytes(record[1:]))
+
+
+_tables: Dict[str, Optional[PassTable]] = {}
+_tables_lock = threading.Lock()
+
+def table_for_rules(rules, table_dir: Optional[str] = None) -> Optional[PassTable]:
+    '''Returns the table for `rules` in `table_dir` or PASS_TABLE_DIR, opening
+    it on first use, or None if there isn't one. Safe to call from several threads.'''
+    if not applies_to_rules(rules):
+        return None
+    path = os.path.join(table_dir or PASS_TABLE_DIR, table_filename(rules))
+    with _tables_lock:
+        if path not in _tables:
+            try:
+                _tables[path] = PassTable(path)
+            except (OSError, ValueError):
+                _tables[path] = None
+        return _tables[path]
@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+# capi has to be imported before hearts because they import each other.
+import capi
+from cards import Card
+from hearts import PassInfo, Round, RuleSet, Player
+import pass_table
+
+def cards(s):
+    return [Card.parse(c) for c in s.split()]
+
+
+class TestPassTable(unittest.TestCase):
+
+    def make_table_dir(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        return tmpdir.name
+
+    def test_hand_key(self):
+        hand = cards('AS QS 4S AH 8H 2H 7D 6D 5D 4D KC 6C 2C')
+        # Different low cards.
+        same_class = cards('AS QS 9S AH TH 3H JD 8D 7D 3D KC 7C 2C')
+        self.assertEqual(pass_table.hand_key(hand, 1), pass_table.hand_key(same_class, 1))
+        # More low diamonds and clubs than are counted.
+        long_diamonds = cards('QD JD 9D 8D 7D 6D 5D 7C 6C 5C 4C 3C 2C')
+        long_clubs = cards('QD JD 9D 8D 7D 6D 8C 7C 6C 5C 4C 3C 2C')
+        self.assertEqual(
+            pass_table.hand_key(long_diamonds, 1), pass_table.hand_key(long_clubs, 1))
+        # QS with 3 low spades isn't the same as QS with more.
+        short_spades = cards('QS 9S 5S 4S AH 8H 2H 7D 6D 5D KC 6C 2C')
+        long_spades = cards('QS 9S 6S 5S 4S 3S 2S 7D 6D 5D KC 6C 2C')
+        self.assertNotEqual(
+            pass_table.hand_key(short_spades, 1), pass_table.hand_key(long_spades, 1))
+        self.assertNotEqual(pass_table.hand_key(hand, 1), pass_table.hand_key(hand, 3))
+        no_2c = cards('AS QS 4S AH 8H 2H 7D 6D 5D 4D KC 6C 3C')
+        self.assertNotEqual(pass_table.hand_key(hand, 1), pass_table.hand_key(no_2c, 1))
+        ks = cards('AS KS 4S AH 8H 2H 7D 6D 5D 4D KC 6C 2C')
+        self.assertNotEqual(pass_table.hand_key(hand, 1), pass_table.hand_key(ks, 1))
+
+    def test_encode_pass(self):
+        hand = cards('AS QS 4S AH 8H 2H 7D 6D 5D 4D KC 6C 2C')
+        encoded = pass_table.encode_pass(hand, cards('QS AH 7D'))
+        self.assertEqual(pass_table.decode_pass(hand, encoded), cards('QS AH 7D'))
+        same_class = cards('AS QS 9S AH TH 3H JD 8D 7D 3D KC 3C 2C')
+        self.assertEqual(pass_table.decode_pass(same_class, encoded), cards('QS AH JD'))
+        # 5D is below the 6 low diamonds that are counted.
+        long_diamonds = cards('QS 4S QD JD 9D 8D 7D 6D 5D 4D 3D 3C 2C')
+        self.assertIsNotNone(pass_table.encode_pass(long_diamonds, cards('QS 6D 3C')))
+        self.assertIsNone(pass_table.encode_pass(long_diamonds, cards('QS 5D 3C')))
+
+    def test_lookup(self):
+        table_dir = self.make_table_dir()
+        hand = cards('AS QS 4S AH 8H 2H 6D 5D 4D KC 6C 5C 2C')
+        rules = RuleSet(jd_minus_10=True)
+        path = os.path.join(table_dir, pass_table.table_filename(rules))
+        pass_table.write_table(path, {
+            pass_table.hand_key(hand, 1): pass_table.encode_pass(hand, cards('AS QS AH')),
+            pass_table.hand_key(hand, 2): pass_table.encode_pass(hand, cards('QS AH KC')),
+        })
+        table = pass_table.table_for_rules(rules, table_dir)
+        self.assertEqual(table.lookup(hand, 1), cards('AS QS AH'))
+        self.assertEqual(table.lookup(hand, 2), cards('QS AH KC'))
+        self.assertIsNone(table.lookup(hand, 3))
+        self.assertIsNone(table.lookup(cards('KS QS 4S AH 8H 2H 6D 5D 4D KC 6C 5C 2C'), 1))
+        # No table for other rules.
+        self.assertIsNone(pass_table.table_for_rules(RuleSet(), table_dir))
+        self.assertIsNone(pass_table.table_for_rules(RuleSet(num_players=3), table_dir))
+
+    def test_invalid_table(self):
+        table_dir = self.make_table_dir()
+        rules = RuleSet(queen_breaks_hearts=True)
+        with open(os.path.join(table_dir, pass_table.table_filename(rules)), 'wb') as f:
+            f.write(b'not a pass table')
+        self.assertIsNone(pass_table.table_for_rules(rules, table_dir))
+
+    def test_cards_to_pass_uses_table(self):
+        table_dir = self.make_table_dir()
+        hand = cards('AS QS 4S AH 8H 2H 6D 5D 4D KC 6C 5C 2C')
+        rules = RuleSet(points_on_first_trick=True)
+        path = os.path.join(table_dir, pass_table.table_filename(rules))
+        pass_table.write_table(path, {
+            pass_table.hand_key(hand, 1): pass_table.encode_pass(hand, cards('6D 5D 4D')),
+        })
+        orig_dir = pass_table.PASS_TABLE_DIR
+        pass_table.PASS_TABLE_DIR = table_dir
+        self.addCleanup(setattr, pass_table, 'PASS_TABLE_DIR', orig_dir)
+        rnd = Round(rules, PassInfo(direction=1, num_cards=3), [0, 0, 0, 0])
+        rnd.players[2] = Player(hand=hand)
+        self.assertEqual(capi.cards_to_pass(rnd, 2), cards('6D 5D 4D'))
+
+        # The table assumes scores of 0 and the default strategy.
+        rnd.scores_before_round = [0, 50, 0, 0]
+        self.assertNotEqual(capi.cards_to_pass(rnd, 2), cards('6D 5D 4D'))
+        rnd.scores_before_round = [0, 0, 0, 0]
+        self.assertNotEqual(
+            capi.cards_to_pass(rnd, 2, {'name': 'heuristic'}), cards('6D 5D 4D'))
+
+        # Hands that aren't in the table use the strategy the table was made with.
+        rnd.players[3] = Player(hand=cards('KS QS 4S AH 8H 2H 6D 5D 4D KC 6C 5C 3C'))
+        with mock.patch.object(capi, 'cards_to_pass_for_hand', return_value=[]) as direct:
+            capi.cards_to_pass(rnd, 3)
+        self.assertEqual(direct.call_args.args[-1], pass_table.STRATEGY)
+
+
+if __name__ == '__main__':
+    unittest.main()
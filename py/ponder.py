@@ -0,0 +1,93 @@
+import threading
+from typing import Callable, Dict, List
+
+from ai_executor import AIExecutor, PRIORITY_SPECULATIVE
+import capi
+from cards import Card
+from hearts import Round
+
+def debug(*args, **kwargs):
+    # print(*args, **kwargs)
+    pass
+
+
+class Ponderer:
+    '''Speculatively computes AI plays for positions that might come up next,
+    so that the AI can respond immediately when one of them does.
+
+    Positions are keyed by the JSON request that `capi.best_play` would send,
+    which contains everything the AI sees. Work runs on `executor` at
+    speculative priority, which leaves a worker free for real AI requests.
+    '''
+    def __init__(self, executor: AIExecutor,
+                 best_play_fn: Callable[[Round], Card] = capi.best_play,
+                 key_fn: Callable[[Round], bytes] = capi.json_bytes_for_round):
+        self.executor = executor
+        self.best_play_fn = best_play_fn
+        self.key_fn = key_fn
+        self._lock = threading.Lock()
+        self._results: Dict[bytes, Card] = {}
+        # Keys that have been submitted but haven't finished.
+        self._pending = set()
+        self._waiters: Dict[bytes, List[Callable[[Card], None]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        '''Discards all results. Pending computations will skip themselves if
+        they haven't started, and their results will be ignored otherwise.'''
+        with self._lock:
+            self._results.clear()
+            self._pending.clear()
+            self._waiters.clear()
+
+    def ponder(self, rnd: Round):
+        '''Starts computing the AI play for the current player in `rnd`.
+        `rnd` must not be modified afterwards.'''
+        key = self.key_fn(rnd)
+        with self._lock:
+            if key in self._results or key in self._pending:
+                return
+            self._pending.add(key)
+
+        def compute():
+            with self._lock:
+                if key not in self._pending:
+                    return None
+            return self.best_play_fn(rnd)
+
+        def store_result(card, elapsed):
+            with self._lock:
+                if card is None or key not in self._pending:
+                    return
+                debug(f'Pondered {card} in {elapsed} seconds')
+                self._pending.discard(key)
+                self._results[key] = card
+                waiters = self._waiters.pop(key, [])
+            for w in waiters:
+                w(card)
+
+        self.executor.submit(compute, store_result, priority=PRIORITY_SPECULATIVE)
+
+    def take(self, rnd: Round, callback: Callable[[Card], None]) -> bool:
+        '''If the AI play for `rnd` has been pondered, calls `callback` with
+        it and returns True. If it's still being computed, arranges for
+        `callback` to be called when it finishes, cancels all other pondering,
+        and returns True. Otherwise returns False and the caller should compute
+        the play itself. `callback` may be called on a worker thread.'''
+        key = self.key_fn(rnd)
+        with self._lock:
+            card = self._results.get(key)
+            if card is None and key in self._pending:
+                # Other positions can no longer occur, so stop working on them.
+                self._pending = {key}
+                self._results.clear()
+                self._waiters.setdefault(key, []).append(callback)
+                self.hits += 1
+                return True
+            if card is None:
+                self.misses += 1
+                return False
+            self.hits += 1
+        callback(card)
+        return True
@@ -0,0 +1,58 @@
+import threading
+import unittest
+
+from ai_executor import AIExecutor
+from ponder import Ponderer
+
+class TestPonderer(unittest.TestCase):
+
+    def make_ponderer(self, best_play_fn):
+        executor = AIExecutor()
+        self.addCleanup(executor.shutdown)
+        # "Rounds" are just strings here; the key is the string itself.
+        return Ponderer(executor, best_play_fn=best_play_fn, key_fn=lambda r: r)
+
+    def test_uses_pondered_result(self):
+        calls = []
+        ponderer = self.make_ponderer(lambda r: calls.append(r) or r.upper())
+        done = threading.Event()
+        results = []
+
+        def callback(card):
+            results.append(card)
+            done.set()
+
+        ponderer.ponder('a')
+        ponderer.ponder('a')
+        self.assertTrue(ponderer.take('a', callback))
+        self.assertTrue(done.wait(5))
+        self.assertEqual(results, ['A'])
+        self.assertEqual(calls, ['a'])
+        self.assertFalse(ponderer.take('b', callback))
+        self.assertEqual((ponderer.hits, ponderer.misses), (1, 1))
+
+    def test_take_cancels_other_positions(self):
+        release = threading.Event()
+        calls = []
+
+        def best_play(r):
+            calls.append(r)
+            release.wait(5)
+            return r.upper()
+
+        ponderer = self.make_ponderer(best_play)
+        done = threading.Event()
+        results = []
+        ponderer.ponder('a')
+        ponderer.ponder('b')
+        ponderer.ponder('c')
+        self.assertTrue(ponderer.take('a', lambda card: results.append(card) or done.set()))
+        release.set()
+        self.assertTrue(done.wait(5))
+        self.assertEqual(results, ['A'])
+        # 'b' and 'c' were queued behind 'a' and skipped once 'a' was taken.
+        self.assertEqual(calls, ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
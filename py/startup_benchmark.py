@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+# Measures how long the app takes to draw its first frame. Runs the app
+# several times from the `py` directory with HEARTS_STARTUP_BENCHMARK set,
+# which makes it print the time to first frame and exit:
+#   python startup_benchmark.py --runs 5
+# The first run is usually slower because files aren't in the OS cache yet,
+# which is closer to what users see on a cold start.
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Same as in main.py, which can't be imported here because importing Kivy's
+# window module opens a window.
+STARTUP_BENCHMARK_ENV_VAR = 'HEARTS_STARTUP_BENCHMARK'
+OUTPUT_PREFIX = 'first_frame_seconds='
+
+def run_once(timeout: float):
+    '''Returns (seconds to first frame as reported by the app, seconds until
+    the process exited), or None if the app didn't report a first frame.'''
+    env = dict(os.environ)
+    env[STARTUP_BENCHMARK_ENV_VAR] = '1'
+    start = time.time()
+    proc = subprocess.run(
+        [sys.executable, 'main.py'], env=env, capture_output=True, text=True, timeout=timeout)
+    total = time.time() - start
+    for line in proc.stdout.splitlines():
+        if line.startswith(OUTPUT_PREFIX):
+            return float(line[len(OUTPUT_PREFIX):]), total
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=60, help='Seconds to wait for each run')
+    args = parser.parse_args()
+
+    first_frame_times = []
+    for i in range(args.runs):
+        result = run_once(args.timeout)
+        if result is None:
+            print(f'Run {i + 1}: app did not report a first frame')
+            sys.exit(1)
+        first_frame, total = result
+        print(f'Run {i + 1}: first frame {first_frame:.3f}s, process exited after {total:.3f}s')
+        first_frame_times.append(first_frame)
+    print(f'First frame: min {min(first_frame_times):.3f}s, '
+          f'median {statistics.median(first_frame_times):.3f}s, '
+          f'max {max(first_frame_times):.3f}s')
+
+
+if __name__ == '__main__':
+    main()
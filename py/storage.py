@@ -1,13 +1,19 @@
 import contextlib
+import dataclasses
 import json
 import os
+import threading
 import time
-from typing import Iterable, List
+from typing import Callable, Iterable, List, Optional
 
 from cards import Card, Rank, Suit
 from hearts import Match, PassInfo, Player, Round, RuleSet, Trick
+from instrumentation import timed
 from stats import MatchStats, RoundStats, StatsWithAndWithoutJD
 
+# How many history lines to read between progress callbacks when loading stats.
+STATS_PROGRESS_INTERVAL = 1000
+
 def debug(*args, **kwargs):
     # debug(*args, **kw)
     pass
@@ -113,13 +119,55 @@ def match_from_dict(d) -> Match:
         match.current_round = rnd
     return match
 
+def _add_match_to_stats(line, with_jd: MatchStats, without_jd: MatchStats):
+    try:
+        m = json.loads(line)
+        rules = rules_from_dict(m["rules"])
+        scores = m["scores"]
+        result = m["result"]
+        stats = with_jd if rules.jd_minus_10 else without_jd
+        stats.num_matches += 1
+        stats.num_wins += (1 if result == "win" else 0)
+        stats.num_ties += (1 if result == "tie" else 0)
+        stats.total_points += scores[0]
+    except Exception as ex:
+        print(f"Error reading match stats: {ex}")
+
+def _add_round_to_stats(line, with_jd: RoundStats, without_jd: RoundStats):
+    try:
+        r = json.loads(line)
+        rules = rules_from_dict(r["rules"])
+        points = r["points"]
+        took_qs = bool(r["qs"])
+        took_jd = bool(r["jd"])
+        hearts = r["hearts"]
+        shooter = r["shoot"]
+        stats = with_jd if rules.jd_minus_10 else without_jd
+        stats.num_rounds += 1
+        stats.total_points += points[0]
+        stats.total_opponent_points += (sum(points) - points[0])
+        stats.num_moonshots += (1 if shooter == 0 else 0)
+        stats.num_opponent_moonshots += (
+            1 if shooter is not None and shooter != 0 else 0)
+        # Don't count hearts or queen if the player shot.
+        stats.num_queen_spades += (1 if took_qs and shooter != 0 else 0)
+        stats.num_hearts += (hearts if shooter != 0 else 0)
+        stats.num_jack_diamonds += (1 if took_jd else 0)
+    except Exception as ex:
+        print(f"Error reading round stats: {ex}")
+
 class Storage:
     def __init__(self, base_dir: str):
         self.base_dir = base_dir
+        # Incremented when stats are cleared, so that loads running at the
+        # same time don't write caches of the old stats.
+        self._stats_generation = 0
+        self._stats_lock = threading.Lock()
 
     def current_match_filename(self):
         return os.path.join(self.base_dir, "current_match.json")
 
+    @timed('storage.store_current_match')
     def store_current_match(self, match: Match):
         mdict = match_to_dict(match)
         match_filename = self.current_match_filename()
@@ -129,6 +177,7 @@ class Storage:
         os.rename(match_temp_filename, match_filename)
         debug(f"Wrote match json to {match_filename}")
 
+    @timed('storage.load_current_match')
     def load_current_match(self) -> Match:
         try:
             match_filename = self.current_match_filename()
@@ -141,6 +190,7 @@ class Storage:
             print(f"Failed to read stored match: {ex}")
             return None
 
+    @timed('storage.remove_current_match')
     def remove_current_match(self):
         with contextlib.suppress(FileNotFoundError):
             os.unlink(self.current_match_filename())
@@ -148,6 +198,7 @@ class Storage:
     def match_history_filename(self):
         return os.path.join(self.base_dir, "matches.json")
 
+    @timed('storage.record_match_stats')
     def record_match_stats(self, match: Match, time_fn=time.time):
         winners = match.winners()
         result = "lose"
@@ -165,32 +216,18 @@ class Storage:
             f.write(json.dumps(match_info, separators=(',', ':')))
             f.write('\n')
 
-    def load_match_stats(self) -> StatsWithAndWithoutJD[MatchStats]:
-        with_jd = MatchStats()
-        without_jd = MatchStats()
-        mfile = self.match_history_filename()
-        if os.path.isfile(mfile):
-            with open(self.match_history_filename()) as f:
-                for line in f:
-                    if not line.strip():
-                        continue
-                    try:
-                        m = json.loads(line)
-                        rules = rules_from_dict(m["rules"])
-                        scores = m["scores"]
-                        result = m["result"]
-                        stats = with_jd if rules.jd_minus_10 else without_jd
-                        stats.num_matches += 1
-                        stats.num_wins += (1 if result == "win" else 0)
-                        stats.num_ties += (1 if result == "tie" else 0)
-                        stats.total_points += scores[0]
-                    except Exception as ex:
-                        print(f"Error reading match stats: {ex}")
-        return StatsWithAndWithoutJD(with_jd, without_jd)
+    @timed('storage.load_match_stats')
+    def load_match_stats(
+            self,
+            on_progress: Optional[Callable[[StatsWithAndWithoutJD[MatchStats]], None]] = None,
+    ) -> StatsWithAndWithoutJD[MatchStats]:
+        return self._load_stats_incrementally(
+            self.match_history_filename(), MatchStats, _add_match_to_stats, on_progress)
 
     def round_history_filename(self):
         return os.path.join(self.base_dir, "rounds.json")
 
+    @timed('storage.record_round_stats')
     def record_round_stats(self, rnd: Round, time_fn=time.time):
         queen = Card(Rank.QUEEN, Suit.SPADES)
         jack = Card(Rank.JACK, Suit.DIAMONDS)
@@ -213,39 +250,87 @@ class Storage:
             f.write(json.dumps(round_info, separators=(',', ':')))
             f.write('\n')
 
-    def load_round_stats(self) -> StatsWithAndWithoutJD[RoundStats]:
-        with_jd = RoundStats()
-        without_jd = RoundStats()
-        rfile = self.round_history_filename()
-        if os.path.isfile(rfile):
-            with open(rfile) as f:
-                for line in f:
-                    if not line.strip():
-                        continue
-                    try:
-                        r = json.loads(line)
-                        rules = rules_from_dict(r["rules"])
-                        points = r["points"]
-                        took_qs = bool(r["qs"])
-                        took_jd = bool(r["jd"])
-                        hearts = r["hearts"]
-                        shooter = r["shoot"]
-                        stats = with_jd if rules.jd_minus_10 else without_jd
-                        stats.num_rounds += 1
-                        stats.total_points += points[0]
-                        stats.total_opponent_points += (sum(points) - points[0])
-                        stats.num_moonshots += (1 if shooter == 0 else 0)
-                        stats.num_opponent_moonshots += (
-                            1 if shooter is not None and shooter != 0 else 0)
-                        # Don't count hearts or queen if the player shot.
-                        stats.num_queen_spades += (1 if took_qs and shooter != 0 else 0)
-                        stats.num_hearts += (hearts if shooter != 0 else 0)
-                        stats.num_jack_diamonds += (1 if took_jd else 0)
-                    except Exception as ex:
-                        print(f"Error reading round stats: {ex}")
+    @timed('storage.load_round_stats')
+    def load_round_stats(
+            self,
+            on_progress: Optional[Callable[[StatsWithAndWithoutJD[RoundStats]], None]] = None,
+    ) -> StatsWithAndWithoutJD[RoundStats]:
+        return self._load_stats_incrementally(
+            self.round_history_filename(), RoundStats, _add_round_to_stats, on_progress)
+
+    def stats_cache_filename(self, history_filename: str):
+        return history_filename + ".cache"
+
+    def _load_stats_incrementally(self, history_filename, stats_class, add_fn, on_progress):
+        '''Returns stats for all records in `history_filename`. Totals for the
+        records already seen are cached along with the file offset they end at,
+        so only records appended since the last load are read. If `on_progress`
+        is given, it's called with the cached totals and then with partial
+        totals as records are read. This can run on a background thread.
+        '''
+        with self._stats_lock:
+            generation = self._stats_generation
+        if not os.path.isfile(history_filename):
+            return StatsWithAndWithoutJD(stats_class(), stats_class())
+        cache_filename = self.stats_cache_filename(history_filename)
+        offset, with_jd, without_jd = self._read_stats_cache(cache_filename, stats_class)
+        if offset > os.path.getsize(history_filename):
+            # The history file was replaced, so the cache is for a different file.
+            offset, with_jd, without_jd = 0, stats_class(), stats_class()
+        if on_progress:
+            on_progress(StatsWithAndWithoutJD(
+                dataclasses.replace(with_jd), dataclasses.replace(without_jd)))
+        num_read = 0
+        with open(history_filename, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Still being written, it'll be read next time.
+                    break
+                offset += len(line)
+                if line.strip():
+                    add_fn(line, with_jd, without_jd)
+                num_read += 1
+                if on_progress and num_read % STATS_PROGRESS_INTERVAL == 0:
+                    on_progress(StatsWithAndWithoutJD(
+                        dataclasses.replace(with_jd), dataclasses.replace(without_jd)))
+        if num_read > 0:
+            with self._stats_lock:
+                # Don't recreate the cache if the stats were cleared while loading.
+                if generation == self._stats_generation:
+                    self._write_stats_cache(cache_filename, offset, with_jd, without_jd)
         return StatsWithAndWithoutJD(with_jd, without_jd)
 
+    def _read_stats_cache(self, cache_filename, stats_class):
+        try:
+            if os.path.isfile(cache_filename):
+                with open(cache_filename) as f:
+                    cache = json.load(f)
+                return (
+                    cache["offset"],
+                    stats_class(**cache["with_jd"]),
+                    stats_class(**cache["without_jd"]),
+                )
+        except Exception as ex:
+            print(f"Failed to read stats cache: {ex}")
+        return 0, stats_class(), stats_class()
+
+    def _write_stats_cache(self, cache_filename, offset, with_jd, without_jd):
+        cache = {
+            "offset": offset,
+            "with_jd": dataclasses.asdict(with_jd),
+            "without_jd": dataclasses.asdict(without_jd),
+        }
+        temp_filename = cache_filename + ".tmp"
+        with open(temp_filename, "w") as f:
+            f.write(json.dumps(cache))
+        os.rename(temp_filename, cache_filename)
+
+    @timed('storage.clear_stats')
     def clear_stats(self):
-        for path in [self.match_history_filename(), self.round_history_filename()]:
-            with contextlib.suppress(FileNotFoundError):
-                os.unlink(path)
+        with self._stats_lock:
+            self._stats_generation += 1
+            for history_path in [self.match_history_filename(), self.round_history_filename()]:
+                for path in [history_path, self.stats_cache_filename(history_path)]:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.unlink(path)
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+
+import capi
+from hearts import Match, RuleSet
+import storage
+from storage import Storage
+
+class TestStorage(unittest.TestCase):
+
+    def make_storage(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        return Storage(tmpdir.name)
+
+    def record_match(self, st: Storage, scores, jd_minus_10=False):
+        match = Match(RuleSet(jd_minus_10=jd_minus_10))
+        match.score_history = [scores]
+        st.record_match_stats(match)
+
+    def test_match_stats(self):
+        st = self.make_storage()
+        self.record_match(st, [10, 100, 20, 30])
+        self.record_match(st, [100, 10, 20, 30], jd_minus_10=True)
+        stats = st.load_match_stats()
+        self.assertEqual(stats.stats_without_jd.num_matches, 1)
+        self.assertEqual(stats.stats_without_jd.num_wins, 1)
+        self.assertEqual(stats.stats_without_jd.total_points, 10)
+        self.assertEqual(stats.stats_with_jd.num_matches, 1)
+        self.assertEqual(stats.stats_with_jd.num_wins, 0)
+        self.assertEqual(stats.stats_with_jd.total_points, 100)
+
+    def test_reads_only_new_records(self):
+        st = self.make_storage()
+        self.record_match(st, [10, 100, 20, 30])
+        self.assertEqual(st.load_match_stats().stats_without_jd.num_matches, 1)
+        self.record_match(st, [20, 100, 30, 40])
+        progress = []
+        stats = st.load_match_stats(on_progress=progress.append)
+        self.assertEqual(stats.stats_without_jd.num_matches, 2)
+        self.assertEqual(stats.stats_without_jd.total_points, 30)
+        # The first callback has the cached totals from before the second match.
+        self.assertEqual(progress[0].stats_without_jd.num_matches, 1)
+
+        # Changing already-read records doesn't change the cached totals.
+        with open(st.match_history_filename()) as f:
+            lines = f.readlines()
+        with open(st.match_history_filename(), 'w') as f:
+            f.write(lines[0].replace('"win"', '"tie"'))
+            f.write(lines[1])
+        self.assertEqual(st.load_match_stats().stats_without_jd.num_wins, 2)
+
+    def test_progress_callbacks(self):
+        st = self.make_storage()
+        for _ in range(5):
+            self.record_match(st, [10, 100, 20, 30])
+        progress = []
+        orig_interval = storage.STATS_PROGRESS_INTERVAL
+        storage.STATS_PROGRESS_INTERVAL = 2
+        try:
+            stats = st.load_match_stats(on_progress=progress.append)
+        finally:
+            storage.STATS_PROGRESS_INTERVAL = orig_interval
+        self.assertEqual(
+            [p.stats_without_jd.num_matches for p in progress], [0, 2, 4])
+        self.assertEqual(stats.stats_without_jd.num_matches, 5)
+
+    def test_ignores_incomplete_record(self):
+        st = self.make_storage()
+        self.record_match(st, [10, 100, 20, 30])
+        with open(st.match_history_filename(), 'a') as f:
+            f.write('{"time":')
+        self.assertEqual(st.load_match_stats().stats_without_jd.num_matches, 1)
+
+    def test_clear_stats(self):
+        st = self.make_storage()
+        self.record_match(st, [10, 100, 20, 30])
+        st.load_match_stats()
+        st.clear_stats()
+        self.assertFalse(os.path.exists(st.stats_cache_filename(st.match_history_filename())))
+        self.assertEqual(st.load_match_stats().stats_without_jd.num_matches, 0)
+        self.record_match(st, [100, 10, 20, 30])
+        stats = st.load_match_stats()
+        self.assertEqual(stats.stats_without_jd.num_matches, 1)
+        self.assertEqual(stats.stats_without_jd.total_points, 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+# Load test for table_server.py: creates tables on a running server and plays
+# their human seats with random legal moves, all at once, then prints request
+# latencies, throughput and the server's metrics. For example:
+#   python table_server.py --socket /tmp/hearts.sock --data-dir /tmp/tables \
+#       --strategy '{"name": "avoid_points"}' &
+#   python table_load_client.py --socket /tmp/hearts.sock --tables 100
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from instrumentation import Histogram
+
+
+# Seconds to wait for a response before giving up on a table.
+DEFAULT_TIMEOUT = 60
+
+
+class Connection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 timeout: float = DEFAULT_TIMEOUT):
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.next_id = 0
+
+    async def call(self, req: dict) -> dict:
+        self.next_id += 1
+        self.writer.write(json.dumps({**req, 'id': self.next_id}).encode('utf-8') + b'\n')
+        await self.writer.drain()
+        line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        if not line:
+            raise RuntimeError('Server closed the connection')
+        response = json.loads(line)
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response
+
+    def close(self):
+        self.writer.close()
+
+
+async def connect(args) -> Connection:
+    if args.port:
+        streams = await asyncio.open_connection('127.0.0.1', args.port)
+    else:
+        streams = await asyncio.open_unix_connection(args.socket)
+    return Connection(*streams, timeout=args.timeout)
+
+
+async def play_table(args, latencies: Histogram) -> int:
+    '''Plays one table until its match ends or `args.max_moves` moves are made,
+    and returns the number of moves.'''
+    conn = await connect(args)
+
+    async def call(req):
+        start = time.time()
+        response = await conn.call(req)
+        latencies.add(time.time() - start)
+        return response
+
+    state = await call({'op': 'create_table', 'human_seats': [0]})
+    table_id = state['table_id']
+    num_moves = 0
+    while state['status'] != 'finished' and num_moves < args.max_moves:
+        if state['status'] == 'pass':
+            cards = random.sample(state['hand'].split(), 3)
+            state = await call(
+                {'op': 'pass', 'table_id': table_id, 'seat': 0, 'cards': ' '.join(cards)})
+        elif state['status'] == 'play':
+            card = random.choice(state['legal_plays'].split())
+            state = await call({'op': 'play', 'table_id': table_id, 'seat': 0, 'card': card})
+        else:
+            raise RuntimeError(f'Unexpected status: {state["status"]}')
+        num_moves += 1
+    conn.close()
+    return num_moves
+
+
+async def run(args):
+    latencies = Histogram()
+    start = time.time()
+    moves = await asyncio.gather(*[play_table(args, latencies) for _ in range(args.tables)])
+    elapsed = time.time() - start
+    print(f'{args.tables} tables, {sum(moves)} moves in {elapsed:.2f} seconds, '
+          f'{sum(moves) / elapsed:.1f} moves/second')
+    print('Request latency (seconds):', json.dumps(latencies.summary(), indent=2))
+    conn = await connect(args)
+    print('Server metrics:', json.dumps(await conn.call({'op': 'metrics'}), indent=2))
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--socket', default='/tmp/hearts_tables.sock')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--tables', type=int, default=10)
+    parser.add_argument('--max-moves', type=int, default=1000,
+                        help='Stop each table after this many human moves')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help='Seconds to wait for each response')
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
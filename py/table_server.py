@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+
+# Headless server that hosts many matches at once, for running AI players at
+# scale and for finding out where the game logic and the shared library stop
+# scaling. Clients connect to a local socket and send one JSON request per
+# line, each with an "id" that's copied to its response, and an "op":
+#   {"op": "create_table", "human_seats": [0]}: starts a match in which the
+#     other seats are played by the AI. Returns the table's state for its
+#     first human seat.
+#   {"op": "state", "table_id": ..., "seat": 0}: returns the table's state
+#     as that seat sees it.
+#   {"op": "pass", "table_id": ..., "seat": 0, "cards": "QS AH 8H"}
+#   {"op": "play", "table_id": ..., "seat": 0, "card": "2C"}: makes the move
+#     and returns the seat's state once it's a human's turn again.
+#   {"op": "metrics"} or {"op": "metrics", "table_id": ...}: global or table
+#     throughput.
+# The "status" of a state is "pass" or "play" if the seat should move,
+# "wait" if another human has to move first, and "finished" at the end of the
+# match. Failed requests get a response with an "error" message.
+# Each table is stored with `Storage` in its own directory under the data
+# directory, and unfinished tables are loaded again when the server starts.
+# Run from the `py` directory, for example:
+#   python table_server.py --socket /tmp/hearts.sock --data-dir tables
+# and see table_load_client.py for a client that plays many tables at once.
+
+import argparse
+import asyncio
+import dataclasses
+import json
+import os
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from ai_executor import AIExecutor
+import capi
+from cards import Card
+from hearts import Match, RuleSet
+from storage import Storage, cards_from_string, cards_to_string, rules_from_dict, rules_to_dict
+
+# Maximum number of AI requests queued or running at once, across all tables.
+DEFAULT_MAX_PENDING_AI = 256
+
+TABLE_INFO_FILENAME = 'table.json'
+
+
+@dataclasses.dataclass
+class TableMetrics:
+    human_moves: int = 0
+    ai_plays: int = 0
+    ai_passes: int = 0
+    # Seconds that AI requests spent running, not counting time in the queue.
+    ai_time: float = 0.0
+    rounds_finished: int = 0
+
+
+class Table:
+    def __init__(self, table_id: str, match: Match, human_seats: List[int], storage: Storage):
+        self.table_id = table_id
+        self.match = match
+        self.human_seats = human_seats
+        self.storage = storage
+        # Passes chosen for the current round, which are made once every seat has chosen.
+        self.passes: Dict[int, List[Card]] = {}
+        self.metrics = TableMetrics()
+        # Moves are made one at a time, while state requests can be answered at any point.
+        self.lock = asyncio.Lock()
+
+    def status(self, seat: int) -> str:
+        if self.match.is_finished():
+            return 'finished'
+        rnd = self.match.current_round
+        if rnd.is_awaiting_pass():
+            return 'wait' if seat in self.passes else 'pass'
+        if rnd.is_in_progress() and rnd.current_player_index() == seat:
+            return 'play'
+        return 'wait'
+
+    def state(self, seat: int) -> dict:
+        state = {
+            'table_id': self.table_id,
+            'seat': seat,
+            'status': self.status(seat),
+            'scores': self.match.total_scores(),
+            'round': len(self.match.score_history),
+        }
+        rnd = self.match.current_round
+        if rnd:
+            state['hand'] = cards_to_string(rnd.players[seat].hand)
+            state['pass_direction'] = rnd.pass_info.direction
+            if rnd.current_trick:
+                state['current_trick'] = {
+                    'leader': rnd.current_trick.leader,
+                    'cards': cards_to_string(rnd.current_trick.cards),
+                }
+            if state['status'] == 'play':
+                state['legal_plays'] = cards_to_string(capi.legal_plays(rnd))
+        if self.match.is_finished():
+            state['winners'] = self.match.winners()
+        return state
+
+
+class TableServer:
+    '''Hosts tables and answers requests for them; see the top of the file for
+    the protocol. AI seats are played on `executor`, with at most
+    `max_pending_ai` requests waiting or running at once so that a burst of
+    tables can't queue unbounded work. `strategy` is passed to capi.best_play.'''
+    def __init__(self, data_dir: str, executor: AIExecutor,
+                 max_pending_ai: int = DEFAULT_MAX_PENDING_AI,
+                 strategy: Optional[dict] = None, time_fn=time.time):
+        self.data_dir = data_dir
+        self.executor = executor
+        self.strategy = strategy
+        self.time_fn = time_fn
+        self.tables: Dict[str, Table] = {}
+        self.start_time = time_fn()
+        self.num_requests = 0
+        # Seconds spent handling requests, including waiting for the AI.
+        self.request_time = 0.0
+        self._ai_slots = asyncio.Semaphore(max_pending_ai)
+
+    def load_tables(self) -> int:
+        '''Loads the unfinished tables in the data directory, and returns how
+        many there were.'''
+        if not os.path.isdir(self.data_dir):
+            return 0
+        for table_id in sorted(os.listdir(self.data_dir)):
+            storage = Storage(os.path.join(self.data_dir, table_id))
+            info_path = os.path.join(storage.base_dir, TABLE_INFO_FILENAME)
+            if not os.path.isfile(info_path):
+                continue
+            match = storage.load_current_match()
+            if match is None:
+                continue
+            with open(info_path) as f:
+                info = json.load(f)
+            self.tables[table_id] = Table(table_id, match, info['human_seats'], storage)
+        return len(self.tables)
+
+    async def handle_request(self, req: dict) -> dict:
+        start = self.time_fn()
+        try:
+            response = await self._handle_op(req)
+        except (KeyError, ValueError, TypeError) as ex:
+            response = {'error': f'{type(ex).__name__}: {ex}'}
+        except Exception as ex:
+            # Failures in the AI or storage, which shouldn't leave the client
+            # waiting for a response that never comes.
+            print(f'Request failed: {req}: {ex!r}')
+            response = {'error': f'{type(ex).__name__}: {ex}'}
+        self.num_requests += 1
+        self.request_time += self.time_fn() - start
+        if 'id' in req:
+            response['id'] = req['id']
+        return response
+
+    async def _handle_op(self, req: dict) -> dict:
+        op = req['op']
+        if op == 'create_table':
+            return await self.create_table(
+                rules_from_dict(req['rules']) if 'rules' in req else RuleSet(),
+                req.get('human_seats', [0]))
+        if op == 'metrics':
+            return self.table_metrics(req['table_id']) if 'table_id' in req else self.metrics()
+        table = self.tables[req['table_id']]
+        seat = req['seat']
+        if seat not in table.human_seats:
+            raise ValueError(f'Seat {seat} is not a human seat')
+        if op == 'state':
+            return table.state(seat)
+        async with table.lock:
+            if op == 'pass':
+                self._pass_cards(table, seat, cards_from_string(req['cards']))
+            elif op == 'play':
+                self._play_card(table, seat, Card.parse(req['card']))
+            else:
+                raise ValueError(f'Unknown op: {op}')
+            table.metrics.human_moves += 1
+            await self._advance(table)
+        return table.state(seat)
+
+    async def create_table(self, rules: RuleSet, human_seats: List[int]) -> dict:
+        if not human_seats or any(s not in range(rules.num_players) for s in human_seats):
+            raise ValueError(f'Invalid human seats: {human_seats}')
+        table_id = uuid.uuid4().hex
+        storage = Storage(os.path.join(self.data_dir, table_id))
+        os.makedirs(storage.base_dir, exist_ok=True)
+        with open(os.path.join(storage.base_dir, TABLE_INFO_FILENAME), 'w') as f:
+            json.dump({'human_seats': human_seats, 'rules': rules_to_dict(rules)}, f)
+        table = Table(table_id, Match(rules), human_seats, storage)
+        self.tables[table_id] = table
+        async with table.lock:
+            await self._advance(table)
+        return table.state(human_seats[0])
+
+    def _pass_cards(self, table: Table, seat: int, cards: List[Card]):
+        rnd = table.match.current_round
+        if table.status(seat) != 'pass':
+            raise ValueError(f'Seat {seat} is not passing')
+        hand = rnd.players[seat].hand
+        if len(set(cards)) != rnd.pass_info.num_cards or any(c not in hand for c in cards):
+            raise ValueError(f'Invalid pass: {cards_to_string(cards)}')
+        table.passes[seat] = cards
+
+    def _play_card(self, table: Table, seat: int, card: Card):
+        rnd = table.match.current_round
+        if table.status(seat) != 'play':
+            raise ValueError(f'Seat {seat} is not playing')
+        if card not in capi.legal_plays(rnd):
+            raise ValueError(f'Illegal play: {card.ascii_string()}')
+        rnd.play_card(card)
+
+    async def _advance(self, table: Table):
+        '''Makes AI moves and starts rounds until a human has to move or the
+        match is over, then stores the table.'''
+        match = table.match
+        while not match.is_finished():
+            rnd = match.current_round
+            if rnd is None:
+                match.start_next_round()
+                table.passes = {}
+                continue
+            if rnd.is_awaiting_pass():
+                ai_seats = [
+                    p for p in range(rnd.rules.num_players)
+                    if p not in table.human_seats and p not in table.passes]
+                passes = await asyncio.gather(
+                    *[self._run_ai(table, lambda p=p: capi.cards_to_pass(rnd, p)) for p in ai_seats])
+                table.metrics.ai_passes += len(ai_seats)
+                table.passes.update(zip(ai_seats, passes))
+                if len(table.passes) < rnd.rules.num_players:
+                    break
+                rnd.pass_cards([table.passes[p] for p in range(rnd.rules.num_players)])
+                table.passes = {}
+                rnd.start_play()
+            elif rnd.is_finished():
+                await self._run_io(lambda: table.storage.record_round_stats(rnd))
+                match.finish_round()
+                table.metrics.rounds_finished += 1
+            elif not rnd.is_in_progress():
+                # No passing this round.
+                rnd.start_play()
+            elif rnd.current_player_index() in table.human_seats:
+                break
+            else:
+                card = await self._run_ai(table, lambda: capi.best_play(rnd, self.strategy))
+                rnd.play_card(card)
+                table.metrics.ai_plays += 1
+        if match.is_finished():
+            await self._run_io(lambda: table.storage.record_match_stats(match))
+            await self._run_io(table.storage.remove_current_match)
+        else:
+            await self._run_io(lambda: table.storage.store_current_match(match))
+
+    async def _run_ai(self, table: Table, fn: Callable):
+        async with self._ai_slots:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+
+            def run():
+                start = self.time_fn()
+                try:
+                    return fn(), None, self.time_fn() - start
+                except Exception as ex:
+                    return None, ex, self.time_fn() - start
+
+            def done(result, elapsed):
+                loop.call_soon_threadsafe(future.set_result, result)
+
+            self.executor.submit(run, done)
+            value, error, run_time = await future
+        table.metrics.ai_time += run_time
+        if error:
+            raise error
+        return value
+
+    async def _run_io(self, fn: Callable):
+        await asyncio.get_running_loop().run_in_executor(None, fn)
+
+    def table_metrics(self, table_id: str) -> dict:
+        table = self.tables[table_id]
+        return {
+            **dataclasses.asdict(table.metrics),
+            'status': 'finished' if table.match.is_finished() else 'active',
+        }
+
+    def metrics(self) -> dict:
+        elapsed = max(self.time_fn() - self.start_time, 1e-9)
+        totals = TableMetrics()
+        for table in self.tables.values():
+            for field in dataclasses.fields(TableMetrics):
+                setattr(totals, field.name,
+                        getattr(totals, field.name) + getattr(table.metrics, field.name))
+        ai_stats = self.executor.stats()
+        return {
+            'tables': len(self.tables),
+            'active_tables': sum(1 for t in self.tables.values() if not t.match.is_finished()),
+            'requests': self.num_requests,
+            'requests_per_second': self.num_requests / elapsed,
+            'mean_request_time': self.request_time / self.num_requests if self.num_requests else 0.0,
+            'moves_per_second': (totals.human_moves + totals.ai_plays) / elapsed,
+            'ai_plays_per_second': totals.ai_plays / elapsed,
+            **dataclasses.asdict(totals),
+            'ai_queue_depth': ai_stats.queue_depth,
+            'ai_max_queue_depth': ai_stats.max_queue_depth,
+            'ai_mean_wait_time': ai_stats.mean_wait_time(),
+            'ai_mean_run_time': ai_stats.mean_run_time(),
+            'decision_cache_hits': capi.decision_cache.hits,
+            'decision_cache_misses': capi.decision_cache.misses,
+        }
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        '''Answers requests from one client. Requests are handled concurrently,
+        so responses can be sent in a different order than the requests.'''
+        async def respond(line: bytes):
+            try:
+                req = json.loads(line)
+            except ValueError as ex:
+                response = {'error': f'Invalid JSON: {ex}'}
+            else:
+                if isinstance(req, dict):
+                    response = await self.handle_request(req)
+                else:
+                    response = {'error': 'Request must be a JSON object'}
+            writer.write(json.dumps(response).encode('utf-8') + b'\n')
+            await writer.drain()
+
+        tasks = set()
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.strip():
+                task = asyncio.create_task(respond(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+        writer.close()
+
+
+async def serve(args):
+    executor = AIExecutor(num_workers=args.ai_workers)
+    strategy = json.loads(args.strategy) if args.strategy else None
+    server = TableServer(args.data_dir, executor, args.max_pending_ai, strategy)
+    print(f'Loaded {server.load_tables()} tables')
+    if args.port:
+        sock_server = await asyncio.start_server(server.handle_connection, '127.0.0.1', args.port)
+    else:
+        sock_server = await asyncio.start_unix_server(server.handle_connection, args.socket)
+    print(f'Listening on {args.socket if not args.port else args.port}')
+    async with sock_server:
+        await sock_server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--socket', default='/tmp/hearts_tables.sock', help='Unix socket path')
+    parser.add_argument('--port', type=int, help='Listen on this local TCP port instead of a socket')
+    parser.add_argument('--data-dir', default='tables')
+    parser.add_argument('--ai-workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--max-pending-ai', type=int, default=DEFAULT_MAX_PENDING_AI)
+    parser.add_argument('--strategy', help='AI strategy as JSON, for example \'{"name": "avoid_points"}\'')
+    args = parser.parse_args()
+    capi.warm_up()
+    asyncio.run(serve(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+# capi has to be imported before hearts because they import each other.
+import capi
+from ai_executor import AIExecutor
+from table_server import TableServer
+
+STRATEGY = {'name': 'avoid_points'}
+
+
+@unittest.skipUnless(capi.get_lib(), 'shared library not built')
+class TestTableServer(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.data_dir = tmpdir.name
+        self.executor = AIExecutor(num_workers=2)
+        self.addCleanup(self.executor.shutdown)
+
+    def make_server(self):
+        return TableServer(self.data_dir, self.executor, max_pending_ai=4, strategy=STRATEGY)
+
+    async def move(self, server, state):
+        table_id = state['table_id']
+        if state['status'] == 'pass':
+            cards = ' '.join(state['hand'].split()[:3])
+            req = {'op': 'pass', 'table_id': table_id, 'seat': 0, 'cards': cards}
+        else:
+            card = state['legal_plays'].split()[0]
+            req = {'op': 'play', 'table_id': table_id, 'seat': 0, 'card': card}
+        response = await server.handle_request(req)
+        self.assertNotIn('error', response)
+        return response
+
+    async def test_plays_round(self):
+        server = self.make_server()
+        state = await server.handle_request({'op': 'create_table', 'id': 7})
+        self.assertEqual(state['id'], 7)
+        self.assertEqual(state['status'], 'pass')
+        self.assertEqual(len(state['hand'].split()), 13)
+        while state['round'] == 0:
+            state = await self.move(server, state)
+        self.assertEqual(sum(state['scores']), 26)
+        metrics = server.table_metrics(state['table_id'])
+        self.assertEqual(metrics['rounds_finished'], 1)
+        self.assertEqual(metrics['human_moves'], 14)
+        # The AI players have also passed for the second round.
+        self.assertEqual(metrics['ai_passes'], 6)
+        self.assertEqual(metrics['ai_plays'], 39)
+        global_metrics = (await server.handle_request({'op': 'metrics'}))
+        self.assertEqual(global_metrics['active_tables'], 1)
+        self.assertEqual(global_metrics['requests'], 15)
+
+    async def test_resumes_tables(self):
+        server = self.make_server()
+        state = await server.handle_request({'op': 'create_table', 'human_seats': [0, 2]})
+        state = await self.move(server, state)
+        self.assertEqual(state['status'], 'wait')
+        table_id = state['table_id']
+
+        resumed = self.make_server()
+        self.assertEqual(resumed.load_tables(), 1)
+        # Passes aren't stored until every seat has passed.
+        state = await resumed.handle_request({'op': 'state', 'table_id': table_id, 'seat': 0})
+        self.assertEqual(state['status'], 'pass')
+        state = await self.move(resumed, state)
+        state = await resumed.handle_request({'op': 'state', 'table_id': table_id, 'seat': 2})
+        self.assertEqual(state['status'], 'pass')
+
+    async def test_errors(self):
+        server = self.make_server()
+        state = await server.handle_request({'op': 'create_table'})
+        table_id = state['table_id']
+        for req in [
+            {'op': 'state', 'table_id': 'nope', 'seat': 0},
+            {'op': 'state', 'table_id': table_id, 'seat': 1},
+            {'op': 'play', 'table_id': table_id, 'seat': 0, 'card': '2C'},
+            {'op': 'pass', 'table_id': table_id, 'seat': 0, 'cards': state['hand'][:2]},
+            {'op': 'shuffle', 'table_id': table_id, 'seat': 0},
+            {'op': 'create_table', 'human_seats': [4]},
+        ]:
+            self.assertIn('error', await server.handle_request(req), req)
+        self.assertEqual(server.table_metrics(table_id)['human_moves'], 0)
+
+    async def test_ai_failure(self):
+        server = self.make_server()
+        with mock.patch('capi.cards_to_pass', side_effect=RuntimeError('server died')):
+            response = await server.handle_request({'op': 'create_table', 'id': 3})
+        self.assertEqual(response['id'], 3)
+        self.assertIn('server died', response['error'])
+
+        path = os.path.join(self.data_dir, 'server.sock')
+        sock_server = await asyncio.start_unix_server(server.handle_connection, path)
+        reader, writer = await asyncio.open_unix_connection(path)
+        with mock.patch('capi.cards_to_pass', side_effect=OSError('disk full')):
+            writer.write(b'{"id": 4, "op": "create_table"}\n')
+            await writer.drain()
+            response = json.loads(await asyncio.wait_for(reader.readline(), 10))
+        writer.close()
+        sock_server.close()
+        await sock_server.wait_closed()
+        self.assertEqual(response['id'], 4)
+        self.assertIn('disk full', response['error'])
+
+    async def test_socket(self):
+        server = self.make_server()
+        path = os.path.join(self.data_dir, 'server.sock')
+        sock_server = await asyncio.start_unix_server(server.handle_connection, path)
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(b'{"id": 1, "op": "create_table"}\nnot json\n')
+        await writer.drain()
+        responses = [json.loads(await reader.readline()) for _ in range(2)]
+        writer.close()
+        sock_server.close()
+        await sock_server.wait_closed()
+        responses.sort(key=lambda r: 'error' in r)
+        self.assertEqual(responses[0]['id'], 1)
+        self.assertEqual(responses[0]['status'], 'pass')
+        self.assertIn('error', responses[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
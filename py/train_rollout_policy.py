@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+# Trains the linear rollout policy in hearts_policy.rs. Plays rounds where
+# every player uses Monte Carlo search, records the features of each legal
+# play and which one the search chose, and fits weights by maximum likelihood
+# so that the policy's highest scoring play is usually the search's. Requires the
+# shared library and NumPy, which the app doesn't need. Run from the `py`
+# directory, for example:
+#   python train_rollout_policy.py --rounds 2000
+# which takes about 10 minutes on one core.
+# The app loads the weights from capi.ROLLOUT_POLICY_PATH, and the built-in
+# weights in hearts_policy.rs can be replaced with the printed ones.
+# --data saves the recorded plays, and --data with --rounds 0 fits again
+# without playing.
+
+import argparse
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+import capi
+from hearts import PassInfo, Round, RuleSet
+
+MAGIC = b'HRLP'
+
+
+def record_round(rules: RuleSet, direction: int, strategy: dict):
+    '''Plays a round and returns a feature matrix for each play that had more
+    than one legal choice, and the index of the card the search chose.'''
+    rnd = Round(rules, PassInfo(direction=direction, num_cards=3), [0] * rules.num_players)
+    if direction > 0:
+        rnd.pass_cards([capi.cards_to_pass(rnd, p) for p in range(rules.num_players)])
+    rnd.start_play()
+    samples = []
+    while not rnd.is_finished():
+        plays = capi.play_features(rnd)
+        card = capi.best_play(rnd, strategy) if len(plays) > 1 else plays[0][0]
+        if len(plays) > 1:
+            cards = [c for (c, _) in plays]
+            samples.append((np.array([f for (_, f) in plays], dtype=np.float32), cards.index(card)))
+        rnd.play_card(card)
+    return samples
+
+
+def pad_samples(samples):
+    '''Returns the samples as a (plays, max legal plays, features) array with
+    a mask of which entries are real plays, and the chosen indices.'''
+    max_plays = max(len(f) for (f, _) in samples)
+    num_features = samples[0][0].shape[1]
+    features = np.zeros((len(samples), max_plays, num_features), dtype=np.float64)
+    mask = np.zeros((len(samples), max_plays), dtype=bool)
+    for i, (f, _) in enumerate(samples):
+        features[i, :len(f)] = f
+        mask[i, :len(f)] = True
+    chosen = np.array([c for (_, c) in samples])
+    return features, mask, chosen
+
+
+def fit(features, mask, chosen, l2: float, iterations: int):
+    '''Fits a conditional logit model, where the probability of each legal play
+    is proportional to exp(weights . features), by gradient descent on the
+    negative log likelihood with L2 regularization.'''
+    n = len(chosen)
+    weights = np.zeros(features.shape[2])
+    learning_rate = 1.0
+    rows = np.arange(n)
+    for i in range(iterations):
+        scores = features @ weights
+        scores[~mask] = -np.inf
+        scores -= scores.max(axis=1, keepdims=True)
+        probs = np.exp(scores)
+        probs /= probs.sum(axis=1, keepdims=True)
+        expected = np.einsum('ij,ijk->ik', probs, features)
+        gradient = (expected - features[rows, chosen]).mean(axis=0) + l2 * weights
+        weights -= learning_rate * gradient
+        if i % 500 == 0 or i == iterations - 1:
+            loss = -np.log(probs[rows, chosen] + 1e-12).mean()
+            print(f'Iteration {i}: loss {loss:.4f}')
+    return weights
+
+
+def match_rate(features, mask, chosen, weights):
+    '''Returns how often the highest scoring play is the one the search chose.'''
+    scores = features @ weights
+    scores[~mask] = -np.inf
+    return (scores.argmax(axis=1) == chosen).mean()
+
+
+def write_policy(path: str, weights):
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<4sI', MAGIC, len(weights)))
+        f.write(struct.pack(f'<{len(weights)}f', *weights))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=2000, help='Rounds of self-play to record')
+    parser.add_argument('--num-hands', type=int, default=50, help='Deals for each Monte Carlo search')
+    parser.add_argument('--data', help='.npz file of recorded plays to add to and save')
+    parser.add_argument('--l2', type=float, default=0.001)
+    parser.add_argument('--iterations', type=int, default=3000)
+    parser.add_argument('--jd-minus-10', action='store_true')
+    parser.add_argument('--output', default=capi.ROLLOUT_POLICY_PATH)
+    args = parser.parse_args()
+
+    if not capi.get_lib():
+        sys.exit(1)
+    rules = RuleSet(jd_minus_10=args.jd_minus_10)
+    strategy = {'name': 'monte_carlo', 'num_hands': args.num_hands}
+    samples = []
+    if args.data and os.path.exists(args.data):
+        saved = np.load(args.data, allow_pickle=True)
+        samples = list(zip(saved['features'], saved['chosen']))
+        print(f'Loaded {len(samples)} plays from {args.data}')
+    start_time = time.time()
+    for i in range(args.rounds):
+        samples.extend(record_round(rules, i % rules.num_players, strategy))
+        if (i + 1) % 10 == 0:
+            print(f'{i + 1} rounds, {len(samples)} plays, {time.time() - start_time:.0f} seconds')
+    if args.data:
+        # Plays have different numbers of legal cards, so features are saved as objects.
+        saved_features = np.empty(len(samples), dtype=object)
+        for i, (f, _) in enumerate(samples):
+            saved_features[i] = f
+        np.savez(args.data, features=saved_features, chosen=np.array([c for (_, c) in samples]))
+    if not samples:
+        sys.exit('No plays recorded')
+
+    features, mask, chosen = pad_samples(samples)
+    weights = fit(features, mask, chosen, args.l2, args.iterations)
+    print(f'Matches the search on {100 * match_rate(features, mask, chosen, weights):.1f}% of plays')
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    write_policy(args.output, weights)
+    print(f'Wrote {args.output}')
+    print('weights: [' + ', '.join(f'{w:.4f}' for w in weights) + ']')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+import functools
 import math
 from typing import Iterable, List, Tuple
 
@@ -70,14 +71,39 @@ def set_round_rect_background(widget, color: Iterable[float], radius: float):
     widget.bind(pos=update, size=update)
 
 
+# Font size at which text is measured for scaled_text_size. Text extents scale
+# close to linearly with font size, so one measurement can serve every size.
+REFERENCE_FONT_SIZE = 20
+
+
+@functools.lru_cache(maxsize=2048)
+def text_size(text: str, font_size: float, padding: float = 0) -> Tuple[int, int]:
+    '''Returns the size of the texture for `text` rendered with the given font
+    size and padding. Rendering text is expensive, so results are cached; use
+    `text_size.cache_info()` to see hit and miss counts.
+    '''
+    debug(f'Measuring text: {text!r} {font_size} {padding}')
+    # Updating an existing label's font size doesn't affect its computed size,
+    # so each measurement needs a new label.
+    label = CoreLabel(text=text, font_size=font_size, padding=padding)
+    label.refresh()
+    return tuple(label.texture.size)
+
+
+def scaled_text_size(text: str, font_size: float,
+                     relative_padding: float = 0) -> Tuple[float, float]:
+    '''Approximates `text_size(text, font_size, font_size * relative_padding)`
+    by scaling a measurement at REFERENCE_FONT_SIZE, so that layouts at new
+    sizes (e.g. after a resize) don't need to render text again.
+    '''
+    ref_pad = REFERENCE_FONT_SIZE * relative_padding
+    ref_width, ref_height = text_size(text, REFERENCE_FONT_SIZE, ref_pad)
+    scale = font_size / REFERENCE_FONT_SIZE
+    return (ref_width * scale, ref_height * scale)
+
+
 def label_size(text: str, font_size: float) -> Tuple[int, int]:
-   label = CoreLabel(text=text, font_size=font_size)
-   label.refresh()
-   r1 = label.texture.size
-   label.text = text + text
-   label.refresh()
-   r2 = label.texture.size
-   return r1 + r2
+   return text_size(text, font_size) + text_size(text + text, font_size)
 
 
 @dataclass
@@ -102,24 +128,13 @@ def _required_size_for_cells(cells: List[List[AutosizeTableCell]],
                             base_font_size: float) -> Tuple[int, int]:
     required_width = 0
     required_height = 0
-    label = None
-    last_font_size = -1
     for row in cells:
         row_height = 0
         sumw = sum([cell.layout_weight for cell in row])
         weight_ratios = [sumw / cell.layout_weight for cell in row]
         for cell, wrat in zip(row, weight_ratios):
             fsize = base_font_size * cell.relative_font_size
-            # Updating an existing label's font size doesn't affect its computed
-            # size, so we have to recreate it if the font size changes.
-            if label is None or last_font_size != fsize:
-                debug(f'New label: {fsize}')
-                pad = fsize * cell.relative_padding
-                label = CoreLabel(font_size=fsize, padding=pad)
-            last_font_size = fsize
-            label.text = cell.text
-            label.refresh()
-            size = label.texture.size
+            size = scaled_text_size(cell.text, fsize, cell.relative_padding)
             required_width = max(required_width, size[0] * wrat)
             row_height = max(row_height, size[1])
         required_height += row_height
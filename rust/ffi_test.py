@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 
-from ctypes import cdll, c_char, c_int32
+from ctypes import byref, cdll, c_char, c_float, c_int32, c_uint64
 import json
+import struct
 import unittest
 
 def load_shared_lib():
@@ -70,6 +71,18 @@ class HeartsApiTest(unittest.TestCase):
         })
         self.assertEqual(set(cards), {"QS", "AH", "8H"})
 
+    def test_pass_simulation(self):
+        cards = choose_cards_to_pass(self.lib, {
+            "scores_before_round": [0, 0, 0, 0],
+            "player_index": 2,
+            "hand": "QS 3S AH KH 8H 2H 6D 5D 4D 3D 6C 5C 4C",
+            "direction": 1,
+            "num_cards": 3,
+            "strategy": {"name": "simulation", "num_deals": 200, "time_limit_ms": 5000},
+        })
+        self.assertEqual(len(cards), 3)
+        self.assertIn("QS", cards)
+
     def test_dump_queen(self):
         card = choose_card_to_play(self.lib, {
             "scores_before_round": [0, 0, 0, 0],
@@ -197,6 +210,31 @@ class HeartsApiTest(unittest.TestCase):
         })
         self.assertEqual(card, "9C")
 
+    def test_rollouts_reported(self):
+        req = {
+            "scores_before_round": [0, 0, 0, 0],
+            "hand": "KS QS JS TS AH 9H 6H 3H AD KD QD JD",
+            "prev_tricks": [{"leader": 0, "cards": "2C QC KC AC"}],
+            "current_trick": {"leader": 3, "cards": "4C"},
+            "pass_direction": 0,
+            "passed_cards": "",
+            "received_cards": "",
+        }
+        req_bytes = json.dumps(req).encode('utf-8')
+        num_rollouts = c_uint64(0)
+        index = self.lib.card_to_play_with_stats_from_json(
+            req_bytes, len(req_bytes), byref(num_rollouts))
+        self.assertEqual(req["hand"].split()[index], "QS")
+        # Dumping the queen is clearly best, so the search should stop well
+        # before 50 deals * 20 rollouts for each of the 12 legal plays.
+        self.assertGreater(num_rollouts.value, 0)
+        self.assertLess(num_rollouts.value, 12 * 50 * 20 / 2)
+
+        req["strategy"] = {"name": "monte_carlo", "early_stopping": False}
+        req_bytes = json.dumps(req).encode('utf-8')
+        self.lib.card_to_play_with_stats_from_json(req_bytes, len(req_bytes), byref(num_rollouts))
+        self.assertEqual(num_rollouts.value, 12 * 50 * 20)
+
     def test_count_points(self):
         score_req = {
             "tricks": [
@@ -216,5 +254,51 @@ class HeartsApiTest(unittest.TestCase):
         self.lib.points_taken_from_json(req_bytes, len(req_bytes), score_buffer, 4)
         self.assertEqual(list(score_buffer), [0, 13, 0, -8])
 
+    def test_load_match_equity_table(self):
+        table = b'not a table'
+        self.assertEqual(self.lib.load_match_equity_table(table, len(table)), -1)
+        # Point limit 10 with grid points at 0 and 5, and a uint16 equity for
+        # each score with the other scores sorted.
+        header = struct.pack('<4siBiiI', b'HMET', 10, 0, 0, 5, 2)
+        table = header + struct.pack('<8H', 16384, 20000, 30000, 45000, 10000, 16384, 25000, 40000)
+        self.assertEqual(self.lib.load_match_equity_table(table, len(table)), 0)
+        self.assertEqual(self.lib.load_match_equity_table(table[:-1], len(table) - 1), -1)
+
+    def test_play_features(self):
+        req = {
+            "scores_before_round": [0, 0, 0, 0],
+            "hand": "QC 9C",
+            "prev_tricks": [
+                {"leader": 0, "cards": "2C 7D TC KC"},
+                {"leader": 3, "cards": "9S 4H 8S AS"},
+                {"leader": 2, "cards": "AD 3D AH 5D"},
+                {"leader": 2, "cards": "KD 8D QH 6D"},
+                {"leader": 2, "cards": "QD 9D TH 4D"},
+                {"leader": 2, "cards": "JD JH 9H 2D"},
+                {"leader": 2, "cards": "TD 8H 5H KH"},
+                {"leader": 2, "cards": "KS 6S 8C 7S"},
+                {"leader": 2, "cards": "QS 4S 7C 5S"},
+                {"leader": 2, "cards": "JS 6H 6C 3S"},
+                {"leader": 2, "cards": "TS 2H 5C 2S"},
+            ],
+            "current_trick": {"leader": 2, "cards": "AC"},
+            "pass_direction": 0,
+            "passed_cards": "",
+            "received_cards": "",
+        }
+        req_bytes = json.dumps(req).encode('utf-8')
+        buf_len = 2 * 64
+        features = (c_float * buf_len).from_buffer(bytearray(4 * buf_len))
+        n = self.lib.play_features_from_json(req_bytes, len(req_bytes), features, buf_len)
+        self.assertGreater(n, 0)
+        self.assertNotEqual(list(features[0:n]), list(features[n:2 * n]))
+        self.assertTrue(any(features[0:n]))
+
+    def test_load_rollout_policy(self):
+        policy = b'not a policy'
+        self.assertEqual(self.lib.load_rollout_policy(policy, len(policy)), -1)
+        policy = struct.pack('<4sI', b'HRLP', 2) + struct.pack('<2f', 1.0, 2.0)
+        self.assertEqual(self.lib.load_rollout_policy(policy, len(policy)), -1)
+
 if __name__ == '__main__':
     unittest.main()
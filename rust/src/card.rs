@@ -1,5 +1,6 @@
 use rand::seq::SliceRandom;
 use rand::Rng;
+use std::collections::HashMap;
 use std::collections::HashSet;
 
 #[derive(Debug)]
@@ -21,7 +22,18 @@ pub enum Suit {
     Spades,
 }
 
+pub const ALL_SUITS: [Suit; 4] = [Suit::Clubs, Suit::Diamonds, Suit::Hearts, Suit::Spades];
+
 impl Suit {
+    pub fn index(&self) -> usize {
+        return match self {
+            Suit::Clubs => 0,
+            Suit::Diamonds => 1,
+            Suit::Hearts => 2,
+            Suit::Spades => 3,
+        };
+    }
+
     pub fn from(s: &str) -> Result<Suit, CardError> {
         return match &s.to_ascii_uppercase()[..] {
             "C" => Ok(Suit::Clubs),
@@ -132,6 +144,95 @@ impl Card {
         s.push_str(self.suit.symbol());
         return s;
     }
+
+    // Unique index from 0 to 51. Cards of the same suit have consecutive
+    // indices, ordered by rank.
+    pub fn index(&self) -> usize {
+        return self.suit.index() * 13 + (self.rank.value as usize - 2);
+    }
+
+    pub fn from_index(index: usize) -> Card {
+        assert!(index < 52);
+        return Card::new(Rank::num((index % 13) as u32 + 2), ALL_SUITS[index / 13]);
+    }
+}
+
+// A set of cards stored as a bitmask, where bit `card.index()` is set if the
+// card is in the set. Copying and set operations are much cheaper than for
+// HashSet<Card>.
+#[derive(Debug, PartialEq, Eq, Hash, Copy, Clone, Default)]
+pub struct CardSet {
+    pub bits: u64,
+}
+
+impl CardSet {
+    pub fn new() -> CardSet {
+        return CardSet { bits: 0 };
+    }
+
+    pub fn from_cards(cards: &[Card]) -> CardSet {
+        let mut cs = CardSet::new();
+        for c in cards.iter() {
+            cs.insert(c);
+        }
+        return cs;
+    }
+
+    pub fn insert(&mut self, card: &Card) {
+        self.bits |= 1 << card.index();
+    }
+
+    pub fn remove(&mut self, card: &Card) {
+        self.bits &= !(1 << card.index());
+    }
+
+    pub fn contains(&self, card: &Card) -> bool {
+        return self.bits & (1 << card.index()) != 0;
+    }
+
+    pub fn len(&self) -> usize {
+        return self.bits.count_ones() as usize;
+    }
+
+    pub fn is_empty(&self) -> bool {
+        return self.bits == 0;
+    }
+
+    pub fn union(&self, other: &CardSet) -> CardSet {
+        return CardSet {
+            bits: self.bits | other.bits,
+        };
+    }
+
+    pub fn intersection(&self, other: &CardSet) -> CardSet {
+        return CardSet {
+            bits: self.bits & other.bits,
+        };
+    }
+
+    pub fn difference(&self, other: &CardSet) -> CardSet {
+        return CardSet {
+            bits: self.bits & !other.bits,
+        };
+    }
+
+    // Returns the cards in this set that are in the given suit.
+    pub fn suit(&self, suit: Suit) -> CardSet {
+        return CardSet {
+            bits: self.bits & (0x1fff << (suit.index() * 13)),
+        };
+    }
+
+    // Returns the cards in the set, ordered by index.
+    pub fn to_vec(&self) -> Vec<Card> {
+        let mut cards: Vec<Card> = Vec::with_capacity(self.len());
+        let mut bits = self.bits;
+        while bits != 0 {
+            cards.push(Card::from_index(bits.trailing_zeros() as usize));
+            bits &= bits - 1;
+        }
+        return cards;
+    }
 }
 
 pub fn cards_from_str(s: &str) -> Result<Vec<Card>, CardError> {
@@ -233,99 +334,248 @@ pub struct CardDistributionRequest {
     // fixed card that is not in `cards`.
 }
 
-fn _possible_card_distribution(
-    req: &CardDistributionRequest,
-    mut rng: impl Rng,
-) -> Result<Vec<Vec<Card>>, CardError> {
-    let num_players = req.constraints.len();
-    let mut result: Vec<Vec<Card>> = Vec::new();
-    let mut legal_cards: Vec<HashSet<Card>> = Vec::new();
-    // Create sets of possible cards for each player.
-    for (i, cs) in req.constraints.iter().enumerate() {
-        let mut legal_for_player: HashSet<Card> = HashSet::new();
-        // Add cards in suits that the player isn't known to be out of.
-        for &c in req.cards.iter() {
-            if !cs.voided_suits.contains(&c.suit) {
-                legal_for_player.insert(c);
-            }
+// Samples card distributions uniformly from all distributions that satisfy a
+// CardDistributionRequest. Cards in each suit are dealt independently given
+// how many of them each player gets, so the number of valid distributions is
+// a sum over per-suit counts of products of multinomial coefficients. Those
+// sums are computed once by dynamic programming over suits, keyed by how many
+// cards each player still needs. Sampling then chooses each suit's counts
+// with probability proportional to the number of distributions they allow,
+// so there's no rejection and no retrying.
+pub struct CardDistributionSampler {
+    num_players: usize,
+    fixed_cards: Vec<Vec<Card>>,
+    free_cards_by_suit: Vec<Vec<Card>>,
+    // Bitmask of suit indices each player may hold.
+    allowed_suits: Vec<u8>,
+    initial_needs: Vec<usize>,
+    // Ways to deal the free cards in suits `s` and after, keyed by `s` and
+    // the number of cards each player still needs. See `state_key`.
+    states: HashMap<u128, SamplerState>,
+}
+
+struct SamplerState {
+    num_ways: u128,
+    // Each possible split of suit `s` among the players, with the cumulative
+    // number of ways to deal suits `s` and after for it and all the previous
+    // splits, so a split can be sampled by searching for a random number.
+    splits: Vec<(Vec<usize>, u128)>,
+}
+
+// Enough for 13 cards in any suit.
+const FACTORIALS: [u128; 14] = [
+    1, 1, 2, 6, 24, 120, 720, 5040, 40320, 362880, 3628800, 39916800, 479001600, 6227020800,
+];
+
+fn multinomial(n: usize, counts: &[usize]) -> u128 {
+    let mut result = FACTORIALS[n];
+    for &k in counts.iter() {
+        result /= FACTORIALS[k];
+    }
+    return result;
+}
+
+// Packs the suit index and each player's need into 6 bits each, enough for
+// a whole deck. With at most 15 players that fits in 96 bits.
+fn state_key(suit_index: usize, needs: &[usize]) -> u128 {
+    let mut key = suit_index as u128;
+    for &n in needs.iter() {
+        debug_assert!(n < 64);
+        key = (key << 6) | (n as u128);
+    }
+    return key;
+}
+
+// Calls `f` with each way of splitting `n` cards among players, where player
+// `p` gets at most `needs[p]` cards and none if bit `suit_index` isn't set in
+// `allowed_suits[p]`. Stops early if `f` returns true.
+fn for_each_split(
+    n: usize,
+    suit_index: usize,
+    needs: &[usize],
+    allowed_suits: &[u8],
+    split: &mut Vec<usize>,
+    f: &mut dyn FnMut(&[usize]) -> bool,
+) -> bool {
+    let p = split.len();
+    if p == needs.len() {
+        return n == 0 && f(split);
+    }
+    let max_for_player = if allowed_suits[p] & (1 << suit_index) != 0 {
+        std::cmp::min(n, needs[p])
+    } else {
+        0
+    };
+    for k in 0..=max_for_player {
+        split.push(k);
+        let done = for_each_split(n - k, suit_index, needs, allowed_suits, split, f);
+        split.pop();
+        if done {
+            return true;
         }
-        // Remove cards that are fixed to other players.
-        for (j, other_cs) in req.constraints.iter().enumerate() {
-            if i != j {
-                for &c in other_cs.fixed_cards.iter() {
-                    legal_for_player.remove(&c);
-                }
-            }
+    }
+    return false;
+}
+
+impl CardDistributionSampler {
+    pub fn new(req: &CardDistributionRequest) -> Result<CardDistributionSampler, CardError> {
+        let num_players = req.constraints.len();
+        if num_players > 15 {
+            return Err(CardError::new("Too many players"));
         }
-        legal_cards.push(legal_for_player);
-        result.push(Vec::new());
-    }
-    // Assign cards randomly according to constraints.
-    loop {
-        let mut took_all = false;
-        for i in 0..num_players {
-            // If any player's remaining cards are forced, take them all.
-            let num_to_fill = req.constraints[i].num_cards - result[i].len();
-            if num_to_fill > 0 {
-                let num_legal = legal_cards[i].len();
-                if num_to_fill > num_legal {
-                    return Err(CardError::new("Cannot satisfy constraints"));
+        let all_cards = CardSet::from_cards(&req.cards);
+        let mut free_cards = all_cards;
+        let mut fixed_cards: Vec<Vec<Card>> = Vec::new();
+        let mut allowed_suits: Vec<u8> = Vec::new();
+        let mut initial_needs: Vec<usize> = Vec::new();
+        for cs in req.constraints.iter() {
+            // Fixed cards that aren't in `cards` have already been played.
+            let mut fixed = CardSet::new();
+            for c in cs.fixed_cards.iter() {
+                if all_cards.contains(c) {
+                    fixed.insert(c);
                 }
-                if num_to_fill == num_legal {
-                    let taken_cards = legal_cards[i].clone();
-                    for &c in taken_cards.iter() {
-                        result[i].push(c);
-                    }
-                    for &c in taken_cards.iter() {
-                        for j in 0..num_players {
-                            legal_cards[j].remove(&c);
-                        }
-                    }
-                    took_all = true;
-                    break;
+            }
+            // A card can't be fixed to more than one player.
+            if free_cards.intersection(&fixed) != fixed || fixed.len() > cs.num_cards {
+                return Err(CardError::new("Cannot satisfy constraints"));
+            }
+            free_cards = free_cards.difference(&fixed);
+            fixed_cards.push(fixed.to_vec());
+            let mut allowed: u8 = 0;
+            for s in ALL_SUITS.iter() {
+                if !cs.voided_suits.contains(s) {
+                    allowed |= 1 << s.index();
                 }
             }
+            allowed_suits.push(allowed);
+            initial_needs.push(cs.num_cards - fixed.len());
+        }
+        if initial_needs.iter().sum::<usize>() != free_cards.len() {
+            return Err(CardError::new("Cannot satisfy constraints"));
+        }
+        let mut sampler = CardDistributionSampler {
+            num_players: num_players,
+            fixed_cards: fixed_cards,
+            free_cards_by_suit: ALL_SUITS
+                .iter()
+                .map(|&s| free_cards.suit(s).to_vec())
+                .collect(),
+            allowed_suits: allowed_suits,
+            initial_needs: initial_needs.clone(),
+            states: HashMap::new(),
+        };
+        if sampler.count_ways(0, &initial_needs) == 0 {
+            return Err(CardError::new("Cannot satisfy constraints"));
+        }
+        return Ok(sampler);
+    }
+
+    fn count_ways(&mut self, suit_index: usize, needs: &[usize]) -> u128 {
+        if suit_index == ALL_SUITS.len() {
+            return if needs.iter().all(|&n| n == 0) { 1 } else { 0 };
+        }
+        let key = state_key(suit_index, needs);
+        if let Some(state) = self.states.get(&key) {
+            return state.num_ways;
+        }
+        let n = self.free_cards_by_suit[suit_index].len();
+        let allowed_suits = self.allowed_suits.clone();
+        let mut all_splits: Vec<Vec<usize>> = Vec::new();
+        for_each_split(
+            n,
+            suit_index,
+            needs,
+            &allowed_suits,
+            &mut Vec::new(),
+            &mut |split| {
+                all_splits.push(split.to_vec());
+                return false;
+            },
+        );
+        let mut total: u128 = 0;
+        let mut splits: Vec<(Vec<usize>, u128)> = Vec::new();
+        let mut next_needs: Vec<usize> = needs.to_vec();
+        for split in all_splits.into_iter() {
+            for p in 0..needs.len() {
+                next_needs[p] = needs[p] - split[p];
+            }
+            let rest = self.count_ways(suit_index + 1, &next_needs);
+            if rest > 0 {
+                total += multinomial(n, &split) * rest;
+                splits.push((split, total));
+            }
         }
-        if took_all {
-            continue;
+        self.states.insert(
+            key,
+            SamplerState {
+                num_ways: total,
+                splits: splits,
+            },
+        );
+        return total;
+    }
+
+    // Returns the number of distributions that satisfy the request.
+    pub fn num_distributions(&self) -> u128 {
+        return self.states[&state_key(0, &self.initial_needs)].num_ways;
+    }
+
+    // Samples a distribution and stores each player's cards in `hands`, which
+    // must have an entry for each player. This doesn't allocate, so it's
+    // cheaper than `sample` when many distributions are needed.
+    pub fn sample_card_sets(&self, mut rng: impl Rng, hands: &mut [CardSet]) {
+        assert_eq!(hands.len(), self.num_players);
+        let mut needs = [0usize; 16];
+        for p in 0..self.num_players {
+            hands[p] = CardSet::from_cards(&self.fixed_cards[p]);
+            needs[p] = self.initial_needs[p];
         }
-        // Nobody had a forced pick, choose one card for one player.
-        let mut chose_card = false;
-        for i in 0..num_players {
-            let num_to_fill = req.constraints[i].num_cards - result[i].len();
-            if num_to_fill > 0 {
-                let c = *random_from_set(&legal_cards[i], &mut rng);
-                result[i].push(c);
-                for j in 0..num_players {
-                    legal_cards[j].remove(&c);
+        for suit_index in 0..ALL_SUITS.len() {
+            // Only states with a nonzero count are reachable here.
+            let state = &self.states[&state_key(suit_index, &needs[..self.num_players])];
+            let r: u128 = rng.gen_range(0..state.num_ways);
+            let split_index = state.splits.iter().position(|(_, cum)| r < *cum).unwrap();
+            let split = &state.splits[split_index].0;
+            // Deal the suit's cards by partially shuffling them.
+            let suit_cards = &self.free_cards_by_suit[suit_index];
+            let mut cards = [Card::from_index(0); 13];
+            cards[..suit_cards.len()].copy_from_slice(suit_cards);
+            let mut start = 0;
+            for p in 0..self.num_players {
+                for _ in 0..split[p] {
+                    let i = rng.gen_range(start..suit_cards.len());
+                    cards.swap(start, i);
+                    hands[p].insert(&cards[start]);
+                    start += 1;
                 }
-                chose_card = true;
-                break;
+                needs[p] -= split[p];
             }
         }
-        if !chose_card {
-            // We've have assigned all the cards.
-            break;
+    }
+
+    pub fn sample(&self, rng: impl Rng) -> Vec<Vec<Card>> {
+        let mut hands = vec![CardSet::new(); self.num_players];
+        self.sample_card_sets(rng, &mut hands);
+        let mut result: Vec<Vec<Card>> = self.fixed_cards.clone();
+        for p in 0..self.num_players {
+            let fixed = CardSet::from_cards(&self.fixed_cards[p]);
+            result[p].extend(hands[p].difference(&fixed).to_vec());
         }
+        return result;
     }
-    return Ok(result);
 }
 
 pub fn possible_card_distribution(
     req: &CardDistributionRequest,
-    mut rng: impl Rng,
+    rng: impl Rng,
 ) -> Result<Vec<Vec<Card>>, CardError> {
-    for _ in 0..10000 {
-        let result = _possible_card_distribution(req, &mut rng);
-        if result.is_ok() {
-            return result;
-        }
+    let sampler = CardDistributionSampler::new(req);
+    if sampler.is_err() {
+        eprintln!("cards: {}", all_suit_groups(&req.cards));
+        eprintln!("constraints: {:?}", &req.constraints);
     }
-    println!("cards: {}", all_suit_groups(&req.cards));
-    println!("constraints: {:?}", &req.constraints);
-    return Err(CardError::new(
-        "Cannot satisfy constraints after 10000 attempts",
-    ));
+    return Ok(sampler?.sample(rng));
 }
 
 #[cfg(test)]
@@ -453,7 +703,7 @@ mod test {
             cards: cards,
             constraints: constraints,
         };
-        let dist = _possible_card_distribution(&req, &mut rng).unwrap();
+        let dist = possible_card_distribution(&req, &mut rng).unwrap();
         assert_eq!(dist.len(), 4);
         for cards in dist.iter() {
             assert_eq!(cards.len(), 3);
@@ -490,7 +740,6 @@ mod test {
     }
 
     #[test]
-    #[ignore]
     fn test_card_distribution_combination() {
         let mut rng: StdRng = SeedableRng::seed_from_u64(42);
         let cards = cv("AS KS QS JS TS 9S AH KH QH");
@@ -502,11 +751,113 @@ mod test {
             constraints: constraints,
         };
         // Players 1 and 2 have no hearts, so they must have all the spades
-        // between them, so player 0 can't have spades. Unfortunately the
-        // algorithm can't determine this yet.
-        let dist = _possible_card_distribution(&req, &mut rng).unwrap();
+        // between them, so player 0 can't have spades.
+        let dist = possible_card_distribution(&req, &mut rng).unwrap();
         assert!(dist[0].contains(&c("AH")));
         assert!(dist[0].contains(&c("KH")));
         assert!(dist[0].contains(&c("QH")));
     }
+
+    #[test]
+    fn test_card_distribution_impossible() {
+        let mut rng: StdRng = SeedableRng::seed_from_u64(42);
+        let cards = cv("2C 3C 4C 2H 3H 4H");
+        let mut constraints = make_constraints(2, 3);
+        constraints[0].voided_suits.insert(Suit::Hearts);
+        constraints[1].voided_suits.insert(Suit::Hearts);
+        let req = CardDistributionRequest {
+            cards: cards,
+            constraints: constraints,
+        };
+        assert!(possible_card_distribution(&req, &mut rng).is_err());
+    }
+
+    #[test]
+    fn test_card_distribution_count() {
+        let deck = Deck::new();
+        let req = CardDistributionRequest {
+            cards: deck.cards.clone(),
+            constraints: make_constraints(4, 13),
+        };
+        let sampler = CardDistributionSampler::new(&req).unwrap();
+        // 52! / (13!)^4
+        assert_eq!(sampler.num_distributions(), 53644737765488792839237440000);
+    }
+
+    #[test]
+    fn test_card_distribution_count_three_players() {
+        // 3 players get 17 cards each, without 2C.
+        let deck = Deck::new();
+        let cards: Vec<Card> = deck
+            .cards
+            .iter()
+            .filter(|&&card| card != c("2C"))
+            .cloned()
+            .collect();
+        let req = CardDistributionRequest {
+            cards: cards,
+            constraints: make_constraints(3, 17),
+        };
+        let sampler = CardDistributionSampler::new(&req).unwrap();
+        // 51! / (17!)^3
+        assert_eq!(sampler.num_distributions(), 34469858696831179429500);
+    }
+
+    #[test]
+    fn test_card_distribution_uniform() {
+        let mut rng: StdRng = SeedableRng::seed_from_u64(42);
+        let cards = cv("2C 3C 4C 2H 3H 4H");
+        let mut constraints = make_constraints(3, 2);
+        constraints[0].voided_suits.insert(Suit::Hearts);
+        let req = CardDistributionRequest {
+            cards: cards,
+            constraints: constraints,
+        };
+        let sampler = CardDistributionSampler::new(&req).unwrap();
+        // Player 0 gets 2 of the 3 clubs, and the other 4 cards are split
+        // evenly between players 1 and 2: 3 * (4 choose 2) = 18 ways.
+        assert_eq!(sampler.num_distributions(), 18);
+        let mut counts: HashMap<String, usize> = HashMap::new();
+        for _ in 0..18000 {
+            let dist = sampler.sample(&mut rng);
+            let mut key = String::new();
+            for hand in dist.iter() {
+                let mut sorted = hand.clone();
+                sorted.sort_by_key(|c| c.index());
+                key.push_str(&symbol_str_from_cards(&sorted));
+                key.push_str("|");
+            }
+            *counts.entry(key).or_insert(0) += 1;
+        }
+        assert_eq!(counts.len(), 18);
+        for &n in counts.values() {
+            assert!(n > 800 && n < 1200);
+        }
+    }
+
+    #[test]
+    fn test_card_index() {
+        for_each_card(|c| {
+            assert_eq!(Card::from_index(c.index()), *c);
+        });
+        assert_eq!(c("2C").index(), 0);
+        assert_eq!(c("AS").index(), 51);
+    }
+
+    #[test]
+    fn test_card_set() {
+        let mut cs = CardSet::from_cards(&cv("2C QS 7H AH"));
+        assert_eq!(cs.len(), 4);
+        assert!(cs.contains(&c("QS")));
+        assert!(!cs.contains(&c("QH")));
+        cs.remove(&c("QS"));
+        cs.insert(&c("3D"));
+        assert_eq!(cs.to_vec(), cv("2C 3D 7H AH"));
+        assert_eq!(cs.suit(Suit::Hearts).to_vec(), cv("7H AH"));
+        assert!(cs.suit(Suit::Spades).is_empty());
+        let other = CardSet::from_cards(&cv("7H 8H"));
+        assert_eq!(cs.union(&other).to_vec(), cv("2C 3D 7H 8H AH"));
+        assert_eq!(cs.intersection(&other).to_vec(), cv("7H"));
+        assert_eq!(cs.difference(&other).to_vec(), cv("2C 3D AH"));
+    }
 }
@@ -1,5 +1,12 @@
 use crate::card::*;
 use crate::hearts;
+use crate::hearts_deal_cache;
+use crate::hearts_endgame::{choose_card_endgame, EndgameParams};
+use crate::hearts_equity::MatchEquity;
+use crate::hearts_pass::{choose_cards_to_pass_simulation, PassSimulationParams};
+use crate::hearts_policy::LinearPolicy;
+use crate::hearts_rollout;
+use crate::hearts_rollout::{RolloutRound, RolloutStrategy};
 
 use rand::seq::SliceRandom;
 use rand::Rng;
@@ -10,6 +17,45 @@ use std::collections::HashSet;
 pub struct MonteCarloParams {
     pub num_hands: i32,
     pub rollouts_per_hand: i32,
+    // If set, switches to the exact endgame search when few cards are left.
+    pub endgame: Option<EndgameParams>,
+    // If set, stops giving rollouts to plays that are clearly worse than the
+    // best one, and stops early when only one play is left.
+    pub early_stopping: Option<EarlyStoppingParams>,
+    // Whether to reuse deals from the player's previous search in the same
+    // round. See hearts_deal_cache.
+    pub reuse_deals: bool,
+}
+
+// All legal plays are evaluated on the same deals, so each play that's still
+// being considered is compared with the current leader using the per-deal
+// differences in equity. A play is dropped when, with `z` standard errors of
+// confidence, it's not better than the leader by more than `tolerance`. The
+// tolerance lets nearly identical plays be dropped, such as adjacent cards.
+#[derive(Debug, Copy, Clone)]
+pub struct EarlyStoppingParams {
+    // Number of deals to evaluate before dropping any plays.
+    pub min_hands: i32,
+    pub z: f64,
+    pub tolerance: f64,
+}
+
+// With 50 deals of 20 rollouts, these use about half the rollouts of a full
+// search on average, and the cards they choose are nearly as good.
+pub const DEFAULT_EARLY_STOPPING: EarlyStoppingParams = EarlyStoppingParams {
+    min_hands: 10,
+    z: 2.5,
+    tolerance: 0.0005,
+};
+
+// Statistics about the work done to choose a card.
+#[derive(Debug, Default, Copy, Clone)]
+pub struct SearchStats {
+    // Number of rounds played out in Monte Carlo searches.
+    pub num_rollouts: u64,
+    // Number of deals that Monte Carlo search took from hearts_deal_cache
+    // instead of sampling.
+    pub num_reused_deals: u64,
 }
 
 pub enum CardToPlayStrategy {
@@ -19,6 +65,11 @@ pub enum CardToPlayStrategy {
     MonteCarloRandom(MonteCarloParams),
     MonteCarloAvoidPoints(MonteCarloParams),
     MonteCarloMixedRandomAvoidPoints(f64, MonteCarloParams),
+    // Plays the card that hearts_policy scores highest.
+    LinearPolicy(LinearPolicy),
+    // Monte Carlo search whose rollouts use a linear policy, with the given
+    // probability of random plays.
+    MonteCarloMixedRandomLinearPolicy(f64, LinearPolicy, MonteCarloParams),
 }
 
 // Interface for the inputs used to choose a card to play. CardToPlayDirectRequest is a struct
@@ -36,6 +87,9 @@ pub trait ChooseCardToPlayRequest {
     fn received_cards(&self) -> &Vec<Card>;
     fn current_player_index(&self) -> usize;
     fn legal_plays(&self) -> Vec<Card>;
+    // Identifies the round across requests, so that searches can reuse work
+    // from the player's earlier requests in the same round.
+    fn round_id(&self) -> Option<u64>;
 }
 
 pub struct CardToPlayDirectRequest {
@@ -47,6 +101,7 @@ pub struct CardToPlayDirectRequest {
     pub pass_direction: u32,
     pub passed_cards: Vec<Card>,
     pub received_cards: Vec<Card>,
+    pub round_id: Option<u64>,
 }
 
 impl CardToPlayDirectRequest {
@@ -76,6 +131,7 @@ impl ChooseCardToPlayRequest for CardToPlayDirectRequest {
     fn received_cards(&self) -> &Vec<Card> {&self.received_cards}
     fn current_player_index(&self) -> usize {self.current_player_index()}
     fn legal_plays(&self) -> Vec<Card> {self.legal_plays()}
+    fn round_id(&self) -> Option<u64> {self.round_id}
 }
 
 impl ChooseCardToPlayRequest for hearts::Round {
@@ -89,16 +145,27 @@ impl ChooseCardToPlayRequest for hearts::Round {
     fn received_cards(&self) -> &Vec<Card> {&self.current_player().received_cards}
     fn current_player_index(&self) -> usize {self.current_player_index()}
     fn legal_plays(&self) -> Vec<Card> {self.legal_plays()}
+    fn round_id(&self) -> Option<u64> {None}
 }
 
 pub struct CardsToPassRequest {
     pub rules: hearts::RuleSet,
     pub scores_before_round: Vec<i32>,
+    // Index into `scores_before_round` of the player who is passing.
+    pub player_index: usize,
     pub hand: Vec<Card>,
     pub direction: u32,
     pub num_cards: u32,
 }
 
+pub enum CardsToPassStrategy {
+    Random,
+    Heuristic,
+    // Simulates rounds with each candidate pass, with the given probability
+    // of random plays in rollouts.
+    Simulation(f64, PassSimulationParams),
+}
+
 // Returns the estimated probability of the player at `player_index` eventually
 // winning the match.
 pub fn match_equity_for_scores(scores: &[i32], max_score: u32, player_index: usize) -> f64 {
@@ -179,7 +246,9 @@ fn danger_for_card(card: &Card, ranks: &[Rank], req: &CardsToPassRequest) -> i32
     }
 }
 
-pub fn choose_cards_to_pass(req: &CardsToPassRequest) -> Vec<Card> {
+// Returns the cards in the hand, ordered from the one that's most important
+// to pass to the one that's least important.
+pub fn cards_by_pass_danger(req: &CardsToPassRequest) -> Vec<Card> {
     let mut suit_ranks: HashMap<Suit, Vec<Rank>> = HashMap::new();
     for suit in vec![Suit::Spades, Suit::Hearts, Suit::Diamonds, Suit::Clubs] {
         suit_ranks.insert(suit, ranks_for_suit(&req.hand, suit));
@@ -193,7 +262,28 @@ pub fn choose_cards_to_pass(req: &CardsToPassRequest) -> Vec<Card> {
     }
     let mut sorted_cards: Vec<Card> = req.hand.clone();
     sorted_cards.sort_by_key(|c| -card_danger.get(c).unwrap());
-    return sorted_cards[0..(req.num_cards as usize)].to_vec();
+    return sorted_cards;
+}
+
+pub fn choose_cards_to_pass(req: &CardsToPassRequest) -> Vec<Card> {
+    return cards_by_pass_danger(req)[0..(req.num_cards as usize)].to_vec();
+}
+
+pub fn choose_cards_to_pass_with_strategy(
+    req: &CardsToPassRequest,
+    strategy: &CardsToPassStrategy,
+    rng: impl Rng,
+) -> Vec<Card> {
+    return match strategy {
+        CardsToPassStrategy::Random => choose_cards_to_pass_random(req),
+        CardsToPassStrategy::Heuristic => choose_cards_to_pass(req),
+        CardsToPassStrategy::Simulation(p_rand, params) => choose_cards_to_pass_simulation(
+            req,
+            *params,
+            &RolloutStrategy::MixedRandomAvoidPoints(*p_rand),
+            rng,
+        ),
+    };
 }
 
 fn is_nonrecursive(strategy: &CardToPlayStrategy) -> bool {
@@ -201,6 +291,7 @@ fn is_nonrecursive(strategy: &CardToPlayStrategy) -> bool {
         CardToPlayStrategy::Random => true,
         CardToPlayStrategy::AvoidPoints => true,
         CardToPlayStrategy::MixedRandomAvoidPoints(_) => true,
+        CardToPlayStrategy::LinearPolicy(_) => true,
         _ => false,
     };
 }
@@ -220,33 +311,70 @@ fn choose_card_nonrecursive(
                 choose_card_avoid_points(req, rng)
             }
         }
+        CardToPlayStrategy::LinearPolicy(policy) => policy.choose_card_for_request(req, rng),
         _ => panic!("Invalid strategy"),
     };
 }
 
+fn endgame_params(strategy: &CardToPlayStrategy) -> Option<EndgameParams> {
+    return match strategy {
+        CardToPlayStrategy::MonteCarloRandom(mc_params) => mc_params.endgame,
+        CardToPlayStrategy::MonteCarloAvoidPoints(mc_params) => mc_params.endgame,
+        CardToPlayStrategy::MonteCarloMixedRandomAvoidPoints(_, mc_params) => mc_params.endgame,
+        CardToPlayStrategy::MonteCarloMixedRandomLinearPolicy(_, _, mc_params) => mc_params.endgame,
+        _ => None,
+    };
+}
+
 pub fn choose_card(
+    req: &impl ChooseCardToPlayRequest,
+    strategy: &CardToPlayStrategy,
+    rng: impl Rng,
+) -> Card {
+    return choose_card_with_stats(req, strategy, rng, &mut SearchStats::default());
+}
+
+// Like choose_card, and adds the work done to `stats`.
+pub fn choose_card_with_stats(
     req: &impl ChooseCardToPlayRequest,
     strategy: &CardToPlayStrategy,
     mut rng: impl Rng,
+    stats: &mut SearchStats,
 ) -> Card {
     if is_nonrecursive(strategy) {
         return choose_card_nonrecursive(req, strategy, &mut rng);
     }
+    if let Some(endgame) = endgame_params(strategy) {
+        if req.hand().len() <= endgame.max_hand_size {
+            return choose_card_endgame(req, endgame, &mut rng);
+        }
+    }
     match strategy {
         CardToPlayStrategy::MonteCarloRandom(mc_params) => {
-            choose_card_monte_carlo(req, *mc_params, &CardToPlayStrategy::Random, &mut rng)
+            choose_card_monte_carlo(req, *mc_params, &RolloutStrategy::Random, &mut rng, stats)
         }
 
         CardToPlayStrategy::MonteCarloAvoidPoints(mc_params) => {
-            choose_card_monte_carlo(req, *mc_params, &CardToPlayStrategy::AvoidPoints, &mut rng)
+            choose_card_monte_carlo(req, *mc_params, &RolloutStrategy::AvoidPoints, &mut rng, stats)
         }
 
         CardToPlayStrategy::MonteCarloMixedRandomAvoidPoints(p_rand, mc_params) => {
             choose_card_monte_carlo(
                 req,
                 *mc_params,
-                &CardToPlayStrategy::MixedRandomAvoidPoints(*p_rand),
+                &RolloutStrategy::MixedRandomAvoidPoints(*p_rand),
+                &mut rng,
+                stats,
+            )
+        }
+
+        CardToPlayStrategy::MonteCarloMixedRandomLinearPolicy(p_rand, policy, mc_params) => {
+            choose_card_monte_carlo(
+                req,
+                *mc_params,
+                &RolloutStrategy::MixedRandomLinearPolicy(*p_rand, *policy),
                 &mut rng,
+                stats,
             )
         }
 
@@ -369,34 +497,7 @@ pub fn choose_card_avoid_points(req: &impl ChooseCardToPlayRequest, mut rng: imp
     }
 }
 
-fn get_card_to_play(round: &hearts::Round, strategy: &CardToPlayStrategy, mut rng: impl Rng) -> Card {
-    return choose_card_nonrecursive(round, strategy, &mut rng);
-}
-
-fn do_rollout(round: &mut hearts::Round, strategy: &CardToPlayStrategy, mut rng: impl Rng) {
-    /*
-    println!("Rollout:");
-    for (i, p) in round.players.iter().enumerate() {
-        println!("P{}: {}", i, all_suit_groups(&p.hand));
-    }
-    */
-    while !round.is_over() {
-        let legal_plays = round.legal_plays();
-        if legal_plays.len() == 0 {
-            println!("No legal plays!?");
-            println!("Current player: {}", round.current_player_index());
-            println!("Hand: {}", all_suit_groups(&round.current_player().hand));
-            println!("Trick: {:?}", round.current_trick);
-        }
-        assert!(legal_plays.len() > 0);
-        // We have to split the strategies into recursive and nonrecursive, otherwise the compiler
-        // tries to infinitely recurse.
-        let card_to_play = get_card_to_play(round, strategy, &mut rng);
-        round.play_card(&card_to_play);
-    }
-}
-
-fn max_index<T: PartialOrd>(vals: &[T]) -> usize {
+pub fn max_index<T: PartialOrd>(vals: &[T]) -> usize {
     let mut max = &vals[0];
     let mut max_index: usize = 0;
     for i in 1..vals.len() {
@@ -408,7 +509,7 @@ fn max_index<T: PartialOrd>(vals: &[T]) -> usize {
     return max_index;
 }
 
-fn make_card_distribution_req(req: &impl ChooseCardToPlayRequest) -> CardDistributionRequest {
+pub fn make_card_distribution_req(req: &impl ChooseCardToPlayRequest) -> CardDistributionRequest {
     let num_players = req.rules().num_players;
     let mut seen_cards: HashSet<Card> = HashSet::new();
     for &c in req.hand().iter() {
@@ -485,16 +586,16 @@ fn make_card_distribution_req(req: &impl ChooseCardToPlayRequest) -> CardDistrib
     };
 }
 
-fn possible_round(
+pub fn possible_round(
     cc_req: &impl ChooseCardToPlayRequest,
-    dist_req: &CardDistributionRequest,
+    sampler: &CardDistributionSampler,
     rng: impl Rng,
-) -> Option<hearts::Round> {
-    let maybe_dist = possible_card_distribution(&dist_req, rng);
-    if maybe_dist.is_err() {
-        return None;
-    }
-    let dist = maybe_dist.unwrap();
+) -> hearts::Round {
+    return round_for_deal(cc_req, &sampler.sample(rng));
+}
+
+// Returns the round in `cc_req` with the other players holding the cards in `dist`.
+pub fn round_for_deal(cc_req: &impl ChooseCardToPlayRequest, dist: &[Vec<Card>]) -> hearts::Round {
     let cur_player = cc_req.current_player_index();
     let mut result_players: Vec<hearts::Player> = Vec::new();
     for i in 0..cc_req.rules().num_players {
@@ -505,7 +606,7 @@ fn possible_round(
         });
         result_players.push(hearts::Player::new(h));
     }
-    return Some(hearts::Round {
+    return hearts::Round {
         rules: cc_req.rules().clone(),
         players: result_players,
         initial_scores: cc_req.scores_before_round().clone(),
@@ -515,14 +616,15 @@ fn possible_round(
         // Ignore passed cards.
         pass_direction: 0,
         num_passed_cards: 0,
-    });
+    };
 }
 
 pub fn choose_card_monte_carlo(
     req: &impl ChooseCardToPlayRequest,
     mc_params: MonteCarloParams,
-    rollout_strategy: &CardToPlayStrategy,
+    rollout_strategy: &RolloutStrategy,
     mut rng: impl Rng,
+    stats: &mut SearchStats,
 ) -> Card {
     let legal_plays = req.legal_plays();
     assert!(legal_plays.len() > 0);
@@ -530,8 +632,14 @@ pub fn choose_card_monte_carlo(
         return legal_plays[0];
     }
     let pnum = req.current_player_index();
+    let num_players = req.rules().num_players;
+    let match_equity = MatchEquity::for_rules(req.rules());
     let mut equity_per_play: Vec<f64> = Vec::new();
     equity_per_play.resize(legal_plays.len(), 0.0);
+    // Average equity of each play in each deal, for early stopping.
+    let mut deal_equities: Vec<Vec<f64>> = vec![Vec::new(); legal_plays.len()];
+    // Indices into legal_plays of the plays that are still being evaluated.
+    let mut active: Vec<usize> = (0..legal_plays.len()).collect();
 
     /*
     print!("P{} options: ", pnum);
@@ -542,33 +650,126 @@ pub fn choose_card_monte_carlo(
     */
 
     let dist_req = make_card_distribution_req(req);
-    for _s in 0..mc_params.num_hands {
-        let maybe_hypo_round = possible_round(req, &dist_req, &mut rng);
-        if maybe_hypo_round.is_none() {
-            println!("MC failed, defaulting to choose_card_avoid_points");
-            return choose_card_avoid_points(req, &mut rng);
+    // If reusing deals, ones from the player's previous search in the round
+    // that are still possible are used first. Counting the possible
+    // distributions for the sampler costs much more than sampling, so it's
+    // only done if more deals are needed, after which each sample is cheap.
+    let cached_deals = if mc_params.reuse_deals {
+        hearts_deal_cache::take_deals(req, &dist_req)
+    } else {
+        Vec::new()
+    };
+    let played = hearts_deal_cache::cards_played_by_player(req);
+    let mut sampler: Option<CardDistributionSampler> = None;
+    let mut deals: Vec<Vec<CardSet>> = Vec::new();
+    for s in 0..mc_params.num_hands {
+        let hands = if (s as usize) < cached_deals.len() {
+            stats.num_reused_deals += 1;
+            hearts_deal_cache::current_hands(&cached_deals[s as usize], &played)
+        } else {
+            if sampler.is_none() {
+                match CardDistributionSampler::new(&dist_req) {
+                    Ok(smp) => sampler = Some(smp),
+                    Err(_) => {
+                        eprintln!("MC failed, defaulting to choose_card_avoid_points");
+                        return choose_card_avoid_points(req, &mut rng);
+                    }
+                }
+            }
+            let mut hands = vec![CardSet::new(); num_players];
+            sampler
+                .as_ref()
+                .unwrap()
+                .sample_card_sets(&mut rng, &mut hands);
+            hands
+        };
+        if mc_params.reuse_deals {
+            deals.push(hearts_deal_cache::starting_hands(req, &played, &hands));
         }
-        let hypo_round = maybe_hypo_round.unwrap();
-        for ci in 0..legal_plays.len() {
-            let mut hypo_copy = hypo_round.clone();
-            hypo_copy.play_card(&legal_plays[ci]);
+        let dist: Vec<Vec<Card>> = hands.iter().map(|h| h.to_vec()).collect();
+        let hypo_round = round_for_deal(req, &dist);
+        // Rollouts use the compact RolloutRound, which can be copied and
+        // played without allocating.
+        let rollout_round = RolloutRound::from_round(&hypo_round);
+        for &ci in active.iter() {
+            let deal_start_equity = equity_per_play[ci];
+            let mut after_play = rollout_round;
+            after_play.play_card(&legal_plays[ci]);
             // println!("Card: {}", legal_plays[ci].symbol_string());
             for _r in 0..mc_params.rollouts_per_hand {
-                let mut rh = hypo_copy.clone();
-                do_rollout(&mut rh, &rollout_strategy, &mut rng);
-                let round_points = rh.points_taken();
-                let mut scores_after_round = req.scores_before_round().clone();
-                for p in 0..req.rules().num_players {
-                    scores_after_round[p] += round_points[p];
+                let mut rr = after_play;
+                rr.play_to_end(rollout_strategy, &mut rng);
+                let round_points = rr.points_taken();
+                let mut scores_after_round = [0i32; hearts_rollout::MAX_PLAYERS];
+                for p in 0..num_players {
+                    scores_after_round[p] = req.scores_before_round()[p] + round_points[p];
                 }
                 equity_per_play[ci] +=
-                    match_equity_for_scores(&scores_after_round, req.rules().point_limit, pnum);
+                    match_equity.equity(&scores_after_round[..num_players], pnum);
                 // println!("Scores: {:?}", &scores_after_round);
             }
+            stats.num_rollouts += mc_params.rollouts_per_hand as u64;
+            deal_equities[ci].push(
+                (equity_per_play[ci] - deal_start_equity) / (mc_params.rollouts_per_hand as f64),
+            );
         }
+        if let Some(es) = mc_params.early_stopping {
+            if s + 1 >= es.min_hands {
+                active = remaining_plays(&active, &deal_equities, es);
+                if active.len() == 1 {
+                    break;
+                }
+            }
+        }
+    }
+    if mc_params.reuse_deals {
+        hearts_deal_cache::store_deals(req, deals);
     }
     // println!("MC equities: {:?}", equity_per_play);
-    return legal_plays[max_index(&equity_per_play)];
+    // Plays that are still active have been evaluated on the same deals, and
+    // dropped plays are worse than at least one of them.
+    let best = *active
+        .iter()
+        .max_by(|&&a, &&b| equity_per_play[a].partial_cmp(&equity_per_play[b]).unwrap())
+        .unwrap();
+    return legal_plays[best];
+}
+
+// Returns the plays in `active` that can't yet be ruled out as worse than the
+// one with the highest average equity. See EarlyStoppingParams.
+fn remaining_plays(
+    active: &[usize],
+    deal_equities: &[Vec<f64>],
+    es: EarlyStoppingParams,
+) -> Vec<usize> {
+    let num_deals = deal_equities[active[0]].len();
+    if num_deals < 2 {
+        return active.to_vec();
+    }
+    let total = |ci: usize| deal_equities[ci].iter().sum::<f64>();
+    let leader = *active
+        .iter()
+        .max_by(|&&a, &&b| total(a).partial_cmp(&total(b)).unwrap())
+        .unwrap();
+    let mut remaining: Vec<usize> = Vec::new();
+    for &ci in active.iter() {
+        if ci == leader {
+            remaining.push(ci);
+            continue;
+        }
+        // Per-deal advantage of this play over the leader.
+        let diffs: Vec<f64> = (0..num_deals)
+            .map(|d| deal_equities[ci][d] - deal_equities[leader][d])
+            .collect();
+        let mean = diffs.iter().sum::<f64>() / (num_deals as f64);
+        let variance =
+            diffs.iter().map(|x| (x - mean) * (x - mean)).sum::<f64>() / ((num_deals - 1) as f64);
+        let upper_bound = mean + es.z * (variance / (num_deals as f64)).sqrt();
+        if upper_bound >= es.tolerance {
+            remaining.push(ci);
+        }
+    }
+    return remaining;
 }
 
 // Tests for what card to play are in ffi_test.py.
@@ -580,6 +781,30 @@ mod test {
         cards_from_str(s).unwrap()
     }
 
+    #[test]
+    fn test_remaining_plays() {
+        let es = EarlyStoppingParams {
+            min_hands: 2,
+            z: 2.0,
+            tolerance: 0.001,
+        };
+        let deal_equities = vec![
+            vec![0.30, 0.20, 0.25, 0.22],
+            // Always much worse than the first play.
+            vec![0.10, 0.05, 0.08, 0.06],
+            // Sometimes better and sometimes worse, so not ruled out.
+            vec![0.40, 0.10, 0.33, 0.12],
+            // Nearly the same as the first play.
+            vec![0.2999, 0.1999, 0.2499, 0.2199],
+        ];
+        assert_eq!(
+            remaining_plays(&[0, 1, 2, 3], &deal_equities, es),
+            vec![0, 2]
+        );
+        // Dropped plays aren't considered again.
+        assert_eq!(remaining_plays(&[0, 2], &deal_equities, es), vec![0, 2]);
+    }
+
     #[test]
     fn test_match_equity() {
         assert_eq!(1.0, match_equity_for_scores(&vec![50, 60, 100, 60], 100, 0));
@@ -617,6 +842,7 @@ mod test {
         let req = CardsToPassRequest {
             rules: rules.clone(),
             scores_before_round: vec![0, 0, 0, 0],
+            player_index: 0,
             hand: c("JS 5S 4S 3S 8H 5H 3H AD KD TD 7C 6C 4C"),
             direction: 1,
             num_cards: 3,
@@ -630,6 +856,7 @@ mod test {
         let req = CardsToPassRequest {
             rules: rules.clone(),
             scores_before_round: vec![0, 0, 0, 0],
+            player_index: 0,
             hand: c("AS QS JS AH 8H 2H 6D 5D 4D 3D 6C 5C 4C"),
             direction: 1,
             num_cards: 3,
@@ -643,6 +870,7 @@ mod test {
         let req = CardsToPassRequest {
             rules: rules.clone(),
             scores_before_round: vec![0, 0, 0, 0],
+            player_index: 0,
             hand: c("AS QS JS AH 8H 2H 6D 5D 4D 3D 6C 5C 4C"),
             direction: 3,
             num_cards: 3,
@@ -656,6 +884,7 @@ mod test {
         let req = CardsToPassRequest {
             rules: rules.clone(),
             scores_before_round: vec![0, 0, 0, 0],
+            player_index: 0,
             hand: c("AS KS JS AH 8H 2H 6D 5D 4D 3D 6C 5C 4C"),
             direction: 3,
             num_cards: 3,
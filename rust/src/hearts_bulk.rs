@@ -0,0 +1,431 @@
+use crate::card::*;
+use crate::hearts;
+use crate::hearts_ai;
+use crate::hearts_policy;
+use crate::hearts_rollout::{RolloutRound, RolloutStrategy};
+
+use rand::rngs::StdRng;
+use rand::SeedableRng;
+use std::thread;
+
+// Simulates many rounds or matches at once for data analysis, reading deals
+// from and writing results to arrays owned by the caller, so that callers
+// like NumPy don't create objects or buffers per game. A deal is 52 bytes,
+// where byte i is the seat (0 to 3) that holds the card with index i; see
+// Card::index. Each game has its own random seed, so results are the same
+// for the same inputs regardless of how games are split between threads.
+// Cards are played with the rollout strategies, and passed with
+// hearts_ai::choose_cards_to_pass.
+
+pub const NUM_PLAYERS: usize = 4;
+pub const DEAL_SIZE: usize = 52;
+
+// The rules block is the point limit followed by 0 or 1 for each of
+// points_on_first_trick, queen_breaks_hearts, jd_minus_10 and shooting_disabled.
+pub const RULES_BLOCK_SIZE: usize = 5;
+
+// Pass directions for successive rounds of a match: left, right, across, keep.
+const MATCH_PASS_DIRECTIONS: [u32; NUM_PLAYERS] = [1, 3, 2, 0];
+
+pub fn rules_from_block(block: &[i32]) -> hearts::RuleSet {
+    assert_eq!(block.len(), RULES_BLOCK_SIZE);
+    return hearts::RuleSet {
+        point_limit: block[0] as u32,
+        points_on_first_trick: block[1] != 0,
+        queen_breaks_hearts: block[2] != 0,
+        jd_minus_10: block[3] != 0,
+        moon_shooting: if block[4] != 0 {
+            hearts::MoonShooting::Disabled
+        } else {
+            hearts::MoonShooting::OpponentsPlus26
+        },
+        ..hearts::RuleSet::default()
+    };
+}
+
+// Strategy codes: 0 is random, 1 is avoid points, 2 mixes random and avoid
+// points, and 3 mixes random and the linear policy. The mixed strategies play
+// randomly with probability `p_random`.
+pub fn strategy_from_code(code: i32, p_random: f64) -> Option<RolloutStrategy> {
+    return match code {
+        0 => Some(RolloutStrategy::Random),
+        1 => Some(RolloutStrategy::AvoidPoints),
+        2 => Some(RolloutStrategy::MixedRandomAvoidPoints(p_random)),
+        3 => Some(RolloutStrategy::MixedRandomLinearPolicy(
+            p_random,
+            hearts_policy::current_linear_policy(),
+        )),
+        _ => None,
+    };
+}
+
+// Returns whether every deal gives 13 cards to each player.
+pub fn are_deals_valid(deals: &[u8]) -> bool {
+    if deals.len() % DEAL_SIZE != 0 {
+        return false;
+    }
+    return deals.chunks(DEAL_SIZE).all(|deal| {
+        let mut counts = [0usize; NUM_PLAYERS];
+        for &seat in deal.iter() {
+            if seat as usize >= NUM_PLAYERS {
+                return false;
+            }
+            counts[seat as usize] += 1;
+        }
+        counts.iter().all(|&c| c == DEAL_SIZE / NUM_PLAYERS)
+    });
+}
+
+fn hands_from_deal(deal: &[u8]) -> [CardSet; NUM_PLAYERS] {
+    let mut hands = [CardSet::new(); NUM_PLAYERS];
+    for (i, &seat) in deal.iter().enumerate() {
+        hands[seat as usize].bits |= 1 << i;
+    }
+    return hands;
+}
+
+fn pass_cards(
+    rules: &hearts::RuleSet,
+    hands: &mut [CardSet; NUM_PLAYERS],
+    direction: u32,
+    scores: &[i32; NUM_PLAYERS],
+) {
+    let passes: Vec<Vec<Card>> = (0..NUM_PLAYERS)
+        .map(|p| {
+            hearts_ai::choose_cards_to_pass(&hearts_ai::CardsToPassRequest {
+                rules: rules.clone(),
+                scores_before_round: scores.to_vec(),
+                player_index: p,
+                hand: hands[p].to_vec(),
+                direction: direction,
+                num_cards: 3,
+            })
+        })
+        .collect();
+    for (p, cards) in passes.iter().enumerate() {
+        let dest = (p + direction as usize) % NUM_PLAYERS;
+        for c in cards.iter() {
+            hands[p].remove(c);
+            hands[dest].insert(c);
+        }
+    }
+}
+
+// Plays a round and returns the points taken by each player and who shot
+// the moon, if anyone. If `plays_out` is given, writes the index of each
+// card played to it in the order they were played.
+fn play_round(
+    rules: &hearts::RuleSet,
+    strategy: &RolloutStrategy,
+    hands: &[CardSet; NUM_PLAYERS],
+    rng: &mut StdRng,
+    mut plays_out: Option<&mut [u8]>,
+) -> ([i32; NUM_PLAYERS], Option<usize>) {
+    let mut round = RolloutRound::from_hands(rules, hands);
+    let mut num_plays = 0;
+    while !round.is_over() {
+        let card = round.choose_card(strategy, &mut *rng);
+        if let Some(plays) = plays_out.as_mut() {
+            plays[num_plays] = card.index() as u8;
+        }
+        round.play_card(&card);
+        num_plays += 1;
+    }
+    let mut points = [0i32; NUM_PLAYERS];
+    points.copy_from_slice(&round.points_taken()[..NUM_PLAYERS]);
+    // Only the shooter's points go down when the moon is shot.
+    let shooter = (0..NUM_PLAYERS).find(|&p| points[p] < round.points_so_far()[p]);
+    return (points, shooter);
+}
+
+fn games_per_thread(num_games: usize, num_threads: usize) -> usize {
+    let num_threads = if num_threads > 0 {
+        num_threads
+    } else {
+        thread::available_parallelism().map_or(1, |n| n.get())
+    };
+    return ((num_games + num_threads - 1) / num_threads).max(1);
+}
+
+// Plays one round for each deal in `deals`, passing in `pass_direction`
+// first if it's not 0. Writes the points taken by each player to
+// `points_out`, the seat that shot the moon or -1 to `shooters_out`, and if
+// given, the index of each card played in order to `plays_out`, which has 52
+// bytes per game. Uses `num_threads` threads, or one per core if it's 0.
+pub fn simulate_rounds(
+    rules: &hearts::RuleSet,
+    strategy: &RolloutStrategy,
+    pass_direction: u32,
+    deals: &[u8],
+    seeds: &[u64],
+    points_out: &mut [i32],
+    shooters_out: &mut [i8],
+    plays_out: Option<&mut [u8]>,
+    num_threads: usize,
+) {
+    let num_games = seeds.len();
+    assert_eq!(deals.len(), num_games * DEAL_SIZE);
+    assert_eq!(points_out.len(), num_games * NUM_PLAYERS);
+    assert_eq!(shooters_out.len(), num_games);
+    let chunk = games_per_thread(num_games, num_threads);
+    let num_chunks = (num_games + chunk - 1) / chunk;
+    let plays_chunks: Vec<Option<&mut [u8]>> = match plays_out {
+        Some(plays) => {
+            assert_eq!(plays.len(), num_games * DEAL_SIZE);
+            plays.chunks_mut(chunk * DEAL_SIZE).map(Some).collect()
+        }
+        None => (0..num_chunks).map(|_| None).collect(),
+    };
+    thread::scope(|scope| {
+        let chunks = deals
+            .chunks(chunk * DEAL_SIZE)
+            .zip(seeds.chunks(chunk))
+            .zip(points_out.chunks_mut(chunk * NUM_PLAYERS))
+            .zip(shooters_out.chunks_mut(chunk))
+            .zip(plays_chunks.into_iter());
+        for ((((deals, seeds), points_out), shooters_out), mut plays_out) in chunks {
+            scope.spawn(move || {
+                let no_scores = [0i32; NUM_PLAYERS];
+                for g in 0..seeds.len() {
+                    let mut rng: StdRng = SeedableRng::seed_from_u64(seeds[g]);
+                    let mut hands = hands_from_deal(&deals[g * DEAL_SIZE..(g + 1) * DEAL_SIZE]);
+                    if pass_direction > 0 {
+                        pass_cards(rules, &mut hands, pass_direction, &no_scores);
+                    }
+                    let plays = plays_out
+                        .as_mut()
+                        .map(|p| &mut p[g * DEAL_SIZE..(g + 1) * DEAL_SIZE]);
+                    let (points, shooter) = play_round(rules, strategy, &hands, &mut rng, plays);
+                    points_out[g * NUM_PLAYERS..(g + 1) * NUM_PLAYERS].copy_from_slice(&points);
+                    shooters_out[g] = shooter.map_or(-1, |p| p as i8);
+                }
+            });
+        }
+    });
+}
+
+// Plays a match for each deal in `deals`, which is used for the first round.
+// Later rounds are dealt randomly, and pass directions rotate as in the
+// Python app's Match. Writes each player's final score to `scores_out`, the
+// number of rounds to `rounds_out`, and the number of times each player shot
+// the moon to `moon_shots_out`.
+pub fn simulate_matches(
+    rules: &hearts::RuleSet,
+    strategy: &RolloutStrategy,
+    deals: &[u8],
+    seeds: &[u64],
+    scores_out: &mut [i32],
+    rounds_out: &mut [i32],
+    moon_shots_out: &mut [i32],
+    num_threads: usize,
+) {
+    let num_games = seeds.len();
+    assert_eq!(deals.len(), num_games * DEAL_SIZE);
+    assert_eq!(scores_out.len(), num_games * NUM_PLAYERS);
+    assert_eq!(rounds_out.len(), num_games);
+    assert_eq!(moon_shots_out.len(), num_games * NUM_PLAYERS);
+    let chunk = games_per_thread(num_games, num_threads);
+    thread::scope(|scope| {
+        let chunks = deals
+            .chunks(chunk * DEAL_SIZE)
+            .zip(seeds.chunks(chunk))
+            .zip(scores_out.chunks_mut(chunk * NUM_PLAYERS))
+            .zip(rounds_out.chunks_mut(chunk))
+            .zip(moon_shots_out.chunks_mut(chunk * NUM_PLAYERS));
+        for ((((deals, seeds), scores_out), rounds_out), moon_shots_out) in chunks {
+            scope.spawn(move || {
+                let mut deck = Deck::new();
+                for g in 0..seeds.len() {
+                    let mut rng: StdRng = SeedableRng::seed_from_u64(seeds[g]);
+                    let mut hands = hands_from_deal(&deals[g * DEAL_SIZE..(g + 1) * DEAL_SIZE]);
+                    let mut scores = [0i32; NUM_PLAYERS];
+                    let mut moon_shots = [0i32; NUM_PLAYERS];
+                    let mut num_rounds = 0;
+                    while scores.iter().all(|&s| s < rules.point_limit as i32) {
+                        if num_rounds > 0 {
+                            deck.shuffle(&mut rng);
+                            for (p, cards) in deck.cards.chunks(DEAL_SIZE / NUM_PLAYERS).enumerate()
+                            {
+                                hands[p] = CardSet::from_cards(cards);
+                            }
+                        }
+                        let direction = MATCH_PASS_DIRECTIONS[num_rounds % NUM_PLAYERS];
+                        if direction > 0 {
+                            pass_cards(rules, &mut hands, direction, &scores);
+                        }
+                        let (points, shooter) = play_round(rules, strategy, &hands, &mut rng, None);
+                        for p in 0..NUM_PLAYERS {
+                            scores[p] += points[p];
+                        }
+                        if let Some(p) = shooter {
+                            moon_shots[p] += 1;
+                        }
+                        num_rounds += 1;
+                    }
+                    scores_out[g * NUM_PLAYERS..(g + 1) * NUM_PLAYERS].copy_from_slice(&scores);
+                    rounds_out[g] = num_rounds as i32;
+                    moon_shots_out[g * NUM_PLAYERS..(g + 1) * NUM_PLAYERS]
+                        .copy_from_slice(&moon_shots);
+                }
+            });
+        }
+    });
+}
+
+#[cfg(test)]
+mod test {
+    use super::*;
+
+    fn random_deals(num_games: usize, seed: u64) -> Vec<u8> {
+        let mut rng: StdRng = SeedableRng::seed_from_u64(seed);
+        let mut deck = Deck::new();
+        let mut deals = vec![0u8; num_games * DEAL_SIZE];
+        for deal in deals.chunks_mut(DEAL_SIZE) {
+            deck.shuffle(&mut rng);
+            for (i, c) in deck.cards.iter().enumerate() {
+                deal[c.index()] = (i / 13) as u8;
+            }
+        }
+        return deals;
+    }
+
+    #[test]
+    fn test_rules_from_block() {
+        let rules = rules_from_block(&[50, 0, 1, 1, 0]);
+        assert_eq!(rules.point_limit, 50);
+        assert!(!rules.points_on_first_trick);
+        assert!(rules.queen_breaks_hearts);
+        assert!(rules.jd_minus_10);
+        assert_eq!(rules.moon_shooting, hearts::MoonShooting::OpponentsPlus26);
+        let rules = rules_from_block(&[100, 1, 0, 0, 1]);
+        assert!(rules.points_on_first_trick);
+        assert_eq!(rules.moon_shooting, hearts::MoonShooting::Disabled);
+    }
+
+    #[test]
+    fn test_are_deals_valid() {
+        let mut deals = random_deals(3, 1);
+        assert!(are_deals_valid(&deals));
+        assert!(!are_deals_valid(&deals[1..]));
+        deals[DEAL_SIZE + 5] = (deals[DEAL_SIZE + 5] + 1) % 4;
+        assert!(!are_deals_valid(&deals));
+        deals[DEAL_SIZE + 5] = 4;
+        assert!(!are_deals_valid(&deals));
+    }
+
+    #[test]
+    fn test_simulate_rounds() {
+        let rules = hearts::RuleSet::default();
+        let strategy = RolloutStrategy::MixedRandomAvoidPoints(0.1);
+        let num_games = 50;
+        let deals = random_deals(num_games, 2);
+        let seeds: Vec<u64> = (0..num_games as u64).collect();
+        let mut points = vec![0i32; num_games * NUM_PLAYERS];
+        let mut shooters = vec![0i8; num_games];
+        let mut plays = vec![0u8; num_games * DEAL_SIZE];
+        simulate_rounds(
+            &rules,
+            &strategy,
+            0,
+            &deals,
+            &seeds,
+            &mut points,
+            &mut shooters,
+            Some(&mut plays),
+            3,
+        );
+        for g in 0..num_games {
+            let game_points = &points[g * NUM_PLAYERS..(g + 1) * NUM_PLAYERS];
+            let total: i32 = game_points.iter().sum();
+            if shooters[g] >= 0 {
+                assert_eq!(total, 78);
+                assert_eq!(game_points[shooters[g] as usize], 0);
+            } else {
+                assert_eq!(total, 26);
+            }
+            let deal = &deals[g * DEAL_SIZE..(g + 1) * DEAL_SIZE];
+            let game_plays = &plays[g * DEAL_SIZE..(g + 1) * DEAL_SIZE];
+            // 2C is led by its holder, and every card is played once.
+            assert_eq!(game_plays[0] as usize, hearts::TWO_OF_CLUBS.index());
+            let played = game_plays.iter().fold(0u64, |bits, &c| bits | (1 << c));
+            assert_eq!(played, (1 << 52) - 1);
+            // The first trick is played in seat order.
+            for i in 1..NUM_PLAYERS {
+                let seat = |c: u8| deal[c as usize] as usize;
+                assert_eq!(seat(game_plays[i]), (seat(game_plays[0]) + i) % NUM_PLAYERS);
+            }
+        }
+
+        // Splitting games differently between threads doesn't change results.
+        let mut other_points = vec![0i32; num_games * NUM_PLAYERS];
+        let mut other_shooters = vec![0i8; num_games];
+        simulate_rounds(
+            &rules,
+            &strategy,
+            0,
+            &deals,
+            &seeds,
+            &mut other_points,
+            &mut other_shooters,
+            None,
+            1,
+        );
+        assert_eq!(other_points, points);
+        assert_eq!(other_shooters, shooters);
+    }
+
+    #[test]
+    fn test_pass_cards() {
+        let rules = hearts::RuleSet::default();
+        let deals = random_deals(1, 3);
+        let dealt = hands_from_deal(&deals);
+        let mut hands = dealt;
+        pass_cards(&rules, &mut hands, 1, &[0; NUM_PLAYERS]);
+        for p in 0..NUM_PLAYERS {
+            assert_eq!(hands[p].len(), 13);
+            let passed = dealt[p].difference(&hands[p]);
+            let received = hands[p].difference(&dealt[p]);
+            assert_eq!(passed.len(), 3);
+            // Passing left, so the player on the right passes to this one.
+            assert_eq!(
+                received,
+                dealt[(p + 3) % NUM_PLAYERS].intersection(&hands[p])
+            );
+        }
+    }
+
+    #[test]
+    fn test_simulate_matches() {
+        let rules = hearts::RuleSet {
+            point_limit: 50,
+            ..hearts::RuleSet::default()
+        };
+        let strategy = RolloutStrategy::MixedRandomAvoidPoints(0.1);
+        let num_games = 10;
+        let deals = random_deals(num_games, 4);
+        let seeds: Vec<u64> = (100..100 + num_games as u64).collect();
+        let mut scores = vec![0i32; num_games * NUM_PLAYERS];
+        let mut rounds = vec![0i32; num_games];
+        let mut moon_shots = vec![0i32; num_games * NUM_PLAYERS];
+        simulate_matches(
+            &rules,
+            &strategy,
+            &deals,
+            &seeds,
+            &mut scores,
+            &mut rounds,
+            &mut moon_shots,
+            4,
+        );
+        for g in 0..num_games {
+            let game_scores = &scores[g * NUM_PLAYERS..(g + 1) * NUM_PLAYERS];
+            assert!(*game_scores.iter().max().unwrap() >= 50);
+            assert!(rounds[g] >= 2);
+            let num_moon_shots: i32 = moon_shots[g * NUM_PLAYERS..(g + 1) * NUM_PLAYERS]
+                .iter()
+                .sum();
+            let total: i32 = game_scores.iter().sum();
+            assert_eq!(total, 26 * rounds[g] + 52 * num_moon_shots);
+        }
+    }
+}
@@ -0,0 +1,415 @@
+// Keeps the deals that Monte Carlo search sampled for each player in recent
+// rounds, so that the player's next search in the same round can reuse the
+// ones that are still possible instead of sampling all of them again.
+//
+// A deal is stored as the hands the other players held at the start of the
+// round. Requests are matched by the round ID from the request and the
+// player, and a request only reuses deals that were sampled after a prefix
+// of its plays, so it knows everything the earlier search knew. Deals that
+// were sampled uniformly from the distributions possible then, and that are
+// still possible now, are a uniform sample of the distributions possible
+// now, just as if they had been sampled fresh.
+//
+// Deals sampled for other players can't be reused, because they almost never
+// give the player the hand it actually has.
+//
+// This is only used if MonteCarloParams::reuse_deals is set. With 50 deals
+// per search, few of a player's deals are still possible by its next turn
+// (about 2 on average), and no difference in time per decision has been
+// measured, so it's off by default.
+
+use crate::card::*;
+use crate::hearts_ai::ChooseCardToPlayRequest;
+
+use std::sync::Mutex;
+
+// Number of (round, player) pairs to keep deals for. Entries that haven't
+// been used for the longest are dropped first.
+pub const MAX_CACHED_SEARCHES: usize = 64;
+
+struct CachedDeals {
+    round_id: u64,
+    player: usize,
+    // Every card played in the round when the deals were sampled, in order.
+    plays: Vec<Card>,
+    // Starting hands of each player, with an empty set for `player`.
+    deals: Vec<Vec<CardSet>>,
+    last_used: u64,
+}
+
+struct DealCache {
+    entries: Vec<CachedDeals>,
+    // Incremented on each access, for finding the least recently used entry.
+    clock: u64,
+}
+
+static CACHE: Mutex<DealCache> = Mutex::new(DealCache {
+    entries: Vec::new(),
+    clock: 0,
+});
+
+fn plays_in_order(req: &impl ChooseCardToPlayRequest) -> Vec<Card> {
+    let mut plays: Vec<Card> = Vec::new();
+    for t in req.prev_tricks().iter() {
+        plays.extend(t.cards.iter());
+    }
+    plays.extend(req.current_trick().cards.iter());
+    return plays;
+}
+
+// Returns the cards each player has played in the round.
+pub fn cards_played_by_player(req: &impl ChooseCardToPlayRequest) -> Vec<CardSet> {
+    let num_players = req.rules().num_players;
+    let mut played = vec![CardSet::new(); num_players];
+    for t in req.prev_tricks().iter() {
+        for (i, c) in t.cards.iter().enumerate() {
+            played[(t.leader + i) % num_players].insert(c);
+        }
+    }
+    let trick = req.current_trick();
+    for (i, c) in trick.cards.iter().enumerate() {
+        played[(trick.leader + i) % num_players].insert(c);
+    }
+    return played;
+}
+
+// Returns the starting hands of the other players for `hands`, which are the
+// cards they hold now as returned by a CardDistributionSampler.
+pub fn starting_hands(
+    req: &impl ChooseCardToPlayRequest,
+    played: &[CardSet],
+    hands: &[CardSet],
+) -> Vec<CardSet> {
+    let cur = req.current_player_index();
+    return (0..hands.len())
+        .map(|p| {
+            if p == cur {
+                CardSet::new()
+            } else {
+                hands[p].union(&played[p])
+            }
+        })
+        .collect();
+}
+
+// Returns the cards each player holds now for the starting hands in `deal`.
+pub fn current_hands(deal: &[CardSet], played: &[CardSet]) -> Vec<CardSet> {
+    return deal
+        .iter()
+        .zip(played.iter())
+        .map(|(h, p)| h.difference(p))
+        .collect();
+}
+
+// Returns whether the starting hands in `deal` could have been dealt given
+// the cards each player has played and the constraints in `dist_req`.
+pub fn is_consistent(
+    deal: &[CardSet],
+    played: &[CardSet],
+    cur: usize,
+    dist_req: &CardDistributionRequest,
+) -> bool {
+    let unseen = CardSet::from_cards(&dist_req.cards);
+    for (p, cs) in dist_req.constraints.iter().enumerate() {
+        if p == cur {
+            continue;
+        }
+        if deal[p].intersection(&played[p]) != played[p] {
+            return false;
+        }
+        let hand = deal[p].difference(&played[p]);
+        if hand.len() != cs.num_cards || hand.intersection(&unseen) != hand {
+            return false;
+        }
+        if cs.voided_suits.iter().any(|&s| !hand.suit(s).is_empty()) {
+            return false;
+        }
+        if cs
+            .fixed_cards
+            .iter()
+            .any(|c| unseen.contains(c) && !hand.contains(c))
+        {
+            return false;
+        }
+    }
+    return true;
+}
+
+// Returns the starting hands of the deals cached for the request's round and
+// player that are still consistent with `dist_req`, which should be the
+// request's card distribution. Returns nothing if the request has no round ID.
+pub fn take_deals(
+    req: &impl ChooseCardToPlayRequest,
+    dist_req: &CardDistributionRequest,
+) -> Vec<Vec<CardSet>> {
+    let round_id = match req.round_id() {
+        Some(id) => id,
+        None => return Vec::new(),
+    };
+    let cur = req.current_player_index();
+    let plays = plays_in_order(req);
+    let played = cards_played_by_player(req);
+    let mut cache = CACHE.lock().unwrap();
+    cache.clock += 1;
+    let clock = cache.clock;
+    let entry = match cache
+        .entries
+        .iter_mut()
+        .find(|e| e.round_id == round_id && e.player == cur)
+    {
+        Some(e) => e,
+        None => return Vec::new(),
+    };
+    // Deals from a search of another line of play, such as a speculative one,
+    // may depend on cards that weren't played in this one.
+    if !plays.starts_with(&entry.plays) {
+        return Vec::new();
+    }
+    entry.last_used = clock;
+    return entry
+        .deals
+        .iter()
+        .filter(|d| is_consistent(d, &played, cur, dist_req))
+        .cloned()
+        .collect();
+}
+
+// Stores the starting hands of the deals that a search for the request used,
+// replacing any deals cached for its round and player. Does nothing if the
+// request has no round ID.
+pub fn store_deals(req: &impl ChooseCardToPlayRequest, deals: Vec<Vec<CardSet>>) {
+    let round_id = match req.round_id() {
+        Some(id) => id,
+        None => return,
+    };
+    let cur = req.current_player_index();
+    let mut cache = CACHE.lock().unwrap();
+    cache.clock += 1;
+    let entry = CachedDeals {
+        round_id: round_id,
+        player: cur,
+        plays: plays_in_order(req),
+        deals: deals,
+        last_used: cache.clock,
+    };
+    let cache = &mut *cache;
+    match cache
+        .entries
+        .iter()
+        .position(|e| e.round_id == round_id && e.player == cur)
+    {
+        Some(i) => cache.entries[i] = entry,
+        None => {
+            if cache.entries.len() >= MAX_CACHED_SEARCHES {
+                let oldest = (0..cache.entries.len())
+                    .min_by_key(|&i| cache.entries[i].last_used)
+                    .unwrap();
+                cache.entries.swap_remove(oldest);
+            }
+            cache.entries.push(entry);
+        }
+    }
+}
+
+#[cfg(test)]
+mod test {
+    use super::*;
+    use crate::hearts;
+    use crate::hearts_ai::{
+        choose_card_monte_carlo, make_card_distribution_req, CardToPlayDirectRequest,
+        MonteCarloParams, SearchStats,
+    };
+    use crate::hearts_rollout::RolloutStrategy;
+    use rand::rngs::StdRng;
+    use rand::SeedableRng;
+
+    fn c(s: &str) -> Vec<Card> {
+        cards_from_str(s).unwrap()
+    }
+
+    fn cs(s: &str) -> CardSet {
+        CardSet::from_cards(&c(s))
+    }
+
+    fn trick(leader: usize, cards: &str) -> hearts::Trick {
+        let tc = c(cards);
+        let winner = (leader + hearts::trick_winner_index(&tc)) % 4;
+        return hearts::Trick {
+            leader: leader,
+            cards: tc,
+            winner: winner,
+        };
+    }
+
+    fn request(
+        round_id: Option<u64>,
+        hand: &str,
+        prev_tricks: Vec<hearts::Trick>,
+        trick: (usize, &str),
+    ) -> CardToPlayDirectRequest {
+        return CardToPlayDirectRequest {
+            rules: hearts::RuleSet::default(),
+            scores_before_round: vec![0, 0, 0, 0],
+            hand: c(hand),
+            prev_tricks: prev_tricks,
+            current_trick: hearts::TrickInProgress {
+                leader: trick.0,
+                cards: c(trick.1),
+            },
+            pass_direction: 0,
+            passed_cards: Vec::new(),
+            received_cards: Vec::new(),
+            round_id: round_id,
+        };
+    }
+
+    // Player 0's starting hand, and a deal of the other cards in which player
+    // 1 has AC, player 2 has KC, and player 3 has 2C and no other clubs.
+    const HAND: &str = "QC JC TC 9C AS KS QS JS TS 9S 8S 7S 6S";
+    fn deal() -> Vec<CardSet> {
+        return vec![
+            CardSet::new(),
+            cs("AC 8C 7C 5S 4S 3S 2S AH KH QH JH TH 9H"),
+            cs("KC 6C 5C 4C 3C 8H 7H 6H 5H 4H 3H 2H AD"),
+            cs("2C KD QD JD TD 9D 8D 7D 6D 5D 4D 3D 2D"),
+        ];
+    }
+
+    #[test]
+    fn test_is_consistent() {
+        let deal = deal();
+        // Player 3 led 2C, and player 0 is second to play.
+        let req = request(None, HAND, vec![], (3, "2C"));
+        let played = cards_played_by_player(&req);
+        let dist_req = make_card_distribution_req(&req);
+        assert!(is_consistent(&deal, &played, 0, &dist_req));
+
+        // After a trick where player 1 followed with AC and player 2 with KC,
+        // and players 2 and 3 showed out of spades.
+        let req = request(
+            None,
+            "JC TC 9C AS KS QS JS TS 9S 8S 7S 6S",
+            vec![trick(3, "2C QC AC KC")],
+            (1, "5S 2H 2D"),
+        );
+        let played = cards_played_by_player(&req);
+        let dist_req = make_card_distribution_req(&req);
+        assert!(is_consistent(&deal, &played, 0, &dist_req));
+
+        // Player 2 played 8C, which the deal gives to player 1.
+        let req = request(
+            None,
+            "JC TC 9C AS KS QS JS TS 9S 8S 7S 6S",
+            vec![trick(3, "2C QC AC 8C")],
+            (1, "5S 2H 2D"),
+        );
+        let played = cards_played_by_player(&req);
+        let dist_req = make_card_distribution_req(&req);
+        assert!(!is_consistent(&deal, &played, 0, &dist_req));
+
+        // Player 1 discarded a heart, so it can't have the clubs the deal gives it.
+        let req = request(
+            None,
+            "JC TC 9C AS KS QS JS TS 9S 8S 7S 6S",
+            vec![trick(3, "2C QC AH KC")],
+            (2, "3C 2D 4S"),
+        );
+        let played = cards_played_by_player(&req);
+        let dist_req = make_card_distribution_req(&req);
+        assert!(!is_consistent(&deal, &played, 0, &dist_req));
+    }
+
+    #[test]
+    fn test_starting_and_current_hands() {
+        let req = request(
+            None,
+            "JC TC 9C AS KS QS JS TS 9S 8S 7S 6S",
+            vec![trick(3, "2C QC AC KC")],
+            (1, "5S 2H 2D"),
+        );
+        let played = cards_played_by_player(&req);
+        let deal = deal();
+        let hands = current_hands(&deal, &played);
+        assert_eq!(hands[1], cs("8C 7C 4S 3S 2S AH KH QH JH TH 9H"));
+        assert_eq!(hands[3], cs("KD QD JD TD 9D 8D 7D 6D 5D 4D 3D"));
+        let start = starting_hands(&req, &played, &hands);
+        assert_eq!(start[0], CardSet::new());
+        assert_eq!(start[1..], deal[1..]);
+    }
+
+    #[test]
+    fn test_take_and_store_deals() {
+        let round_id = 4601;
+        let req = request(Some(round_id), HAND, vec![], (3, "2C"));
+        store_deals(&req, vec![deal()]);
+        let dist_req = make_card_distribution_req(&req);
+        assert_eq!(take_deals(&req, &dist_req), vec![deal()]);
+
+        // Another player, or another round, doesn't get the deals.
+        let other = request(
+            Some(round_id),
+            "AC 8C 7C 5S 4S 3S 2S AH KH QH JH TH 9H",
+            vec![],
+            (3, "2C QC"),
+        );
+        let dist_req = make_card_distribution_req(&other);
+        assert!(take_deals(&other, &dist_req).is_empty());
+        let other = request(Some(round_id + 100), HAND, vec![], (3, "2C"));
+        let dist_req = make_card_distribution_req(&other);
+        assert!(take_deals(&other, &dist_req).is_empty());
+
+        // A trick later, the deal is still possible.
+        let later = request(
+            Some(round_id),
+            "JC TC 9C AS KS QS JS TS 9S 8S 7S 6S",
+            vec![trick(3, "2C QC AC KC")],
+            (1, "5S 2H 2D"),
+        );
+        let dist_req = make_card_distribution_req(&later);
+        assert_eq!(take_deals(&later, &dist_req), vec![deal()]);
+
+        // Deals stored for a line of play that didn't happen aren't reused.
+        let speculative = request(
+            Some(round_id),
+            "JC TC 9C AS KS QS JS TS 9S 8S 7S 6S",
+            vec![trick(3, "2C QC AC KC")],
+            (1, "5S 2H 3D"),
+        );
+        store_deals(&speculative, vec![deal()]);
+        let dist_req = make_card_distribution_req(&later);
+        assert!(take_deals(&later, &dist_req).is_empty());
+    }
+
+    #[test]
+    fn test_monte_carlo_reuses_deals() {
+        let mut rng = StdRng::seed_from_u64(46);
+        let params = MonteCarloParams {
+            num_hands: 10,
+            rollouts_per_hand: 2,
+            endgame: None,
+            early_stopping: None,
+            reuse_deals: true,
+        };
+        let req = request(Some(4602), HAND, vec![], (3, "2C"));
+        let mut stats = SearchStats::default();
+        choose_card_monte_carlo(
+            &req,
+            params,
+            &RolloutStrategy::AvoidPoints,
+            &mut rng,
+            &mut stats,
+        );
+        assert_eq!(stats.num_reused_deals, 0);
+        // Asking again for the same position reuses every deal.
+        let mut stats = SearchStats::default();
+        choose_card_monte_carlo(
+            &req,
+            params,
+            &RolloutStrategy::AvoidPoints,
+            &mut rng,
+            &mut stats,
+        );
+        assert_eq!(stats.num_reused_deals, 10);
+        assert_eq!(stats.num_rollouts, 10 * 2 * 4);
+    }
+}
@@ -0,0 +1,360 @@
+use crate::card::*;
+use crate::hearts;
+use crate::hearts_ai::{
+    choose_card_avoid_points, make_card_distribution_req, max_index, possible_round,
+    ChooseCardToPlayRequest,
+};
+use crate::hearts_equity::MatchEquity;
+use crate::hearts_rollout::{RolloutRound, MAX_PLAYERS};
+
+use rand::Rng;
+use std::collections::HashMap;
+
+// Exact search for the last few tricks of a round. Like choose_card_monte_carlo
+// it samples deals of the unseen cards, but instead of playing out each deal
+// with random rollouts it finds the result of every player playing perfectly
+// with all hands known. Each player maximizes their own match equity (the
+// "max-n" rule), which is the multiplayer version of minimax. Two-player
+// alpha-beta cutoffs don't apply because the opponents aren't one side, so
+// the search relies on a transposition table instead: positions at the start
+// of a trick repeat across play orders and across the sampled deals.
+
+#[derive(Debug, Copy, Clone)]
+pub struct EndgameParams {
+    // Use the solver when the current player has at most this many cards.
+    pub max_hand_size: usize,
+    // Number of deals of the unseen cards to solve.
+    pub num_hands: i32,
+}
+
+pub const DEFAULT_MAX_HAND_SIZE: usize = 4;
+pub const DEFAULT_NUM_HANDS: i32 = 50;
+
+// Points in completed tricks range from -10 (jack of diamonds) to 26.
+const MIN_POINTS: i32 = -10;
+const NUM_POINT_VALUES: usize = 37;
+
+// Random values for Zobrist hashing. The hash of a position is the XOR of the
+// values for each card in each player's hand, the trick leader, each player's
+// points, and the other state that affects scoring.
+struct ZobristKeys {
+    cards: [[u64; 52]; MAX_PLAYERS],
+    leader: [u64; MAX_PLAYERS],
+    points: [[u64; NUM_POINT_VALUES]; MAX_PLAYERS],
+    jd_winner: [u64; MAX_PLAYERS],
+    hearts_broken: u64,
+}
+
+impl ZobristKeys {
+    fn new(mut rng: impl Rng) -> ZobristKeys {
+        let mut keys = ZobristKeys {
+            cards: [[0; 52]; MAX_PLAYERS],
+            leader: [0; MAX_PLAYERS],
+            points: [[0; NUM_POINT_VALUES]; MAX_PLAYERS],
+            jd_winner: [0; MAX_PLAYERS],
+            hearts_broken: rng.gen(),
+        };
+        for p in 0..MAX_PLAYERS {
+            for c in 0..52 {
+                keys.cards[p][c] = rng.gen();
+            }
+            for v in 0..NUM_POINT_VALUES {
+                keys.points[p][v] = rng.gen();
+            }
+            keys.leader[p] = rng.gen();
+            keys.jd_winner[p] = rng.gen();
+        }
+        return keys;
+    }
+
+    fn hands_hash(&self, round: &RolloutRound) -> u64 {
+        let mut hash = 0;
+        for p in 0..round.num_players() {
+            let mut bits = round.hand(p).bits;
+            while bits != 0 {
+                hash ^= self.cards[p][bits.trailing_zeros() as usize];
+                bits &= bits - 1;
+            }
+        }
+        return hash;
+    }
+
+    // Hash of a position at the start of a trick, given the hash of the hands.
+    fn position_hash(&self, round: &RolloutRound, hands_hash: u64) -> u64 {
+        let mut hash = hands_hash ^ self.leader[round.current_player_index()];
+        let points = round.points_so_far();
+        for p in 0..round.num_players() {
+            hash ^= self.points[p][(points[p] - MIN_POINTS) as usize];
+        }
+        if let Some(p) = round.jd_winner() {
+            hash ^= self.jd_winner[p];
+        }
+        if round.hearts_broken() {
+            hash ^= self.hearts_broken;
+        }
+        return hash;
+    }
+}
+
+struct Solver<'a> {
+    keys: ZobristKeys,
+    // Points taken in the round with perfect play, for positions at the start of a trick.
+    table: HashMap<u64, [i32; MAX_PLAYERS]>,
+    scores_before_round: &'a [i32],
+    match_equity: MatchEquity,
+}
+
+impl Solver<'_> {
+    fn equity(&self, round_points: &[i32; MAX_PLAYERS], player: usize) -> f64 {
+        let num_players = self.scores_before_round.len();
+        let mut scores = [0i32; MAX_PLAYERS];
+        for p in 0..num_players {
+            scores[p] = self.scores_before_round[p] + round_points[p];
+        }
+        return self.match_equity.equity(&scores[..num_players], player);
+    }
+
+    // Returns the cards in `legal` that have the same result as the next
+    // lower card in `legal`, so they don't need to be searched. That's the
+    // case when the cards are in the same suit, are worth the same points,
+    // and no card that's still in play has a rank between them. For example
+    // if 5H and 8H are legal plays and 6H and 7H have already been played,
+    // playing 8H has the same result as playing 5H.
+    fn equivalent_cards(&self, round: &RolloutRound, legal: u64) -> u64 {
+        let mut in_play: u64 = 0;
+        for p in 0..round.num_players() {
+            in_play |= round.hand(p).bits;
+        }
+        if let Some(high_card) = round.trick_high_card() {
+            in_play |= 1 << high_card.index();
+        }
+        let special =
+            (1u64 << hearts::QUEEN_OF_SPADES.index()) | (1u64 << hearts::JACK_OF_DIAMONDS.index());
+        let mut equivalent: u64 = 0;
+        let mut prev_index: Option<usize> = None;
+        let mut bits = legal & !special;
+        while bits != 0 {
+            let card_index = bits.trailing_zeros() as usize;
+            bits &= bits - 1;
+            if let Some(prev) = prev_index {
+                let between = ((1u64 << card_index) - 1) & !((1u64 << (prev + 1)) - 1);
+                if prev / 13 == card_index / 13 && in_play & between == 0 {
+                    equivalent |= 1 << card_index;
+                }
+            }
+            prev_index = Some(card_index);
+        }
+        return equivalent;
+    }
+
+    // Returns the points each player takes in the round with perfect play.
+    // `hands_hash` is ZobristKeys::hands_hash for `round`, which is updated
+    // as cards are played rather than recomputed.
+    fn solve(&mut self, round: &RolloutRound, hands_hash: u64) -> [i32; MAX_PLAYERS] {
+        if round.is_over() {
+            return round.points_taken();
+        }
+        let position_hash = if round.trick_size() == 0 {
+            let hash = self.keys.position_hash(round, hands_hash);
+            if let Some(points) = self.table.get(&hash) {
+                return *points;
+            }
+            Some(hash)
+        } else {
+            None
+        };
+        let player = round.current_player_index();
+        let mut legal = round.legal_plays();
+        let equivalent = self.equivalent_cards(round, legal);
+        let mut best_points = [0i32; MAX_PLAYERS];
+        let mut best_equity = f64::NEG_INFINITY;
+        while legal != 0 {
+            let card_index = legal.trailing_zeros() as usize;
+            legal &= legal - 1;
+            if equivalent & (1 << card_index) != 0 {
+                continue;
+            }
+            let mut next = *round;
+            next.play_card(&Card::from_index(card_index));
+            let points = self.solve(&next, hands_hash ^ self.keys.cards[player][card_index]);
+            let equity = self.equity(&points, player);
+            if equity > best_equity {
+                best_equity = equity;
+                best_points = points;
+            }
+        }
+        if let Some(hash) = position_hash {
+            self.table.insert(hash, best_points);
+        }
+        return best_points;
+    }
+}
+
+pub fn choose_card_endgame(
+    req: &impl ChooseCardToPlayRequest,
+    params: EndgameParams,
+    mut rng: impl Rng,
+) -> Card {
+    let legal_plays = req.legal_plays();
+    assert!(legal_plays.len() > 0);
+    if legal_plays.len() == 1 {
+        return legal_plays[0];
+    }
+    let pnum = req.current_player_index();
+    let num_players = req.rules().num_players;
+    let dist_req = make_card_distribution_req(req);
+    let maybe_sampler = CardDistributionSampler::new(&dist_req);
+    if maybe_sampler.is_err() {
+        eprintln!("Endgame search failed, defaulting to choose_card_avoid_points");
+        return choose_card_avoid_points(req, &mut rng);
+    }
+    let sampler = maybe_sampler.unwrap();
+    let template = RolloutRound::from_round(&possible_round(req, &sampler, &mut rng));
+    let mut solver = Solver {
+        keys: ZobristKeys::new(&mut rng),
+        table: HashMap::new(),
+        scores_before_round: &req.scores_before_round()[..num_players],
+        match_equity: MatchEquity::for_rules(req.rules()),
+    };
+    let mut equity_per_play: Vec<f64> = vec![0.0; legal_plays.len()];
+    let mut hands: Vec<CardSet> = vec![CardSet::new(); num_players];
+    for _ in 0..params.num_hands {
+        sampler.sample_card_sets(&mut rng, &mut hands);
+        let mut round = template;
+        for p in 0..num_players {
+            if p != pnum {
+                round.set_hand(p, hands[p]);
+            }
+        }
+        let hands_hash = solver.keys.hands_hash(&round);
+        for ci in 0..legal_plays.len() {
+            let mut after_play = round;
+            after_play.play_card(&legal_plays[ci]);
+            let points = solver.solve(
+                &after_play,
+                hands_hash ^ solver.keys.cards[pnum][legal_plays[ci].index()],
+            );
+            equity_per_play[ci] += solver.equity(&points, pnum);
+        }
+    }
+    return legal_plays[max_index(&equity_per_play)];
+}
+
+#[cfg(test)]
+mod test {
+    use super::*;
+    use crate::hearts_ai;
+    use crate::hearts_ai::CardToPlayDirectRequest;
+    use rand::rngs::StdRng;
+    use rand::SeedableRng;
+
+    fn c(s: &str) -> Vec<Card> {
+        cards_from_str(s).unwrap()
+    }
+
+    fn trick(leader: usize, cards: &str) -> hearts::Trick {
+        let cards = c(cards);
+        let winner = hearts::trick_winner_index(&cards);
+        return hearts::Trick {
+            leader: leader,
+            cards: cards,
+            winner: (leader + winner) % 4,
+        };
+    }
+
+    fn params() -> EndgameParams {
+        return EndgameParams {
+            max_hand_size: 13,
+            num_hands: 20,
+        };
+    }
+
+    #[test]
+    fn test_block_shoot() {
+        // Same position as test_block_shoot in ffi_test.py. P2 leads AC and
+        // would shoot the moon if it takes the last trick with JC. P3 must
+        // play 9C and keep QC to win the last trick.
+        let req = CardToPlayDirectRequest {
+            rules: hearts::RuleSet::default(),
+            scores_before_round: vec![0, 0, 0, 0],
+            hand: c("QC 9C"),
+            prev_tricks: vec![
+                trick(0, "2C 7D TC KC"),
+                trick(3, "9S 4H 8S AS"),
+                trick(2, "AD 3D AH 5D"),
+                trick(2, "KD 8D QH 6D"),
+                trick(2, "QD 9D TH 4D"),
+                trick(2, "JD JH 9H 2D"),
+                trick(2, "TD 8H 5H KH"),
+                trick(2, "KS 6S 8C 7S"),
+                trick(2, "QS 4S 7C 5S"),
+                trick(2, "JS 6H 6C 3S"),
+                trick(2, "TS 2H 5C 2S"),
+            ],
+            current_trick: hearts::TrickInProgress {
+                leader: 2,
+                cards: c("AC"),
+            },
+            pass_direction: 0,
+            passed_cards: Vec::new(),
+            received_cards: Vec::new(),
+            round_id: None,
+        };
+        let mut rng: StdRng = SeedableRng::seed_from_u64(42);
+        let card = choose_card_endgame(&req, params(), &mut rng);
+        assert_eq!(card, Card::new(Rank::num(9), Suit::Clubs));
+    }
+
+    #[test]
+    fn test_matches_exhaustive_search() {
+        // Compares the solver with the table against a plain max-n search
+        // without one, on random deals with three cards left.
+        fn plain_solve(round: &RolloutRound, solver: &Solver) -> [i32; MAX_PLAYERS] {
+            if round.is_over() {
+                return round.points_taken();
+            }
+            let player = round.current_player_index();
+            let mut best_points = [0i32; MAX_PLAYERS];
+            let mut best_equity = f64::NEG_INFINITY;
+            for card in round.hand(player).to_vec() {
+                if round.legal_plays() & (1 << card.index()) == 0 {
+                    continue;
+                }
+                let mut next = *round;
+                next.play_card(&card);
+                let points = plain_solve(&next, solver);
+                let equity = solver.equity(&points, player);
+                if equity > best_equity {
+                    best_equity = equity;
+                    best_points = points;
+                }
+            }
+            return best_points;
+        }
+
+        let rules = hearts::RuleSet {
+            jd_minus_10: true,
+            ..hearts::RuleSet::default()
+        };
+        let scores = vec![40, 70, 85, 20];
+        let mut rng: StdRng = SeedableRng::seed_from_u64(42);
+        let mut solver = Solver {
+            keys: ZobristKeys::new(&mut rng),
+            table: HashMap::new(),
+            scores_before_round: &scores,
+            match_equity: MatchEquity::for_rules(&rules),
+        };
+        for _ in 0..50 {
+            let mut deck = Deck::new();
+            deck.shuffle(&mut rng);
+            let mut round = hearts::Round::deal(&deck, &rules, &scores, 0);
+            for _ in 0..(10 * 4 + rng.gen_range(0..4)) {
+                let card = hearts_ai::choose_card_random(&round, &mut rng);
+                round.play_card(&card);
+            }
+            let rr = RolloutRound::from_round(&round);
+            let hands_hash = solver.keys.hands_hash(&rr);
+            assert_eq!(solver.solve(&rr, hands_hash), plain_solve(&rr, &solver));
+        }
+    }
+}
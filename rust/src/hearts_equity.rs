@@ -0,0 +1,448 @@
+use crate::card::*;
+use crate::hearts;
+use crate::hearts_ai::match_equity_for_scores;
+use crate::hearts_rollout::{RolloutRound, RolloutStrategy};
+
+use rand::Rng;
+use std::collections::HashMap;
+use std::sync::{Arc, RwLock};
+
+// Match equities computed from how rounds are actually scored, instead of
+// hearts_ai::match_equity_for_scores's estimate from the distances to the
+// point limit. The hearts_equity_table binary simulates rounds to get the
+// distribution of points that each player takes, and then uses dynamic
+// programming over a grid of match scores to find each player's probability
+// of winning. Tables are written to files, and apps load them with
+// load_match_equity_table in main_api.rs. Searches get the equities for
+// their rules from MatchEquity, which falls back to the estimate if there's
+// no table.
+//
+// The grid has a point every `step` points, and equities between them are
+// interpolated. Whether a player reaches the point limit is checked exactly,
+// so interpolation is only between scores that don't end the match. Players
+// are symmetric, so the file only has an equity for each score with the
+// other players' scores sorted, and loading expands that to a full array so
+// that lookups are just indexing.
+
+const NUM_PLAYERS: usize = 4;
+const MAGIC: &[u8; 4] = b"HMET";
+const HEADER_SIZE: usize = 21;
+
+pub struct MatchEquityTable {
+    point_limit: i32,
+    jd_minus_10: bool,
+    moon_shooting: bool,
+    // Score of the first grid point. Lower scores use the first grid point.
+    min_score: i32,
+    step: i32,
+    num_points: usize,
+    // Equity of player 0 for each combination of grid points, indexed by
+    // grid point indices in player order.
+    values: Vec<f32>,
+}
+
+// Returns the index of the grid point at or below `score`, and how far
+// `score` is from it towards the next grid point, from 0 to 1.
+fn grid_position(score: i32, min_score: i32, step: i32, num_points: usize) -> (usize, f64) {
+    let offset = ((score - min_score) as f64 / step as f64).max(0.0);
+    let index = (offset as usize).min(num_points - 2);
+    return (index, (offset - index as f64).min(1.0));
+}
+
+fn is_match_over(scores: &[i32], point_limit: i32) -> bool {
+    return scores.iter().any(|&s| s >= point_limit);
+}
+
+impl MatchEquityTable {
+    fn new(rules: &hearts::RuleSet, min_score: i32, step: i32) -> MatchEquityTable {
+        let point_limit = rules.point_limit as i32;
+        assert!(step > 0 && min_score < point_limit);
+        let num_points = ((point_limit - 1 - min_score) / step + 1) as usize;
+        assert!(num_points >= 2);
+        return MatchEquityTable {
+            point_limit: point_limit,
+            jd_minus_10: rules.jd_minus_10,
+            moon_shooting: rules.moon_shooting != hearts::MoonShooting::Disabled,
+            min_score: min_score,
+            step: step,
+            num_points: num_points,
+            values: vec![0.0; num_points.pow(NUM_PLAYERS as u32)],
+        };
+    }
+
+    fn index(&self, points: [usize; NUM_PLAYERS]) -> usize {
+        let mut index = 0;
+        for &p in points.iter() {
+            index = index * self.num_points + p;
+        }
+        return index;
+    }
+
+    fn score_at(&self, point: usize) -> i32 {
+        return self.min_score + (point as i32) * self.step;
+    }
+
+    // Sets the equity for `points` and for the same scores with the other
+    // players in any order.
+    fn set_value(&mut self, points: [usize; NUM_PLAYERS], value: f32) {
+        let [a, b, c, d] = points;
+        for &opponents in [
+            [b, c, d],
+            [b, d, c],
+            [c, b, d],
+            [c, d, b],
+            [d, b, c],
+            [d, c, b],
+        ]
+        .iter()
+        {
+            let index = self.index([a, opponents[0], opponents[1], opponents[2]]);
+            self.values[index] = value;
+        }
+    }
+
+    pub fn matches_rules(&self, rules: &hearts::RuleSet) -> bool {
+        return rules.num_players == NUM_PLAYERS
+            && rules.removed_cards.is_empty()
+            && rules.point_limit as i32 == self.point_limit
+            && rules.jd_minus_10 == self.jd_minus_10
+            && (rules.moon_shooting != hearts::MoonShooting::Disabled) == self.moon_shooting;
+    }
+
+    // Returns the equity of `player`, assuming the match isn't over.
+    fn interpolated_equity(&self, scores: &[i32], player: usize) -> f64 {
+        let mut positions = [(0usize, 0f64); NUM_PLAYERS];
+        for i in 0..NUM_PLAYERS {
+            let score = scores[(player + i) % NUM_PLAYERS];
+            positions[i] = grid_position(score, self.min_score, self.step, self.num_points);
+        }
+        let mut equity = 0.0;
+        for corner in 0..(1 << NUM_PLAYERS) {
+            let mut weight = 1.0;
+            let mut points = [0usize; NUM_PLAYERS];
+            for i in 0..NUM_PLAYERS {
+                let (index, frac) = positions[i];
+                if corner & (1 << i) != 0 {
+                    points[i] = index + 1;
+                    weight *= frac;
+                } else {
+                    points[i] = index;
+                    weight *= 1.0 - frac;
+                }
+            }
+            if weight > 0.0 {
+                equity += weight * (self.values[self.index(points)] as f64);
+            }
+        }
+        return equity;
+    }
+
+    pub fn equity(&self, scores: &[i32], player: usize) -> f64 {
+        assert_eq!(scores.len(), NUM_PLAYERS);
+        if is_match_over(scores, self.point_limit) {
+            return match_equity_for_scores(scores, self.point_limit as u32, player);
+        }
+        return self.interpolated_equity(scores, player);
+    }
+
+    // Computes a table for `rules` from the points taken in `num_rounds`
+    // simulated rounds. `min_score` should be below 0 if players can have
+    // negative scores, which is possible with the JD rule.
+    pub fn compute(
+        rules: &hearts::RuleSet,
+        min_score: i32,
+        step: i32,
+        num_rounds: usize,
+        rng: impl Rng,
+    ) -> MatchEquityTable {
+        assert_eq!(rules.num_players, NUM_PLAYERS);
+        assert!(rules.removed_cards.is_empty());
+        let mut table = MatchEquityTable::new(rules, min_score, step);
+        let outcomes = round_outcomes(rules, num_rounds, rng);
+        let n = table.num_points;
+
+        // Each state is a score for player 0 and sorted scores for the others.
+        let mut states: Vec<[usize; NUM_PLAYERS]> = Vec::new();
+        for a in 0..n {
+            for b in 0..n {
+                for c in b..n {
+                    for d in c..n {
+                        states.push([a, b, c, d]);
+                        let scores: Vec<i32> =
+                            [a, b, c, d].iter().map(|&p| table.score_at(p)).collect();
+                        let estimate = match_equity_for_scores(&scores, rules.point_limit, 0);
+                        table.set_value([a, b, c, d], estimate as f32);
+                    }
+                }
+            }
+        }
+        // Rounds always add points in total, so states with higher total
+        // scores are computed first. Interpolation can make a state depend
+        // on others with the same total, so repeat until nothing changes.
+        states.sort_by_key(|s| -(s.iter().sum::<usize>() as i32));
+        for _ in 0..20 {
+            let mut max_change = 0f64;
+            for &state in states.iter() {
+                let mut equity = 0.0;
+                for (points, prob) in outcomes.iter() {
+                    let mut scores = [0i32; NUM_PLAYERS];
+                    for i in 0..NUM_PLAYERS {
+                        scores[i] = table.score_at(state[i]) + points[i];
+                    }
+                    equity += prob * table.equity(&scores, 0);
+                }
+                let index = table.index(state);
+                max_change = max_change.max((equity - table.values[index] as f64).abs());
+                table.set_value(state, equity as f32);
+            }
+            if max_change < 1e-6 {
+                break;
+            }
+        }
+        return table;
+    }
+
+    pub fn to_bytes(&self) -> Vec<u8> {
+        let mut bytes: Vec<u8> = Vec::new();
+        bytes.extend_from_slice(MAGIC);
+        bytes.extend_from_slice(&self.point_limit.to_le_bytes());
+        bytes.push((self.jd_minus_10 as u8) | ((self.moon_shooting as u8) << 1));
+        bytes.extend_from_slice(&self.min_score.to_le_bytes());
+        bytes.extend_from_slice(&self.step.to_le_bytes());
+        bytes.extend_from_slice(&(self.num_points as u32).to_le_bytes());
+        let n = self.num_points;
+        for a in 0..n {
+            for b in 0..n {
+                for c in b..n {
+                    for d in c..n {
+                        let value = self.values[self.index([a, b, c, d])];
+                        let quantized = (value.max(0.0).min(1.0) * 65535.0).round() as u16;
+                        bytes.extend_from_slice(&quantized.to_le_bytes());
+                    }
+                }
+            }
+        }
+        return bytes;
+    }
+
+    pub fn from_bytes(bytes: &[u8]) -> Result<MatchEquityTable, String> {
+        if bytes.len() < HEADER_SIZE || &bytes[0..4] != MAGIC {
+            return Err("Not a match equity table".to_string());
+        }
+        let read_i32 = |offset: usize| {
+            let mut b = [0u8; 4];
+            b.copy_from_slice(&bytes[offset..offset + 4]);
+            i32::from_le_bytes(b)
+        };
+        let point_limit = read_i32(4);
+        let flags = bytes[8];
+        let min_score = read_i32(9);
+        let step = read_i32(13);
+        let num_points = read_i32(17) as usize;
+        if step <= 0 || num_points < 2 || num_points > 1000 {
+            return Err("Invalid match equity table header".to_string());
+        }
+        let n = num_points;
+        let num_states = n * n * (n + 1) * (n + 2) / 6;
+        if bytes.len() != HEADER_SIZE + 2 * num_states {
+            return Err("Wrong size for match equity table".to_string());
+        }
+        let mut table = MatchEquityTable {
+            point_limit: point_limit,
+            jd_minus_10: flags & 1 != 0,
+            moon_shooting: flags & 2 != 0,
+            min_score: min_score,
+            step: step,
+            num_points: n,
+            values: vec![0.0; n.pow(NUM_PLAYERS as u32)],
+        };
+        let mut offset = HEADER_SIZE;
+        for a in 0..n {
+            for b in 0..n {
+                for c in b..n {
+                    for d in c..n {
+                        let quantized = u16::from_le_bytes([bytes[offset], bytes[offset + 1]]);
+                        table.set_value([a, b, c, d], (quantized as f32) / 65535.0);
+                        offset += 2;
+                    }
+                }
+            }
+        }
+        return Ok(table);
+    }
+}
+
+// Returns the distinct points taken by each player in simulated rounds and
+// their probabilities. Every ordering of players is included, since which
+// player takes which points doesn't depend on their seat.
+fn round_outcomes(
+    rules: &hearts::RuleSet,
+    num_rounds: usize,
+    mut rng: impl Rng,
+) -> Vec<([i32; NUM_PLAYERS], f64)> {
+    let mut permutations: Vec<[usize; NUM_PLAYERS]> = Vec::new();
+    for a in 0..NUM_PLAYERS {
+        for b in 0..NUM_PLAYERS {
+            for c in 0..NUM_PLAYERS {
+                let d = 6 - a - b - c;
+                if a != b && a != c && b != c && d < NUM_PLAYERS {
+                    permutations.push([a, b, c, d]);
+                }
+            }
+        }
+    }
+    let strategy = RolloutStrategy::MixedRandomAvoidPoints(0.1);
+    let mut deck = Deck::new();
+    let mut counts: HashMap<[i32; NUM_PLAYERS], usize> = HashMap::new();
+    for _ in 0..num_rounds {
+        deck.shuffle(&mut rng);
+        let hands: Vec<CardSet> = deck
+            .cards
+            .chunks(13)
+            .map(|h| CardSet::from_cards(h))
+            .collect();
+        let mut round = RolloutRound::from_hands(rules, &hands);
+        round.play_to_end(&strategy, &mut rng);
+        let points = round.points_taken();
+        for perm in permutations.iter() {
+            let mut permuted = [0i32; NUM_PLAYERS];
+            for i in 0..NUM_PLAYERS {
+                permuted[i] = points[perm[i]];
+            }
+            *counts.entry(permuted).or_insert(0) += 1;
+        }
+    }
+    let total = (num_rounds * permutations.len()) as f64;
+    let mut outcomes: Vec<([i32; NUM_PLAYERS], f64)> = counts
+        .into_iter()
+        .map(|(points, count)| (points, count as f64 / total))
+        .collect();
+    // Sorting makes the table the same for the same random numbers.
+    outcomes.sort_by_key(|o| o.0);
+    return outcomes;
+}
+
+static TABLES: RwLock<Vec<Arc<MatchEquityTable>>> = RwLock::new(Vec::new());
+
+// Makes `table` available to MatchEquity::for_rules, replacing any table for the same rules.
+pub fn add_table(table: MatchEquityTable) {
+    let mut tables = TABLES.write().unwrap();
+    tables.retain(|t| {
+        !(t.point_limit == table.point_limit
+            && t.jd_minus_10 == table.jd_minus_10
+            && t.moon_shooting == table.moon_shooting)
+    });
+    tables.push(Arc::new(table));
+}
+
+// Match equities for a rule set, using a table if one has been added for
+// the rules. Searches should create one of these at the start rather than
+// for every rollout, because finding the table needs a lock.
+#[derive(Clone)]
+pub struct MatchEquity {
+    point_limit: u32,
+    table: Option<Arc<MatchEquityTable>>,
+}
+
+impl MatchEquity {
+    pub fn for_rules(rules: &hearts::RuleSet) -> MatchEquity {
+        let tables = TABLES.read().unwrap();
+        return MatchEquity {
+            point_limit: rules.point_limit,
+            table: tables.iter().find(|t| t.matches_rules(rules)).cloned(),
+        };
+    }
+
+    pub fn equity(&self, scores: &[i32], player: usize) -> f64 {
+        return match &self.table {
+            Some(t) => t.equity(scores, player),
+            None => match_equity_for_scores(scores, self.point_limit, player),
+        };
+    }
+}
+
+#[cfg(test)]
+mod test {
+    use super::*;
+    use rand::rngs::StdRng;
+    use rand::SeedableRng;
+
+    fn small_table(rules: &hearts::RuleSet) -> MatchEquityTable {
+        let mut rng: StdRng = SeedableRng::seed_from_u64(42);
+        return MatchEquityTable::compute(rules, 0, 10, 200, &mut rng);
+    }
+
+    #[test]
+    fn test_equities() {
+        let rules = hearts::RuleSet {
+            point_limit: 50,
+            ..hearts::RuleSet::default()
+        };
+        let table = small_table(&rules);
+        for scores in [[0, 0, 0, 0], [10, 20, 30, 40], [45, 0, 5, 30]].iter() {
+            let total: f64 = (0..4).map(|p| table.equity(scores, p)).sum();
+            assert!((total - 1.0).abs() < 0.001);
+        }
+        assert!((table.equity(&[0, 0, 0, 0], 2) - 0.25).abs() < 0.001);
+        // Lower scores are better.
+        assert!(table.equity(&[10, 20, 30, 40], 0) > table.equity(&[10, 20, 30, 40], 1));
+        assert!(table.equity(&[10, 20, 30, 40], 1) > table.equity(&[10, 20, 30, 40], 2));
+        // Interpolated between grid points.
+        let e1 = table.equity(&[10, 20, 30, 40], 0);
+        let e2 = table.equity(&[15, 20, 30, 40], 0);
+        let e3 = table.equity(&[20, 20, 30, 40], 0);
+        assert!(e1 > e2 && e2 > e3);
+        // Ended matches are exact.
+        assert_eq!(table.equity(&[10, 20, 30, 50], 0), 1.0);
+        assert_eq!(table.equity(&[10, 20, 30, 50], 1), 0.0);
+        // Close to the limit, the player who's far behind can only win if someone
+        // else gets to the limit before they do, so their equity is much lower
+        // than the estimate from distances.
+        let scores = [45, 45, 45, 5];
+        assert!(table.equity(&scores, 0) < match_equity_for_scores(&scores, 50, 0) - 0.05);
+    }
+
+    #[test]
+    fn test_bytes() {
+        let rules = hearts::RuleSet {
+            point_limit: 40,
+            jd_minus_10: true,
+            ..hearts::RuleSet::default()
+        };
+        let table = small_table(&rules);
+        let loaded = MatchEquityTable::from_bytes(&table.to_bytes()).unwrap();
+        assert!(loaded.matches_rules(&rules));
+        assert!(!loaded.matches_rules(&hearts::RuleSet::default()));
+        for scores in [[0, 0, 0, 0], [10, 20, 30, 35], [35, 0, 5, 30]].iter() {
+            for p in 0..4 {
+                assert!((table.equity(scores, p) - loaded.equity(scores, p)).abs() < 0.0001);
+            }
+        }
+        assert!(MatchEquityTable::from_bytes(b"HMET").is_err());
+        assert!(MatchEquityTable::from_bytes(&table.to_bytes()[..100]).is_err());
+    }
+
+    #[test]
+    fn test_match_equity_uses_table() {
+        // A point limit that no other test uses, since tables are global.
+        let rules = hearts::RuleSet {
+            point_limit: 30,
+            ..hearts::RuleSet::default()
+        };
+        let scores = [25, 25, 25, 0];
+        let estimate = MatchEquity::for_rules(&rules).equity(&scores, 0);
+        assert_eq!(estimate, match_equity_for_scores(&scores, 30, 0));
+        let table = small_table(&rules);
+        let expected = table.equity(&scores, 0);
+        add_table(table);
+        assert_eq!(MatchEquity::for_rules(&rules).equity(&scores, 0), expected);
+        let other_rules = hearts::RuleSet {
+            jd_minus_10: true,
+            ..rules
+        };
+        assert_eq!(
+            MatchEquity::for_rules(&other_rules).equity(&scores, 0),
+            estimate
+        );
+    }
+}
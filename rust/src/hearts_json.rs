@@ -1,9 +1,14 @@
 use crate::card::*;
 use crate::hearts;
 use crate::hearts_ai;
+use crate::hearts_endgame;
+use crate::hearts_endgame::EndgameParams;
+use crate::hearts_pass::{PassSimulationParams, DEFAULT_PASS_SIMULATION};
+use crate::hearts_policy;
 
 use serde::Deserialize;
 use serde_json;
+use std::time::Duration;
 
 #[derive(Debug)]
 pub struct ParseError {
@@ -82,9 +87,13 @@ struct JsonCardsToPassRequest {
     #[serde(default)]
     rules: JsonRuleSet,
     scores_before_round: Vec<i32>,
+    #[serde(default)]
+    player_index: usize,
     hand: String,
     direction: u32,
     num_cards: u32,
+    #[serde(default)]
+    strategy: Option<JsonCardsToPassStrategy>,
 }
 
 impl JsonCardsToPassRequest {
@@ -92,6 +101,7 @@ impl JsonCardsToPassRequest {
         return Ok(hearts_ai::CardsToPassRequest {
             rules: self.rules.to_rules()?,
             scores_before_round: self.scores_before_round.clone(),
+            player_index: self.player_index,
             hand: cards_from_str(&self.hand)?,
             direction: self.direction,
             num_cards: self.num_cards,
@@ -99,6 +109,84 @@ impl JsonCardsToPassRequest {
     }
 }
 
+// Optional "strategy" field of a cards to pass request, for example
+// {"name": "simulation", "time_limit_ms": 500}. Omitted parameters use
+// hearts_pass::DEFAULT_PASS_SIMULATION. A time limit of 0 means no limit,
+// and 0 threads means one per core.
+#[derive(Deserialize)]
+#[serde(tag = "name", rename_all = "snake_case")]
+enum JsonCardsToPassStrategy {
+    Random,
+    Heuristic,
+    Simulation {
+        #[serde(default = "JsonCardsToPassStrategy::default_candidate_cards")]
+        candidate_cards: usize,
+        #[serde(default = "JsonCardsToPassStrategy::default_num_deals")]
+        num_deals: i32,
+        #[serde(default = "JsonCardsToPassStrategy::default_rollouts_per_deal")]
+        rollouts_per_deal: i32,
+        #[serde(default)]
+        threads: usize,
+        #[serde(default = "JsonCardsToPassStrategy::default_time_limit_ms")]
+        time_limit_ms: u64,
+        #[serde(default = "JsonCardToPlayStrategy::default_p_random")]
+        p_random: f64,
+    },
+}
+
+impl JsonCardsToPassStrategy {
+    fn default_candidate_cards() -> usize {
+        DEFAULT_PASS_SIMULATION.num_candidate_cards
+    }
+
+    fn default_num_deals() -> i32 {
+        DEFAULT_PASS_SIMULATION.num_deals
+    }
+
+    fn default_rollouts_per_deal() -> i32 {
+        DEFAULT_PASS_SIMULATION.rollouts_per_deal
+    }
+
+    fn default_time_limit_ms() -> u64 {
+        DEFAULT_PASS_SIMULATION.time_limit.unwrap().as_millis() as u64
+    }
+
+    fn to_strategy(&self) -> Result<hearts_ai::CardsToPassStrategy, ParseError> {
+        return match *self {
+            JsonCardsToPassStrategy::Random => Ok(hearts_ai::CardsToPassStrategy::Random),
+            JsonCardsToPassStrategy::Heuristic => Ok(hearts_ai::CardsToPassStrategy::Heuristic),
+            JsonCardsToPassStrategy::Simulation {
+                candidate_cards,
+                num_deals,
+                rollouts_per_deal,
+                threads,
+                time_limit_ms,
+                p_random,
+            } => {
+                if num_deals < 1 || rollouts_per_deal < 1 {
+                    return Err(ParseError::new(
+                        "num_deals and rollouts_per_deal must be positive",
+                    ));
+                }
+                Ok(hearts_ai::CardsToPassStrategy::Simulation(
+                    p_random,
+                    PassSimulationParams {
+                        num_candidate_cards: candidate_cards,
+                        num_deals: num_deals,
+                        rollouts_per_deal: rollouts_per_deal,
+                        num_threads: threads,
+                        time_limit: if time_limit_ms > 0 {
+                            Some(Duration::from_millis(time_limit_ms))
+                        } else {
+                            None
+                        },
+                    },
+                ))
+            }
+        };
+    }
+}
+
 #[derive(Deserialize)]
 struct JsonTrick {
     leader: usize,
@@ -132,6 +220,147 @@ impl JsonTrick {
     }
 }
 
+// Optional "strategy" field of a card to play request, for example
+// {"name": "monte_carlo", "num_hands": 100}. Omitted parameters use the defaults
+// below. The Monte Carlo strategy switches to the exact endgame search
+// when the hand has at most `endgame_hand_size` cards, or never if it's 0.
+// "linear_policy" and Monte Carlo with "rollout_policy": "linear" use the
+// policy from hearts_policy::current_linear_policy. Monte Carlo with
+// "reuse_deals": true reuses deals from the player's earlier searches in the
+// same round, for requests that have a "round_id".
+#[derive(Deserialize)]
+#[serde(tag = "name", rename_all = "snake_case")]
+enum JsonCardToPlayStrategy {
+    Random,
+    AvoidPoints,
+    LinearPolicy,
+    MonteCarlo {
+        #[serde(default = "JsonCardToPlayStrategy::default_num_hands")]
+        num_hands: i32,
+        #[serde(default = "JsonCardToPlayStrategy::default_rollouts_per_hand")]
+        rollouts_per_hand: i32,
+        #[serde(default = "JsonCardToPlayStrategy::default_p_random")]
+        p_random: f64,
+        #[serde(default)]
+        rollout_policy: JsonRolloutPolicy,
+        #[serde(default = "JsonCardToPlayStrategy::default_endgame_hand_size")]
+        endgame_hand_size: usize,
+        #[serde(default = "JsonCardToPlayStrategy::default_endgame_num_hands")]
+        endgame_num_hands: i32,
+        // Whether to use hearts_ai::DEFAULT_EARLY_STOPPING.
+        #[serde(default = "JsonCardToPlayStrategy::default_early_stopping")]
+        early_stopping: bool,
+        #[serde(default)]
+        reuse_deals: bool,
+    },
+}
+
+#[derive(Deserialize, Clone, Copy)]
+#[serde(rename_all = "snake_case")]
+enum JsonRolloutPolicy {
+    AvoidPoints,
+    Linear,
+}
+
+impl Default for JsonRolloutPolicy {
+    fn default() -> JsonRolloutPolicy {
+        JsonRolloutPolicy::AvoidPoints
+    }
+}
+
+impl JsonCardToPlayStrategy {
+    fn default_num_hands() -> i32 {
+        50
+    }
+
+    fn default_rollouts_per_hand() -> i32 {
+        20
+    }
+
+    fn default_p_random() -> f64 {
+        0.1
+    }
+
+    fn default_early_stopping() -> bool {
+        true
+    }
+
+    fn default_endgame_hand_size() -> usize {
+        hearts_endgame::DEFAULT_MAX_HAND_SIZE
+    }
+
+    fn default_endgame_num_hands() -> i32 {
+        hearts_endgame::DEFAULT_NUM_HANDS
+    }
+
+    fn to_strategy(&self) -> Result<hearts_ai::CardToPlayStrategy, ParseError> {
+        return match *self {
+            JsonCardToPlayStrategy::Random => Ok(hearts_ai::CardToPlayStrategy::Random),
+            JsonCardToPlayStrategy::AvoidPoints => Ok(hearts_ai::CardToPlayStrategy::AvoidPoints),
+            JsonCardToPlayStrategy::LinearPolicy => Ok(
+                hearts_ai::CardToPlayStrategy::LinearPolicy(hearts_policy::current_linear_policy()),
+            ),
+            JsonCardToPlayStrategy::MonteCarlo {
+                num_hands,
+                rollouts_per_hand,
+                p_random,
+                rollout_policy,
+                endgame_hand_size,
+                endgame_num_hands,
+                early_stopping,
+                reuse_deals,
+            } => {
+                if num_hands < 1 || rollouts_per_hand < 1 {
+                    return Err(ParseError::new(
+                        "num_hands and rollouts_per_hand must be positive",
+                    ));
+                }
+                let mc_params = hearts_ai::MonteCarloParams {
+                    num_hands: num_hands,
+                    rollouts_per_hand: rollouts_per_hand,
+                    endgame: endgame_params(endgame_hand_size, endgame_num_hands)?,
+                    early_stopping: if early_stopping {
+                        Some(hearts_ai::DEFAULT_EARLY_STOPPING)
+                    } else {
+                        None
+                    },
+                    reuse_deals: reuse_deals,
+                };
+                Ok(match rollout_policy {
+                    JsonRolloutPolicy::AvoidPoints => {
+                        hearts_ai::CardToPlayStrategy::MonteCarloMixedRandomAvoidPoints(
+                            p_random, mc_params,
+                        )
+                    }
+                    JsonRolloutPolicy::Linear => {
+                        hearts_ai::CardToPlayStrategy::MonteCarloMixedRandomLinearPolicy(
+                            p_random,
+                            hearts_policy::current_linear_policy(),
+                            mc_params,
+                        )
+                    }
+                })
+            }
+        };
+    }
+}
+
+fn endgame_params(
+    max_hand_size: usize,
+    num_hands: i32,
+) -> Result<Option<EndgameParams>, ParseError> {
+    if max_hand_size == 0 {
+        return Ok(None);
+    }
+    if num_hands < 1 {
+        return Err(ParseError::new("endgame_num_hands must be positive"));
+    }
+    return Ok(Some(EndgameParams {
+        max_hand_size: max_hand_size,
+        num_hands: num_hands,
+    }));
+}
+
 #[derive(Deserialize)]
 struct JsonCardToPlayRequest {
     #[serde(default)]
@@ -143,6 +372,12 @@ struct JsonCardToPlayRequest {
     pass_direction: u32,
     passed_cards: String,
     received_cards: String,
+    #[serde(default)]
+    strategy: Option<JsonCardToPlayStrategy>,
+    // Lets searches reuse work from the player's earlier requests with the
+    // same ID; see hearts_deal_cache.rs.
+    #[serde(default)]
+    round_id: Option<u64>,
 }
 
 impl JsonCardToPlayRequest {
@@ -156,6 +391,7 @@ impl JsonCardToPlayRequest {
             pass_direction: self.pass_direction,
             passed_cards: cards_from_str(&self.passed_cards)?,
             received_cards: cards_from_str(&self.received_cards)?,
+            round_id: self.round_id,
         });
     }
 }
@@ -192,11 +428,49 @@ pub fn parse_cards_to_pass_request(s: &str) -> Result<hearts_ai::CardsToPassRequ
     return Ok(req.to_request()?);
 }
 
+// Like parse_cards_to_pass_request, but also returns the strategy from the
+// request's "strategy" field, if it has one.
+pub fn parse_cards_to_pass_request_and_strategy(
+    s: &str,
+) -> Result<
+    (
+        hearts_ai::CardsToPassRequest,
+        Option<hearts_ai::CardsToPassStrategy>,
+    ),
+    ParseError,
+> {
+    let req: JsonCardsToPassRequest = serde_json::from_str(s)?;
+    let strategy = match &req.strategy {
+        Some(js) => Some(js.to_strategy()?),
+        None => None,
+    };
+    return Ok((req.to_request()?, strategy));
+}
+
 pub fn parse_card_to_play_request(s: &str) -> Result<hearts_ai::CardToPlayDirectRequest, ParseError> {
     let req: JsonCardToPlayRequest = serde_json::from_str(s)?;
     return Ok(req.to_request()?);
 }
 
+// Like parse_card_to_play_request, but also returns the strategy from the
+// request's "strategy" field, if it has one.
+pub fn parse_card_to_play_request_and_strategy(
+    s: &str,
+) -> Result<
+    (
+        hearts_ai::CardToPlayDirectRequest,
+        Option<hearts_ai::CardToPlayStrategy>,
+    ),
+    ParseError,
+> {
+    let req: JsonCardToPlayRequest = serde_json::from_str(s)?;
+    let strategy = match &req.strategy {
+        Some(js) => Some(js.to_strategy()?),
+        None => None,
+    };
+    return Ok((req.to_request()?, strategy));
+}
+
 pub fn parse_trick_history(s: &str) -> Result<TrickHistory, ParseError> {
     let j: JsonTrickHistory = serde_json::from_str(s)?;
     return Ok(j.to_history()?);
@@ -220,6 +494,53 @@ mod test {
         )
         .unwrap();
         assert_eq!(req.hand.len(), 4);
+        assert_eq!(req.player_index, 0);
+    }
+
+    #[test]
+    fn test_parse_pass_strategy() {
+        let (req, strategy) = parse_cards_to_pass_request_and_strategy(
+            r#"
+            {
+                "scores_before_round": [30, 10, 20, 40],
+                "player_index": 2,
+                "hand": "2C 8D AS QD",
+                "direction": 1,
+                "num_cards": 3,
+                "strategy": {"name": "simulation", "num_deals": 50, "time_limit_ms": 0}
+            }
+        "#,
+        )
+        .unwrap();
+        assert_eq!(req.player_index, 2);
+        match strategy {
+            Some(hearts_ai::CardsToPassStrategy::Simulation(p, params)) => {
+                assert_eq!(p, 0.1);
+                assert_eq!(params.num_deals, 50);
+                assert_eq!(
+                    params.num_candidate_cards,
+                    DEFAULT_PASS_SIMULATION.num_candidate_cards
+                );
+                assert!(params.time_limit.is_none());
+            }
+            _ => panic!("Expected simulation strategy"),
+        }
+
+        let (_, heuristic) = parse_cards_to_pass_request_and_strategy(
+            r#"{"scores_before_round": [0, 0, 0, 0], "hand": "2C", "direction": 1, "num_cards": 1,
+                "strategy": {"name": "heuristic"}}"#,
+        )
+        .unwrap();
+        assert!(matches!(
+            heuristic,
+            Some(hearts_ai::CardsToPassStrategy::Heuristic)
+        ));
+
+        assert!(parse_cards_to_pass_request_and_strategy(
+            r#"{"scores_before_round": [0, 0, 0, 0], "hand": "2C", "direction": 1, "num_cards": 1,
+                "strategy": {"name": "simulation", "num_deals": 0}}"#,
+        )
+        .is_err());
     }
 
     #[test]
@@ -241,6 +562,100 @@ mod test {
         assert_eq!(req.hand.len(), 3);
     }
 
+    fn play_request_with_strategy(strategy: &str) -> String {
+        return format!(
+            r#"
+            {{
+                "scores_before_round": [30, 10, 20, 40],
+                "hand": "2C 8D AS",
+                "prev_tricks": [],
+                "current_trick": {{"leader": 0, "cards": ""}},
+                "pass_direction": 0,
+                "passed_cards": "",
+                "received_cards": ""{}
+            }}
+        "#,
+            strategy
+        );
+    }
+
+    #[test]
+    fn test_parse_play_strategy() {
+        let (_, none) =
+            parse_card_to_play_request_and_strategy(&play_request_with_strategy("")).unwrap();
+        assert!(none.is_none());
+
+        let (req, avoid) = parse_card_to_play_request_and_strategy(&play_request_with_strategy(
+            r#", "strategy": {"name": "avoid_points"}"#,
+        ))
+        .unwrap();
+        assert_eq!(req.hand.len(), 3);
+        assert!(matches!(
+            avoid,
+            Some(hearts_ai::CardToPlayStrategy::AvoidPoints)
+        ));
+
+        let (_, mc) = parse_card_to_play_request_and_strategy(&play_request_with_strategy(
+            r#", "strategy": {"name": "monte_carlo", "num_hands": 10}"#,
+        ))
+        .unwrap();
+        match mc {
+            Some(hearts_ai::CardToPlayStrategy::MonteCarloMixedRandomAvoidPoints(p, params)) => {
+                assert_eq!(p, 0.1);
+                assert_eq!(params.num_hands, 10);
+                assert_eq!(params.rollouts_per_hand, 20);
+                assert_eq!(
+                    params.endgame.unwrap().max_hand_size,
+                    hearts_endgame::DEFAULT_MAX_HAND_SIZE
+                );
+                assert!(params.early_stopping.is_some());
+            }
+            _ => panic!("Expected Monte Carlo strategy"),
+        }
+
+        let (_, mc_linear) = parse_card_to_play_request_and_strategy(&play_request_with_strategy(
+            r#", "strategy": {"name": "monte_carlo", "rollout_policy": "linear"}"#,
+        ))
+        .unwrap();
+        match mc_linear {
+            Some(hearts_ai::CardToPlayStrategy::MonteCarloMixedRandomLinearPolicy(
+                p,
+                policy,
+                params,
+            )) => {
+                assert_eq!(p, 0.1);
+                assert_eq!(policy, hearts_policy::current_linear_policy());
+                assert_eq!(params.num_hands, 50);
+            }
+            _ => panic!("Expected Monte Carlo strategy with linear rollouts"),
+        }
+
+        let (_, linear) = parse_card_to_play_request_and_strategy(&play_request_with_strategy(
+            r#", "strategy": {"name": "linear_policy"}"#,
+        ))
+        .unwrap();
+        assert!(matches!(
+            linear,
+            Some(hearts_ai::CardToPlayStrategy::LinearPolicy(_))
+        ));
+    }
+
+    #[test]
+    fn test_parse_invalid_play_strategy() {
+        assert!(
+            parse_card_to_play_request_and_strategy(&play_request_with_strategy(
+                r#", "strategy": {"name": "psychic"}"#
+            ))
+            .is_err()
+        );
+        assert!(
+            parse_card_to_play_request_and_strategy(&play_request_with_strategy(
+                r#", "strategy": {"name": "monte_carlo", "rollout_policy": "psychic"}"#
+            ))
+            .is_err()
+        );
+    }
+
     #[test]
     fn test_parse_tricks() {
         let empty = parse_trick_history(r#"{"tricks": []}"#).unwrap();
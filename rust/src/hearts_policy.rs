@@ -0,0 +1,458 @@
+use crate::card::*;
+use crate::hearts;
+use crate::hearts_ai::{
+    choose_card_avoid_points, make_card_distribution_req, possible_round, ChooseCardToPlayRequest,
+};
+use crate::hearts_rollout::RolloutRound;
+
+use rand::Rng;
+use std::sync::RwLock;
+
+// A rollout policy that scores each legal play with a linear function of
+// features of the play, and plays the highest scoring card. The weights are
+// fit by py/train_rollout_policy.py to the plays that Monte Carlo search makes
+// in self-play. Playing directly, the policy takes about 0.8 fewer points per
+// round than choose_card_avoid_points. Monte Carlo search with it in rollouts
+// hasn't done better than with the avoid points rollouts, and each rollout
+// takes about twice as long, so it isn't the default.
+//
+// Features only depend on what the player can see: their hand, the cards that
+// haven't been played yet, and the current trick. They're computed from
+// bitmasks of the hand and of the other players' cards, which are found once
+// per play rather than once per legal card.
+
+pub const NUM_FEATURES: usize = 24;
+
+// Indices into the feature array. Each feature is 0 unless the play is of the
+// kind in its name: leading, following suit, or discarding.
+const LEAD_RANK: usize = 0;
+// No other player has a higher card in the suit.
+const LEAD_WINS: usize = 1;
+const LEAD_LOWER_CARDS_OUT: usize = 2;
+const LEAD_HIGHER_CARDS_OUT: usize = 3;
+const LEAD_HEART: usize = 4;
+const LEAD_SPADE_BELOW_QUEEN: usize = 5;
+const LEAD_SPADE_ABOVE_QUEEN: usize = 6;
+const LEAD_SUIT_LENGTH: usize = 7;
+const LEAD_POINTS: usize = 8;
+const FOLLOW_RANK: usize = 9;
+const FOLLOW_WINS_LAST: usize = 10;
+const FOLLOW_TAKES_POINTS_LAST: usize = 11;
+// Winning so far, with players still to play.
+const FOLLOW_WINS_NOT_LAST: usize = 12;
+const FOLLOW_RISKS_POINTS: usize = 13;
+const FOLLOW_HIGHER_CARDS_OUT: usize = 14;
+const FOLLOW_DUCKS_QUEEN: usize = 15;
+const FOLLOW_SPADE_ABOVE_QUEEN: usize = 16;
+const FOLLOW_POINTS: usize = 17;
+const DISCARD_RANK: usize = 18;
+const DISCARD_POINTS: usize = 19;
+const DISCARD_QUEEN: usize = 20;
+const DISCARD_SPADE_ABOVE_QUEEN: usize = 21;
+const DISCARD_VOIDS_SUIT: usize = 22;
+const DISCARD_SUIT_LENGTH: usize = 23;
+
+const MAGIC: &[u8; 4] = b"HRLP";
+
+fn card_bit(card: &Card) -> u64 {
+    return 1 << card.index();
+}
+
+fn suit_mask(suit: Suit) -> u64 {
+    return 0x1fff << (13 * suit.index());
+}
+
+fn rank_fraction(card: &Card) -> f32 {
+    return (card.rank.value - 2) as f32 / 12.0;
+}
+
+fn count_fraction(bits: u64) -> f32 {
+    return bits.count_ones() as f32 / 13.0;
+}
+
+// What the current player knows about a position, as bitmasks.
+struct Position<'a> {
+    round: &'a RolloutRound,
+    hand: u64,
+    // Cards in the other players' hands, which are the cards that haven't
+    // been played and aren't in `hand`.
+    others: u64,
+    trick_high_card: Option<Card>,
+    is_last_play: bool,
+    queen_out: bool,
+}
+
+impl Position<'_> {
+    fn new(round: &RolloutRound) -> Position {
+        let player = round.current_player_index();
+        let mut others = 0;
+        for p in 0..round.num_players() {
+            if p != player {
+                others |= round.hand(p).bits;
+            }
+        }
+        return Position {
+            round: round,
+            hand: round.hand(player).bits,
+            others: others,
+            trick_high_card: round.trick_high_card(),
+            is_last_play: round.trick_size() == round.num_players() - 1,
+            queen_out: others & card_bit(&hearts::QUEEN_OF_SPADES) != 0,
+        };
+    }
+
+    fn features(&self, card: &Card) -> [f32; NUM_FEATURES] {
+        let mut f = [0f32; NUM_FEATURES];
+        let bit = card_bit(card);
+        let suit = suit_mask(card.suit);
+        let higher_out = self.others & suit & !(bit | (bit - 1));
+        let lower_out = self.others & suit & (bit - 1);
+        let points = self.round.card_points(card) as f32 / 13.0;
+        let is_spade_above_queen = card.suit == Suit::Spades && card.rank > Rank::QUEEN;
+        match self.trick_high_card {
+            None => {
+                f[LEAD_RANK] = rank_fraction(card);
+                f[LEAD_WINS] = (higher_out == 0) as i32 as f32;
+                f[LEAD_LOWER_CARDS_OUT] = count_fraction(lower_out);
+                f[LEAD_HIGHER_CARDS_OUT] = count_fraction(higher_out);
+                f[LEAD_HEART] = (card.suit == Suit::Hearts) as i32 as f32;
+                f[LEAD_SPADE_BELOW_QUEEN] = (card.suit == Suit::Spades
+                    && card.rank < Rank::QUEEN
+                    && self.queen_out) as i32 as f32;
+                f[LEAD_SPADE_ABOVE_QUEEN] = (is_spade_above_queen && self.queen_out) as i32 as f32;
+                f[LEAD_SUIT_LENGTH] = count_fraction(self.hand & suit);
+                f[LEAD_POINTS] = points;
+            }
+            Some(high_card) if high_card.suit == card.suit => {
+                let wins = card.rank > high_card.rank;
+                let trick_points = self.round.trick_points() as f32 / 13.0;
+                f[FOLLOW_RANK] = rank_fraction(card);
+                if wins && self.is_last_play {
+                    f[FOLLOW_WINS_LAST] = 1.0;
+                    f[FOLLOW_TAKES_POINTS_LAST] = trick_points + points;
+                } else if wins {
+                    f[FOLLOW_WINS_NOT_LAST] = 1.0;
+                    f[FOLLOW_RISKS_POINTS] = trick_points + points;
+                    f[FOLLOW_HIGHER_CARDS_OUT] = count_fraction(higher_out);
+                }
+                f[FOLLOW_DUCKS_QUEEN] = (*card == hearts::QUEEN_OF_SPADES && !wins) as i32 as f32;
+                f[FOLLOW_SPADE_ABOVE_QUEEN] =
+                    (is_spade_above_queen && self.queen_out) as i32 as f32;
+                f[FOLLOW_POINTS] = points;
+            }
+            Some(_) => {
+                f[DISCARD_RANK] = rank_fraction(card);
+                f[DISCARD_POINTS] = points;
+                f[DISCARD_QUEEN] = (*card == hearts::QUEEN_OF_SPADES) as i32 as f32;
+                f[DISCARD_SPADE_ABOVE_QUEEN] =
+                    (is_spade_above_queen && self.queen_out) as i32 as f32;
+                f[DISCARD_VOIDS_SUIT] = ((self.hand & suit).count_ones() == 1) as i32 as f32;
+                f[DISCARD_SUIT_LENGTH] = count_fraction(self.hand & suit);
+            }
+        }
+        return f;
+    }
+}
+
+// Returns the features of playing `card` in `round`, which must be a legal play.
+pub fn play_features(round: &RolloutRound, card: &Card) -> [f32; NUM_FEATURES] {
+    return Position::new(round).features(card);
+}
+
+// Returns the legal plays for a request and their features. The features
+// don't depend on how the unseen cards are dealt, so any deal that's
+// consistent with the request works.
+pub fn play_features_for_request(
+    req: &impl ChooseCardToPlayRequest,
+    rng: impl Rng,
+) -> Result<Vec<(Card, [f32; NUM_FEATURES])>, CardError> {
+    let sampler = CardDistributionSampler::new(&make_card_distribution_req(req))?;
+    let round = RolloutRound::from_round(&possible_round(req, &sampler, rng));
+    let position = Position::new(&round);
+    return Ok(req
+        .legal_plays()
+        .iter()
+        .map(|c| (*c, position.features(c)))
+        .collect());
+}
+
+#[derive(Debug, Clone, Copy, PartialEq)]
+pub struct LinearPolicy {
+    pub weights: [f32; NUM_FEATURES],
+}
+
+// Fit to 83000 plays from 2000 rounds of self-play with the default Monte
+// Carlo strategy, where the highest scoring play matches the search's choice
+// 48% of the time.
+pub const DEFAULT_LINEAR_POLICY: LinearPolicy = LinearPolicy {
+    weights: [
+        -0.7061, -0.4261, 1.0567, 0.8420, 0.1241, 0.8847, -0.6232, -4.4649, -0.8634, 2.0865,
+        -1.3829, -1.9919, -1.8857, -2.1091, 1.2105, 0.6341, -0.0417, -0.3857, 1.3643, 1.3147,
+        0.3817, 0.7034, 0.8091, -2.8847,
+    ],
+};
+
+impl LinearPolicy {
+    fn score(&self, features: &[f32; NUM_FEATURES]) -> f32 {
+        let mut score = 0.0;
+        for i in 0..NUM_FEATURES {
+            score += self.weights[i] * features[i];
+        }
+        return score;
+    }
+
+    // Returns the legal play with the highest score, or the lowest card
+    // among plays with the same score.
+    pub fn choose_card(&self, round: &RolloutRound) -> Card {
+        let mut legal = round.legal_plays();
+        assert!(legal != 0);
+        if legal.count_ones() == 1 {
+            return Card::from_index(legal.trailing_zeros() as usize);
+        }
+        let position = Position::new(round);
+        let mut best_card = hearts::TWO_OF_CLUBS;
+        let mut best_score = f32::NEG_INFINITY;
+        while legal != 0 {
+            let card = Card::from_index(legal.trailing_zeros() as usize);
+            let score = self.score(&position.features(&card));
+            if score > best_score {
+                best_card = card;
+                best_score = score;
+            }
+            legal &= legal - 1;
+        }
+        return best_card;
+    }
+
+    // Chooses a card for a request by playing it out as a RolloutRound, with
+    // any deal of the unseen cards.
+    pub fn choose_card_for_request(
+        &self,
+        req: &impl ChooseCardToPlayRequest,
+        mut rng: impl Rng,
+    ) -> Card {
+        return match CardDistributionSampler::new(&make_card_distribution_req(req)) {
+            Ok(sampler) => {
+                let round = possible_round(req, &sampler, &mut rng);
+                self.choose_card(&RolloutRound::from_round(&round))
+            }
+            Err(_) => choose_card_avoid_points(req, rng),
+        };
+    }
+
+    // File format: MAGIC, the number of features as a little-endian u32, and
+    // then the weights as little-endian f32s.
+    pub fn to_bytes(&self) -> Vec<u8> {
+        let mut bytes: Vec<u8> = Vec::new();
+        bytes.extend_from_slice(MAGIC);
+        bytes.extend_from_slice(&(NUM_FEATURES as u32).to_le_bytes());
+        for w in self.weights.iter() {
+            bytes.extend_from_slice(&w.to_le_bytes());
+        }
+        return bytes;
+    }
+
+    pub fn from_bytes(bytes: &[u8]) -> Result<LinearPolicy, String> {
+        if bytes.len() < 8 || &bytes[0..4] != MAGIC {
+            return Err("Not a rollout policy".to_string());
+        }
+        let num_features = u32::from_le_bytes([bytes[4], bytes[5], bytes[6], bytes[7]]) as usize;
+        if num_features != NUM_FEATURES || bytes.len() != 8 + 4 * NUM_FEATURES {
+            return Err(format!(
+                "Rollout policy must have {} features",
+                NUM_FEATURES
+            ));
+        }
+        let mut weights = [0f32; NUM_FEATURES];
+        for i in 0..NUM_FEATURES {
+            let offset = 8 + 4 * i;
+            weights[i] = f32::from_le_bytes([
+                bytes[offset],
+                bytes[offset + 1],
+                bytes[offset + 2],
+                bytes[offset + 3],
+            ]);
+        }
+        return Ok(LinearPolicy { weights: weights });
+    }
+}
+
+static LOADED_POLICY: RwLock<Option<LinearPolicy>> = RwLock::new(None);
+
+// Replaces DEFAULT_LINEAR_POLICY as the policy that current_linear_policy returns.
+pub fn set_linear_policy(policy: LinearPolicy) {
+    *LOADED_POLICY.write().unwrap() = Some(policy);
+}
+
+// The policy to use when a strategy asks for linear rollouts: the last one
+// passed to set_linear_policy, or DEFAULT_LINEAR_POLICY.
+pub fn current_linear_policy() -> LinearPolicy {
+    return LOADED_POLICY
+        .read()
+        .unwrap()
+        .unwrap_or(DEFAULT_LINEAR_POLICY);
+}
+
+#[cfg(test)]
+mod test {
+    use super::*;
+    use crate::hearts_ai;
+    use rand::rngs::StdRng;
+    use rand::SeedableRng;
+
+    fn c(s: &str) -> Vec<Card> {
+        cards_from_str(s).unwrap()
+    }
+
+    // A position after the first trick, with the given hands and current trick.
+    fn round(hands: &[&str], leader: usize, trick: &str) -> RolloutRound {
+        let round = hearts::Round {
+            rules: hearts::RuleSet::default(),
+            players: hands.iter().map(|h| hearts::Player::new(&c(h))).collect(),
+            initial_scores: vec![0, 0, 0, 0],
+            pass_direction: 0,
+            num_passed_cards: 0,
+            status: hearts::RoundStatus::Playing,
+            current_trick: hearts::TrickInProgress {
+                leader: leader,
+                cards: c(trick),
+            },
+            prev_tricks: vec![hearts::Trick {
+                leader: 0,
+                cards: c("2C AC KC QC"),
+                winner: 1,
+            }],
+        };
+        return RolloutRound::from_round(&round);
+    }
+
+    #[test]
+    fn test_lead_features() {
+        let rr = round(
+            &["QS 5S 9H 2H", "KS 8D 3H 4C", "AS 3S 4H 5H", "JS 6S 7S 8S"],
+            0,
+            "",
+        );
+        let f = play_features(&rr, &c("5S")[0]);
+        assert_eq!(f[LEAD_RANK], 3.0 / 12.0);
+        assert_eq!(f[LEAD_WINS], 0.0);
+        assert_eq!(f[LEAD_LOWER_CARDS_OUT], 1.0 / 13.0);
+        assert_eq!(f[LEAD_HIGHER_CARDS_OUT], 6.0 / 13.0);
+        // The player has the queen.
+        assert_eq!(f[LEAD_SPADE_BELOW_QUEEN], 0.0);
+        assert_eq!(f[LEAD_SUIT_LENGTH], 2.0 / 13.0);
+        assert_eq!(f[FOLLOW_RANK], 0.0);
+
+        let rr = round(
+            &["KS 5S 9H 2H", "QS 8D 3H 4C", "AS 3S 4H 5H", "JS 6S 7S 8S"],
+            0,
+            "",
+        );
+        assert_eq!(play_features(&rr, &c("5S")[0])[LEAD_SPADE_BELOW_QUEEN], 1.0);
+        assert_eq!(play_features(&rr, &c("KS")[0])[LEAD_SPADE_ABOVE_QUEEN], 1.0);
+        assert_eq!(play_features(&rr, &c("9H")[0])[LEAD_WINS], 1.0);
+    }
+
+    #[test]
+    fn test_follow_features() {
+        let rr = round(
+            &["5S 9H 2H", "8D 3H 4C", "3S 4H 5H", "KS 6S 7S 8S"],
+            0,
+            "QS JS AS",
+        );
+        let f = play_features(&rr, &c("KS")[0]);
+        assert_eq!(f[FOLLOW_WINS_LAST], 0.0);
+        assert_eq!(f[FOLLOW_SPADE_ABOVE_QUEEN], 0.0);
+        assert_eq!(f[LEAD_RANK], 0.0);
+
+        let rr = round(
+            &["5S 9H 2H", "8D 3H 4C", "3S 4H 5H", "KS 6S 7S 8S"],
+            0,
+            "QS JS 2S",
+        );
+        let f = play_features(&rr, &c("KS")[0]);
+        assert_eq!(f[FOLLOW_WINS_LAST], 1.0);
+        assert_eq!(f[FOLLOW_TAKES_POINTS_LAST], 1.0);
+
+        let rr = round(&["5S 9H 2H", "8D 4C", "3S 4H 5H", "KS 6S 7S 8S"], 1, "3H");
+        let f = play_features(&rr, &c("5H")[0]);
+        assert_eq!(f[FOLLOW_WINS_NOT_LAST], 1.0);
+        assert_eq!(f[FOLLOW_RISKS_POINTS], 2.0 / 13.0);
+        assert_eq!(f[FOLLOW_HIGHER_CARDS_OUT], 1.0 / 13.0);
+        assert_eq!(f[FOLLOW_POINTS], 1.0 / 13.0);
+    }
+
+    #[test]
+    fn test_discard_features() {
+        let rr = round(
+            &["5S 9H 2H", "8D 3H 4C", "3S 4H 5H", "KS 6S 7S 8S"],
+            0,
+            "5S",
+        );
+        let f = play_features(&rr, &c("3H")[0]);
+        assert_eq!(f[DISCARD_POINTS], 1.0 / 13.0);
+        assert_eq!(f[DISCARD_VOIDS_SUIT], 1.0);
+        assert_eq!(f[DISCARD_SUIT_LENGTH], 1.0 / 13.0);
+        assert_eq!(f[DISCARD_QUEEN], 0.0);
+    }
+
+    #[test]
+    fn test_choose_card() {
+        let rr = round(&["", "QS 3H 4C", "AD", "KD"], 0, "8D");
+        let mut weights = [0f32; NUM_FEATURES];
+        weights[DISCARD_QUEEN] = 1.0;
+        weights[DISCARD_RANK] = 0.5;
+        assert_eq!(
+            LinearPolicy { weights: weights }.choose_card(&rr),
+            c("QS")[0]
+        );
+        weights[DISCARD_QUEEN] = -1.0;
+        assert_eq!(
+            LinearPolicy { weights: weights }.choose_card(&rr),
+            c("4C")[0]
+        );
+        assert_eq!(DEFAULT_LINEAR_POLICY.choose_card(&rr), c("QS")[0]);
+        // Ties go to the lowest card.
+        let weights = [0f32; NUM_FEATURES];
+        assert_eq!(
+            LinearPolicy { weights: weights }.choose_card(&rr),
+            c("4C")[0]
+        );
+    }
+
+    #[test]
+    fn test_play_features_for_request() {
+        let mut rng: StdRng = SeedableRng::seed_from_u64(42);
+        let mut deck = Deck::new();
+        deck.shuffle(&mut rng);
+        let rules = hearts::RuleSet::default();
+        let mut round = hearts::Round::deal(&deck, &rules, &[0, 0, 0, 0], 0);
+        for _ in 0..10 {
+            let card = hearts_ai::choose_card_avoid_points(&round, &mut rng);
+            round.play_card(&card);
+        }
+        let plays = play_features_for_request(&round, &mut rng).unwrap();
+        assert_eq!(plays.len(), round.legal_plays().len());
+        let rr = RolloutRound::from_round(&round);
+        for (card, features) in plays.iter() {
+            assert_eq!(*features, play_features(&rr, card));
+        }
+    }
+
+    #[test]
+    fn test_bytes() {
+        let mut weights = [0f32; NUM_FEATURES];
+        for i in 0..NUM_FEATURES {
+            weights[i] = i as f32 - 3.5;
+        }
+        let policy = LinearPolicy { weights: weights };
+        assert_eq!(
+            LinearPolicy::from_bytes(&policy.to_bytes()).unwrap(),
+            policy
+        );
+        assert!(LinearPolicy::from_bytes(&policy.to_bytes()[..20]).is_err());
+        let mut wrong_size = policy.to_bytes();
+        wrong_size[4] = 2;
+        assert!(LinearPolicy::from_bytes(&wrong_size).is_err());
+    }
+}
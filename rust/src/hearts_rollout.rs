@@ -0,0 +1,578 @@
+use crate::card::*;
+use crate::hearts;
+use crate::hearts_policy::LinearPolicy;
+
+use rand::Rng;
+
+// Compact representation of a round for Monte Carlo rollouts. Hands are
+// bitmasks and trick state is updated incrementally, so playing a card and
+// finding legal plays don't allocate, and copying a round is a memcpy. It
+// follows the same rules as hearts::Round, and `choose_card` follows the same
+// strategies as hearts_ai::choose_card_nonrecursive.
+
+pub const MAX_PLAYERS: usize = 8;
+
+const HEARTS_MASK: u64 = 0x1fff << (13 * 2);
+const SUIT_MASK: u64 = 0x1fff;
+
+fn suit_mask(suit_index: usize) -> u64 {
+    return SUIT_MASK << (13 * suit_index);
+}
+
+fn card_bit(card: &Card) -> u64 {
+    return 1 << card.index();
+}
+
+fn lowest_card(bits: u64) -> Card {
+    return Card::from_index(bits.trailing_zeros() as usize);
+}
+
+fn highest_card(bits: u64) -> Card {
+    return Card::from_index(63 - bits.leading_zeros() as usize);
+}
+
+// Returns the highest ranked card in `bits`. If cards in different suits have
+// that rank, returns the one in the last suit in ALL_SUITS order, which is
+// what hearts_ai does for hands that are sorted by suit.
+fn highest_rank_card(bits: u64) -> Card {
+    let mut ranks: u64 = 0;
+    for s in 0..4 {
+        ranks |= (bits >> (13 * s)) & SUIT_MASK;
+    }
+    let rank_offset = 63 - ranks.leading_zeros() as usize;
+    for s in (0..4).rev() {
+        if bits & (1 << (13 * s + rank_offset)) != 0 {
+            return Card::from_index(13 * s + rank_offset);
+        }
+    }
+    panic!("No cards");
+}
+
+fn random_card(bits: u64, mut rng: impl Rng) -> Card {
+    let n = bits.count_ones();
+    let mut remaining = bits;
+    for _ in 0..rng.gen_range(0..n) {
+        remaining &= remaining - 1;
+    }
+    return lowest_card(remaining);
+}
+
+#[derive(Debug, Clone, Copy)]
+pub struct RolloutRound {
+    num_players: usize,
+    points_on_first_trick: bool,
+    queen_breaks_hearts: bool,
+    jd_minus_10: bool,
+    moon_shooting: bool,
+    // Cards that count as points on the first trick: hearts, QS.
+    point_cards_mask: u64,
+    hands: [u64; MAX_PLAYERS],
+    num_prev_tricks: usize,
+    hearts_broken: bool,
+    // Points taken in completed tricks, not counting shooting the moon.
+    points: [i32; MAX_PLAYERS],
+    jd_winner: Option<usize>,
+    trick_leader: usize,
+    trick_size: usize,
+    trick_suit: usize,
+    // Highest card of the led suit played so far, and who played it.
+    trick_high_card: Card,
+    trick_winner: usize,
+    trick_points: i32,
+    trick_has_jd: bool,
+}
+
+impl RolloutRound {
+    pub fn from_round(round: &hearts::Round) -> RolloutRound {
+        let rules = &round.rules;
+        let num_players = rules.num_players;
+        assert!(num_players <= MAX_PLAYERS);
+        let mut hands = [0u64; MAX_PLAYERS];
+        for p in 0..num_players {
+            hands[p] = CardSet::from_cards(&round.players[p].hand).bits;
+        }
+        let mut points = [0i32; MAX_PLAYERS];
+        let mut jd_winner: Option<usize> = None;
+        for t in round.prev_tricks.iter() {
+            points[t.winner] += hearts::points_for_cards(&t.cards, rules);
+            if t.cards.contains(&hearts::JACK_OF_DIAMONDS) {
+                jd_winner = Some(t.winner);
+            }
+        }
+        let mut rr = RolloutRound {
+            num_players: num_players,
+            points_on_first_trick: rules.points_on_first_trick,
+            queen_breaks_hearts: rules.queen_breaks_hearts,
+            jd_minus_10: rules.jd_minus_10,
+            moon_shooting: rules.moon_shooting != hearts::MoonShooting::Disabled,
+            point_cards_mask: HEARTS_MASK | card_bit(&hearts::QUEEN_OF_SPADES),
+            hands: hands,
+            num_prev_tricks: round.prev_tricks.len(),
+            hearts_broken: round.are_hearts_broken(),
+            points: points,
+            jd_winner: jd_winner,
+            trick_leader: round.current_trick.leader,
+            trick_size: 0,
+            trick_suit: 0,
+            trick_high_card: hearts::TWO_OF_CLUBS,
+            trick_winner: round.current_trick.leader,
+            trick_points: 0,
+            trick_has_jd: false,
+        };
+        for c in round.current_trick.cards.iter() {
+            rr.add_to_trick(c);
+        }
+        return rr;
+    }
+
+    // A round that hasn't started yet, where the player with 2C leads.
+    pub fn from_hands(rules: &hearts::RuleSet, hands: &[CardSet]) -> RolloutRound {
+        let num_players = rules.num_players;
+        assert!(num_players <= MAX_PLAYERS);
+        assert_eq!(hands.len(), num_players);
+        let mut hand_bits = [0u64; MAX_PLAYERS];
+        for p in 0..num_players {
+            hand_bits[p] = hands[p].bits;
+        }
+        let leader = (0..num_players)
+            .find(|&p| hand_bits[p] & card_bit(&hearts::TWO_OF_CLUBS) != 0)
+            .expect("No player has 2C");
+        return RolloutRound {
+            num_players: num_players,
+            points_on_first_trick: rules.points_on_first_trick,
+            queen_breaks_hearts: rules.queen_breaks_hearts,
+            jd_minus_10: rules.jd_minus_10,
+            moon_shooting: rules.moon_shooting != hearts::MoonShooting::Disabled,
+            point_cards_mask: HEARTS_MASK | card_bit(&hearts::QUEEN_OF_SPADES),
+            hands: hand_bits,
+            num_prev_tricks: 0,
+            hearts_broken: false,
+            points: [0; MAX_PLAYERS],
+            jd_winner: None,
+            trick_leader: leader,
+            trick_size: 0,
+            trick_suit: 0,
+            trick_high_card: hearts::TWO_OF_CLUBS,
+            trick_winner: leader,
+            trick_points: 0,
+            trick_has_jd: false,
+        };
+    }
+
+    // Replaces a player's hand, for reusing a round with different deals.
+    pub fn set_hand(&mut self, player_index: usize, hand: CardSet) {
+        self.hands[player_index] = hand.bits;
+    }
+
+    pub fn current_player_index(&self) -> usize {
+        return (self.trick_leader + self.trick_size) % self.num_players;
+    }
+
+    pub fn is_over(&self) -> bool {
+        return self.hands[..self.num_players].iter().all(|&h| h == 0);
+    }
+
+    pub fn num_players(&self) -> usize {
+        return self.num_players;
+    }
+
+    pub fn hand(&self, player_index: usize) -> CardSet {
+        return CardSet {
+            bits: self.hands[player_index],
+        };
+    }
+
+    // Number of cards played to the current trick.
+    pub fn trick_size(&self) -> usize {
+        return self.trick_size;
+    }
+
+    // Highest card of the led suit in the current trick, if any cards have been played to it.
+    pub fn trick_high_card(&self) -> Option<Card> {
+        return if self.trick_size > 0 {
+            Some(self.trick_high_card)
+        } else {
+            None
+        };
+    }
+
+    // Points taken in completed tricks, not counting shooting the moon.
+    pub fn points_so_far(&self) -> &[i32; MAX_PLAYERS] {
+        return &self.points;
+    }
+
+    pub fn jd_winner(&self) -> Option<usize> {
+        return self.jd_winner;
+    }
+
+    pub fn hearts_broken(&self) -> bool {
+        return self.hearts_broken;
+    }
+
+    // Points in the current trick so far.
+    pub fn trick_points(&self) -> i32 {
+        return self.trick_points;
+    }
+
+    pub fn card_points(&self, card: &Card) -> i32 {
+        if card.suit == Suit::Hearts {
+            return 1;
+        } else if *card == hearts::QUEEN_OF_SPADES {
+            return 13;
+        } else if self.jd_minus_10 && *card == hearts::JACK_OF_DIAMONDS {
+            return -10;
+        }
+        return 0;
+    }
+
+    // Bitmask of the current player's legal plays. See hearts::legal_plays.
+    pub fn legal_plays(&self) -> u64 {
+        let hand = self.hands[self.current_player_index()];
+        if self.num_prev_tricks == 0 {
+            if self.trick_size == 0 {
+                return hand & card_bit(&hearts::TWO_OF_CLUBS);
+            }
+            let suit_matches = hand & suit_mask(self.trick_suit);
+            if suit_matches != 0 {
+                return suit_matches;
+            }
+            if !self.points_on_first_trick {
+                let non_points = hand & !self.point_cards_mask;
+                if non_points != 0 {
+                    return non_points;
+                }
+            }
+            return hand;
+        }
+        if self.trick_size == 0 {
+            if !self.hearts_broken {
+                let non_hearts = hand & !HEARTS_MASK;
+                if non_hearts != 0 {
+                    return non_hearts;
+                }
+            }
+            return hand;
+        }
+        let suit_matches = hand & suit_mask(self.trick_suit);
+        return if suit_matches != 0 {
+            suit_matches
+        } else {
+            hand
+        };
+    }
+
+    fn add_to_trick(&mut self, card: &Card) {
+        let player = self.current_player_index();
+        if self.trick_size == 0 {
+            self.trick_suit = card.suit.index();
+            self.trick_high_card = *card;
+            self.trick_winner = player;
+        } else if card.suit.index() == self.trick_suit && card.rank > self.trick_high_card.rank {
+            self.trick_high_card = *card;
+            self.trick_winner = player;
+        }
+        self.trick_size += 1;
+        self.trick_points += self.card_points(card);
+        if *card == hearts::JACK_OF_DIAMONDS {
+            self.trick_has_jd = true;
+        }
+        if card.suit == Suit::Hearts
+            || (self.queen_breaks_hearts && *card == hearts::QUEEN_OF_SPADES)
+        {
+            self.hearts_broken = true;
+        }
+    }
+
+    pub fn play_card(&mut self, card: &Card) {
+        let player = self.current_player_index();
+        let bit = card_bit(card);
+        assert!(self.hands[player] & bit != 0);
+        self.hands[player] &= !bit;
+        self.add_to_trick(card);
+        if self.trick_size == self.num_players {
+            let winner = self.trick_winner;
+            self.points[winner] += self.trick_points;
+            if self.trick_has_jd {
+                self.jd_winner = Some(winner);
+            }
+            self.num_prev_tricks += 1;
+            self.trick_leader = winner;
+            self.trick_size = 0;
+            self.trick_points = 0;
+            self.trick_has_jd = false;
+        }
+    }
+
+    // Points taken by each player, including shooting the moon. The same as
+    // hearts::points_for_tricks for the round's tricks.
+    pub fn points_taken(&self) -> [i32; MAX_PLAYERS] {
+        let mut points = self.points;
+        if self.moon_shooting {
+            for p in 0..self.num_players {
+                let jd_adjustment = if self.jd_minus_10 && self.jd_winner == Some(p) {
+                    10
+                } else {
+                    0
+                };
+                if points[p] + jd_adjustment == 26 {
+                    for q in 0..self.num_players {
+                        points[q] += if q == p { -26 } else { 26 };
+                    }
+                    break;
+                }
+            }
+        }
+        return points;
+    }
+
+    pub fn choose_card_random(&self, rng: impl Rng) -> Card {
+        return random_card(self.legal_plays(), rng);
+    }
+
+    // The same strategy as hearts_ai::choose_card_avoid_points.
+    pub fn choose_card_avoid_points(&self, mut rng: impl Rng) -> Card {
+        let legal = self.legal_plays();
+        assert!(legal != 0);
+        if legal.count_ones() == 1 {
+            return lowest_card(legal);
+        }
+        let qs_bit = card_bit(&hearts::QUEEN_OF_SPADES);
+        let jd_bit = card_bit(&hearts::JACK_OF_DIAMONDS);
+        if self.trick_size == 0 {
+            // Lowest card in a random suit.
+            let mut num_suits = 0;
+            for s in 0..4 {
+                if legal & suit_mask(s) != 0 {
+                    num_suits += 1;
+                }
+            }
+            let mut n = rng.gen_range(0..num_suits);
+            for s in 0..4 {
+                if legal & suit_mask(s) != 0 {
+                    if n == 0 {
+                        return lowest_card(legal & suit_mask(s));
+                    }
+                    n -= 1;
+                }
+            }
+            panic!("No suit chosen");
+        }
+        let is_following_suit = legal & suit_mask(self.trick_suit) != 0;
+        let has_qs = legal & qs_bit != 0;
+        let has_jd = self.jd_minus_10 && legal & jd_bit != 0;
+        if is_following_suit {
+            if self.num_prev_tricks == 0 && !self.points_on_first_trick {
+                return highest_card(legal & !qs_bit);
+            }
+            let high_card = self.trick_high_card;
+            if has_qs && high_card.rank > Rank::QUEEN {
+                return hearts::QUEEN_OF_SPADES;
+            }
+            // Legal plays are all in the trick suit, so these are the cards
+            // that won't win the trick.
+            let below_high = legal & (card_bit(&high_card) - 1);
+            let nonwinners = below_high & !(if has_jd { jd_bit } else { 0 });
+            let is_last_play = self.trick_size == self.num_players - 1;
+            if is_last_play {
+                if has_jd && self.trick_points < 10 && high_card.rank < Rank::JACK {
+                    return hearts::JACK_OF_DIAMONDS;
+                }
+                if self.trick_points <= 0 {
+                    return highest_card(legal & !qs_bit);
+                }
+                return if nonwinners != 0 {
+                    highest_card(nonwinners)
+                } else {
+                    highest_card(legal & !qs_bit)
+                };
+            } else {
+                return if nonwinners != 0 {
+                    highest_card(nonwinners)
+                } else {
+                    lowest_card(legal & !qs_bit)
+                };
+            }
+        } else {
+            if has_qs {
+                return hearts::QUEEN_OF_SPADES;
+            }
+            if legal & HEARTS_MASK != 0 {
+                return highest_card(legal & HEARTS_MASK);
+            }
+            return highest_rank_card(legal & !(if has_jd { jd_bit } else { 0 }));
+        }
+    }
+
+    // Returns the card to play using one of the non-recursive strategies.
+    pub fn choose_card(&self, strategy: &RolloutStrategy, mut rng: impl Rng) -> Card {
+        return match strategy {
+            RolloutStrategy::Random => self.choose_card_random(rng),
+            RolloutStrategy::AvoidPoints => self.choose_card_avoid_points(rng),
+            RolloutStrategy::MixedRandomAvoidPoints(p_random) => {
+                if rng.gen_range(0.0_f64..1.0_f64) < *p_random {
+                    self.choose_card_random(rng)
+                } else {
+                    self.choose_card_avoid_points(rng)
+                }
+            }
+            RolloutStrategy::MixedRandomLinearPolicy(p_random, policy) => {
+                if rng.gen_range(0.0_f64..1.0_f64) < *p_random {
+                    self.choose_card_random(rng)
+                } else {
+                    policy.choose_card(self)
+                }
+            }
+        };
+    }
+
+    pub fn play_to_end(&mut self, strategy: &RolloutStrategy, mut rng: impl Rng) {
+        while !self.is_over() {
+            let card = self.choose_card(strategy, &mut rng);
+            self.play_card(&card);
+        }
+    }
+}
+
+// The strategies that RolloutRound can use to choose cards. These correspond
+// to the non-recursive hearts_ai::CardToPlayStrategy variants.
+#[derive(Debug, Clone, Copy)]
+pub enum RolloutStrategy {
+    Random,
+    AvoidPoints,
+    MixedRandomAvoidPoints(f64),
+    MixedRandomLinearPolicy(f64, LinearPolicy),
+}
+
+#[cfg(test)]
+mod test {
+    use super::*;
+    use crate::hearts_ai;
+    use rand::rngs::StdRng;
+    use rand::SeedableRng;
+
+    fn lead_candidates(legal: u64) -> u64 {
+        let mut candidates = 0;
+        for s in 0..4 {
+            if legal & suit_mask(s) != 0 {
+                candidates |= 1 << (legal & suit_mask(s)).trailing_zeros();
+            }
+        }
+        return candidates;
+    }
+
+    fn check_matches_round(rules: &hearts::RuleSet, seed: u64) {
+        let mut rng: StdRng = SeedableRng::seed_from_u64(seed);
+        let mut deck = Deck::new();
+        deck.shuffle(&mut rng);
+        let mut round = hearts::Round::deal(&deck, rules, &[0, 0, 0, 0], 0);
+        // hearts_ai breaks ties between discards by hand order, and
+        // RolloutRound acts as if hands are sorted by suit.
+        for p in round.players.iter_mut() {
+            p.hand.sort_by_key(|c| c.index());
+        }
+        let mut rr = RolloutRound::from_round(&round);
+        while !round.is_over() {
+            assert!(!rr.is_over());
+            assert_eq!(rr.current_player_index(), round.current_player_index());
+            let legal = rr.legal_plays();
+            assert_eq!(legal, CardSet::from_cards(&round.legal_plays()).bits);
+            assert_eq!(legal, RolloutRound::from_round(&round).legal_plays());
+            let card = hearts_ai::choose_card_avoid_points(&round, &mut rng);
+            let rollout_card = rr.choose_card_avoid_points(&mut rng);
+            if round.current_trick.cards.is_empty() && legal.count_ones() > 1 {
+                let candidates = lead_candidates(legal);
+                assert!(candidates & card_bit(&card) != 0);
+                assert!(candidates & card_bit(&rollout_card) != 0);
+            } else {
+                assert_eq!(rollout_card, card);
+            }
+            // Sometimes play randomly to reach more varied positions.
+            let to_play = if rng.gen_range(0..3) == 0 {
+                hearts_ai::choose_card_random(&round, &mut rng)
+            } else {
+                card
+            };
+            round.play_card(&to_play);
+            rr.play_card(&to_play);
+        }
+        assert!(rr.is_over());
+        let points = round.points_taken();
+        assert_eq!(&rr.points_taken()[..rules.num_players], &points[..]);
+    }
+
+    #[test]
+    fn test_matches_round_default_rules() {
+        let rules = hearts::RuleSet::default();
+        for seed in 0..500 {
+            check_matches_round(&rules, seed);
+        }
+    }
+
+    #[test]
+    fn test_matches_round_all_rules() {
+        let rules = hearts::RuleSet {
+            points_on_first_trick: true,
+            queen_breaks_hearts: true,
+            jd_minus_10: true,
+            ..hearts::RuleSet::default()
+        };
+        for seed in 0..500 {
+            check_matches_round(&rules, seed);
+        }
+    }
+
+    #[test]
+    fn test_from_hands() {
+        let rules = hearts::RuleSet::default();
+        let mut rng: StdRng = SeedableRng::seed_from_u64(42);
+        let mut deck = Deck::new();
+        deck.shuffle(&mut rng);
+        let round = hearts::Round::deal(&deck, &rules, &[0, 0, 0, 0], 0);
+        let hands: Vec<CardSet> = round
+            .players
+            .iter()
+            .map(|p| CardSet::from_cards(&p.hand))
+            .collect();
+        let mut rr = RolloutRound::from_hands(&rules, &hands);
+        let mut expected = RolloutRound::from_round(&round);
+        assert_eq!(rr.current_player_index(), round.current_player_index());
+        while !expected.is_over() {
+            assert_eq!(rr.current_player_index(), expected.current_player_index());
+            assert_eq!(rr.legal_plays(), expected.legal_plays());
+            let card = expected.choose_card_random(&mut rng);
+            rr.play_card(&card);
+            expected.play_card(&card);
+        }
+        assert!(rr.is_over());
+        assert_eq!(rr.points_taken(), expected.points_taken());
+    }
+
+    #[test]
+    fn test_moon_shot() {
+        for &jd_minus_10 in [false, true].iter() {
+            let rules = hearts::RuleSet {
+                jd_minus_10: jd_minus_10,
+                ..hearts::RuleSet::default()
+            };
+            let mut round = hearts::Round::deal(&Deck::new(), &rules, &[0, 0, 0, 0], 0);
+            // Player 0 takes every trick.
+            for p in round.players.iter_mut() {
+                p.hand.clear();
+            }
+            for r in 2..=14 {
+                let rank = Rank::num(r);
+                round.prev_tricks.push(hearts::Trick {
+                    leader: 0,
+                    cards: ALL_SUITS.iter().map(|&s| Card::new(rank, s)).collect(),
+                    winner: 0,
+                });
+            }
+            round.current_trick = hearts::TrickInProgress::new(0);
+            let rr = RolloutRound::from_round(&round);
+            assert!(rr.is_over());
+            let shooter_points = if jd_minus_10 { -10 } else { 0 };
+            assert_eq!(&rr.points_taken()[..4], &[shooter_points, 26, 26, 26]);
+            assert_eq!(&rr.points_taken()[..4], &round.points_taken()[..]);
+        }
+    }
+}
@@ -0,0 +1,219 @@
+// Answers newline-delimited JSON requests from stdin until it's closed, for
+// tools that can't load the shared library and don't want to start a process
+// for each request. Each line is a request object as for the *_from_json
+// functions in main_api.rs, with an "op" field naming the function and an
+// "id" field of any JSON value. Each response is a line with the same "id"
+// and either the result or an "error" message:
+//   "card_to_play": {"id": 1, "index": 3, "card": "QS", "num_rollouts": 1000}
+//     where "index" is into the request's hand.
+//   "cards_to_pass": {"id": 2, "cards": "QS AH 8H"}
+//   "legal_plays": {"id": 3, "cards": "QS 8S"}
+//   "points_taken": {"id": 4, "points": [0, 13, 0, 0]}
+// Requests are handled by a pool of threads, so responses can be written in
+// a different order than the requests were read. Stdout only has response
+// lines; the AI writes any diagnostics to stderr.
+
+use crate::card::*;
+use crate::default_card_to_play_strategy;
+use crate::hearts_ai;
+use crate::hearts_ai::CardsToPassStrategy;
+use crate::hearts_json;
+use crate::hearts_json::ParseError;
+
+use rand::thread_rng;
+use serde_json::{json, Value};
+use std::io::{BufRead, Write};
+use std::panic;
+use std::sync::mpsc;
+use std::sync::{Arc, Mutex};
+use std::thread;
+
+fn cards_str(cards: &[Card]) -> String {
+    return cards
+        .iter()
+        .map(|c| c.ascii_string())
+        .collect::<Vec<String>>()
+        .join(" ");
+}
+
+fn handle_request(line: &str) -> Result<Value, ParseError> {
+    let v: Value = serde_json::from_str(line)?;
+    let op = match v.get("op").and_then(|op| op.as_str()) {
+        Some(op) => op,
+        None => return Err(ParseError::new("Missing \"op\"")),
+    };
+    match op {
+        "card_to_play" => {
+            let (req, maybe_strat) = hearts_json::parse_card_to_play_request_and_strategy(line)?;
+            if req.legal_plays().is_empty() {
+                return Err(ParseError::new("No legal plays"));
+            }
+            let ai_strat = maybe_strat.unwrap_or_else(default_card_to_play_strategy);
+            let mut stats = hearts_ai::SearchStats::default();
+            let card = hearts_ai::choose_card_with_stats(&req, &ai_strat, thread_rng(), &mut stats);
+            return Ok(json!({
+                "index": req.hand.iter().position(|&c| c == card),
+                "card": card.ascii_string(),
+                "num_rollouts": stats.num_rollouts,
+            }));
+        }
+        "cards_to_pass" => {
+            let (req, maybe_strat) = hearts_json::parse_cards_to_pass_request_and_strategy(line)?;
+            let strat = maybe_strat.unwrap_or(CardsToPassStrategy::Heuristic);
+            let cards = hearts_ai::choose_cards_to_pass_with_strategy(&req, &strat, thread_rng());
+            return Ok(json!({ "cards": cards_str(&cards) }));
+        }
+        "legal_plays" => {
+            let req = hearts_json::parse_card_to_play_request(line)?;
+            return Ok(json!({ "cards": cards_str(&req.legal_plays()) }));
+        }
+        "points_taken" => {
+            let history = hearts_json::parse_trick_history(line)?;
+            return Ok(json!({ "points": history.points_taken() }));
+        }
+        _ => return Err(ParseError::new(&format!("Unknown op: {}", op))),
+    }
+}
+
+// Returns the response line for a request line, without the newline.
+pub fn response_for_line(line: &str) -> String {
+    let id = serde_json::from_str::<Value>(line)
+        .ok()
+        .and_then(|v| v.get("id").cloned())
+        .unwrap_or(Value::Null);
+    // Requests that aren't consistent, such as hands with the wrong number of
+    // cards, can panic deep in the AI. That shouldn't take down the server.
+    let mut response = match panic::catch_unwind(|| handle_request(line)) {
+        Ok(Ok(result)) => result,
+        Ok(Err(e)) => json!({ "error": e.msg }),
+        Err(_) => json!({ "error": "Invalid request" }),
+    };
+    response["id"] = id;
+    return response.to_string();
+}
+
+// Reads request lines from stdin and writes response lines to stdout with
+// `num_threads` threads, or one per core if it's 0, until stdin is closed.
+pub fn serve(num_threads: usize) {
+    let num_threads = if num_threads > 0 {
+        num_threads
+    } else {
+        thread::available_parallelism().map_or(1, |n| n.get())
+    };
+    let (sender, receiver) = mpsc::channel::<String>();
+    let receiver = Arc::new(Mutex::new(receiver));
+    let workers: Vec<thread::JoinHandle<()>> = (0..num_threads)
+        .map(|_| {
+            let receiver = Arc::clone(&receiver);
+            thread::spawn(move || loop {
+                let line = match receiver.lock().unwrap().recv() {
+                    Ok(line) => line,
+                    Err(_) => return,
+                };
+                let response = response_for_line(&line);
+                let mut out = std::io::stdout().lock();
+                writeln!(out, "{}", response).unwrap();
+                out.flush().unwrap();
+            })
+        })
+        .collect();
+    for line in std::io::stdin().lock().lines() {
+        let line = line.unwrap();
+        if !line.trim().is_empty() {
+            sender.send(line).unwrap();
+        }
+    }
+    drop(sender);
+    for w in workers {
+        w.join().unwrap();
+    }
+}
+
+#[cfg(test)]
+mod test {
+    use super::*;
+
+    fn response(line: &str) -> Value {
+        return serde_json::from_str(&response_for_line(line)).unwrap();
+    }
+
+    const PLAY_REQUEST: &str = r#""hand": "QS 9S 2S KH 3H 2H 9D 8D 7D 9C 8C 3C",
+        "scores_before_round": [0, 0, 0, 0],
+        "prev_tricks": [{"leader": 0, "cards": "2C AC KC QC"}],
+        "current_trick": {"leader": 1, "cards": "4S 8S"},
+        "pass_direction": 0, "passed_cards": "", "received_cards": """#;
+
+    #[test]
+    fn test_card_to_play() {
+        let r = response(&format!(
+            r#"{{"id": 1, "op": "card_to_play", {},
+                "strategy": {{"name": "avoid_points"}}}}"#,
+            PLAY_REQUEST
+        ));
+        assert_eq!(r["id"], 1);
+        // Ducks under 8S.
+        assert_eq!(r["card"], "2S");
+        assert_eq!(r["index"], 2);
+        assert_eq!(r["num_rollouts"], 0);
+    }
+
+    #[test]
+    fn test_inconsistent_card_to_play() {
+        // All three opponents showed out of clubs, but the player doesn't
+        // have the rest of them, so no deal is possible and the search
+        // falls back to avoiding points.
+        let r = response(
+            r#"{"id": 6, "op": "card_to_play",
+                "hand": "AS KS QS JS TS 9S 8S AH KH QH JH TH",
+                "scores_before_round": [0, 0, 0, 0],
+                "prev_tricks": [{"leader": 0, "cards": "2C 2D 3D 4D"}],
+                "current_trick": {"leader": 0, "cards": ""},
+                "pass_direction": 0, "passed_cards": "", "received_cards": ""}"#,
+        );
+        assert_eq!(r["id"], 6);
+        assert_eq!(r["card"], "8S");
+    }
+
+    #[test]
+    fn test_legal_plays() {
+        let r = response(&format!(
+            r#"{{"id": "a", "op": "legal_plays", {}}}"#,
+            PLAY_REQUEST
+        ));
+        assert_eq!(r["id"], "a");
+        assert_eq!(r["cards"], "QS 9S 2S");
+    }
+
+    #[test]
+    fn test_cards_to_pass() {
+        let r = response(
+            r#"{"id": 2, "op": "cards_to_pass",
+                "scores_before_round": [0, 0, 0, 0],
+                "hand": "AS QS JS AH 8H 2H 6D 5D 4D 3D 6C 5C 4C",
+                "direction": 3, "num_cards": 3}"#,
+        );
+        assert_eq!(r["cards"], "QS AH 8H");
+    }
+
+    #[test]
+    fn test_points_taken() {
+        let r = response(
+            r#"{"id": 3, "op": "points_taken",
+                "tricks": [{"leader": 0, "cards": "2C AC KC QC"},
+                           {"leader": 1, "cards": "QS 2H 3H 4H"}]}"#,
+        );
+        assert_eq!(r["points"], json!([0, 16, 0, 0]));
+    }
+
+    #[test]
+    fn test_errors() {
+        let r = response(r#"{"id": 4, "op": "shuffle"}"#);
+        assert_eq!(r["id"], 4);
+        assert_eq!(r["error"], "Unknown op: shuffle");
+        let r = response(r#"{"id": 5, "op": "legal_plays"}"#);
+        assert!(r["error"].is_string());
+        let r = response("not json");
+        assert_eq!(r["id"], Value::Null);
+        assert!(r["error"].is_string());
+    }
+}
@@ -1,6 +1,12 @@
 mod card;
 mod hearts;
 mod hearts_ai;
+mod hearts_deal_cache;
+mod hearts_endgame;
+mod hearts_equity;
+mod hearts_pass;
+mod hearts_policy;
+mod hearts_rollout;
 
 use rand::thread_rng;
 
@@ -63,6 +69,7 @@ fn main() {
                 for i in 0..round.players.len() {
                     let pass_req = hearts_ai::CardsToPassRequest {
                         rules: rules.clone(),
+                        player_index: i,
                         hand: round.players[i].hand.clone(),
                         direction: pass_dir,
                         num_cards: 3,
@@ -91,16 +98,25 @@ fn main() {
                     MonteCarloParams {
                         num_hands: 50,
                         rollouts_per_hand: 20,
+                        endgame: None,
+                        early_stopping: None,
+                        reuse_deals: false,
                     },
                 ),
                 CardToPlayStrategy::MonteCarloRandom(MonteCarloParams {
                     num_hands: 50,
                     rollouts_per_hand: 20,
+                    endgame: None,
+                    early_stopping: None,
+                    reuse_deals: false,
                 }),
                 CardToPlayStrategy::MonteCarloAvoidPoints(
                     MonteCarloParams {
                         num_hands: 50,
                         rollouts_per_hand: 20,
+                        endgame: None,
+                        early_stopping: None,
+                        reuse_deals: false,
                     },
                 ),
             ];
@@ -1,15 +1,28 @@
 mod card;
 mod hearts;
 mod hearts_ai;
+mod hearts_bulk;
+mod hearts_deal_cache;
+mod hearts_endgame;
+mod hearts_equity;
 mod hearts_json;
+mod hearts_pass;
+mod hearts_policy;
+mod hearts_rollout;
+mod hearts_server;
 
+use std::env;
+use std::fs;
 use std::io::Read;
 use std::slice;
 
 use rand::thread_rng;
 
 use hearts_ai::MonteCarloParams;
-use hearts_ai::{CardToPlayDirectRequest, CardToPlayStrategy, CardsToPassRequest};
+use hearts_ai::{
+    CardToPlayDirectRequest, CardToPlayStrategy, CardsToPassRequest, CardsToPassStrategy,
+};
+use hearts_endgame::EndgameParams;
 
 /* Example: paste to stdin:
 {
@@ -22,18 +35,56 @@ use hearts_ai::{CardToPlayDirectRequest, CardToPlayStrategy, CardsToPassRequest}
 }
 */
 
+// Options:
+//   --serve: answers newline-delimited requests until stdin is closed,
+//     instead of a single request. See hearts_server.rs.
+//   --threads N: with --serve, the number of requests to handle at once,
+//     default one per core.
+//   --equity-table PATH: loads a match equity table written by the
+//     hearts_equity_table binary. Can be repeated.
+//   --rollout-policy PATH: loads rollout policy weights.
 fn main() {
+    let mut serve = false;
+    let mut num_threads = 0;
+    let mut args = env::args().skip(1);
+    while let Some(arg) = args.next() {
+        match arg.as_str() {
+            "--serve" => serve = true,
+            "--threads" => num_threads = args.next().unwrap().parse().unwrap(),
+            // Invalid files are skipped, as load_match_equity_table and
+            // load_rollout_policy do, so one bad file doesn't stop the server.
+            "--equity-table" => {
+                let path = args.next().unwrap();
+                match fs::read(&path)
+                    .map_err(|e| e.to_string())
+                    .and_then(|b| hearts_equity::MatchEquityTable::from_bytes(&b))
+                {
+                    Ok(table) => hearts_equity::add_table(table),
+                    Err(e) => eprintln!("Invalid match equity table {}: {}", path, e),
+                }
+            }
+            "--rollout-policy" => {
+                let path = args.next().unwrap();
+                match fs::read(&path)
+                    .map_err(|e| e.to_string())
+                    .and_then(|b| hearts_policy::LinearPolicy::from_bytes(&b))
+                {
+                    Ok(policy) => hearts_policy::set_linear_policy(policy),
+                    Err(e) => eprintln!("Invalid rollout policy {}: {}", path, e),
+                }
+            }
+            _ => panic!("Unknown argument: {}", arg),
+        }
+    }
+    if serve {
+        hearts_server::serve(num_threads);
+        return;
+    }
     let mut rng = thread_rng();
     let mut buffer = String::new();
     std::io::stdin().read_to_string(&mut buffer).expect("");
-    let req = hearts_json::parse_card_to_play_request(&buffer).unwrap();
-    let ai_strat = CardToPlayStrategy::MonteCarloMixedRandomAvoidPoints(
-        0.1,
-        MonteCarloParams {
-            num_hands: 50,
-            rollouts_per_hand: 20,
-        },
-    );
+    let (req, maybe_strat) = hearts_json::parse_card_to_play_request_and_strategy(&buffer).unwrap();
+    let ai_strat = maybe_strat.unwrap_or_else(default_card_to_play_strategy);
     let ai_card = hearts_ai::choose_card(&req, &ai_strat, &mut rng);
     println!("{}", ai_card.symbol_string());
 }
@@ -44,9 +95,12 @@ fn string_from_ptr(s: *const u8, len: u32) -> String {
     return String::from_utf8(bytes.to_vec()).unwrap();
 }
 
-fn cards_to_pass_req_from_json(s: *const u8, len: u32) -> CardsToPassRequest {
+fn cards_to_pass_req_from_json(
+    s: *const u8,
+    len: u32,
+) -> (CardsToPassRequest, Option<CardsToPassStrategy>) {
     let r_str = string_from_ptr(s, len);
-    return hearts_json::parse_cards_to_pass_request(&r_str).unwrap();
+    return hearts_json::parse_cards_to_pass_request_and_strategy(&r_str).unwrap();
 }
 
 fn card_to_play_req_from_json(s: *const u8, len: u32) -> CardToPlayDirectRequest {
@@ -54,15 +108,35 @@ fn card_to_play_req_from_json(s: *const u8, len: u32) -> CardToPlayDirectRequest
     return hearts_json::parse_card_to_play_request(&r_str).unwrap();
 }
 
+fn default_card_to_play_strategy() -> CardToPlayStrategy {
+    return CardToPlayStrategy::MonteCarloMixedRandomAvoidPoints(
+        0.1,
+        MonteCarloParams {
+            num_hands: 50,
+            rollouts_per_hand: 20,
+            endgame: Some(EndgameParams {
+                max_hand_size: hearts_endgame::DEFAULT_MAX_HAND_SIZE,
+                num_hands: hearts_endgame::DEFAULT_NUM_HANDS,
+            }),
+            early_stopping: Some(hearts_ai::DEFAULT_EARLY_STOPPING),
+            reuse_deals: false,
+        },
+    );
+}
+
 // Parses `len` bytes of `s` as a JSON-encoded CardsToPassRequest.
 // Determines the best cards to pass, and for each card at index i in the hand,
 // writes 1 to `pass_out[i]` if the card should be passed and 0 if not.
 // The size of `pass_out` must be at least the number of cards in the hand.
+// The request can have a "strategy" field, for example {"name": "simulation"}
+// to play out rounds with candidate passes; see hearts_json.rs for the options.
+// Without it, uses the heuristic in hearts_ai::choose_cards_to_pass.
 // See ffi_test.py for an example of how to call.
 #[no_mangle]
 pub extern "C" fn cards_to_pass_from_json(s: *const u8, len: u32, pass_out: *mut u8, out_len: u32) {
-    let req = cards_to_pass_req_from_json(s, len);
-    let cards_to_pass = hearts_ai::choose_cards_to_pass(&req);
+    let (req, maybe_strat) = cards_to_pass_req_from_json(s, len);
+    let strat = maybe_strat.unwrap_or(CardsToPassStrategy::Heuristic);
+    let cards_to_pass = hearts_ai::choose_cards_to_pass_with_strategy(&req, &strat, thread_rng());
     if req.hand.len() > (out_len as usize) {
         panic!(
             "`out_len` is {} but hand has {} cards",
@@ -80,19 +154,37 @@ pub extern "C" fn cards_to_pass_from_json(s: *const u8, len: u32, pass_out: *mut
 
 // Parses `len` bytes of `s` as a JSON-encoded CardToPlayRequest.
 // Returns the best card to play as an index into the "hand" field of the request.
+// The request can have a "strategy" field to choose the AI strategy, for example
+// {"name": "monte_carlo", "num_hands": 100}; see hearts_json.rs for the options.
+// Without it, uses Monte Carlo search, switching to the exact endgame search
+// for the last few tricks.
 // See ffi_test.py for an example of how to call.
 #[no_mangle]
 pub extern "C" fn card_to_play_from_json(s: *const u8, len: u32) -> i32 {
-    let req = card_to_play_req_from_json(s, len);
-    let ai_strat = CardToPlayStrategy::MonteCarloMixedRandomAvoidPoints(
-        0.1,
-        MonteCarloParams {
-            num_hands: 50,
-            rollouts_per_hand: 20,
-        },
-    );
+    return card_to_play_with_stats_from_json(s, len, std::ptr::null_mut());
+}
+
+// Like card_to_play_from_json, and if `num_rollouts_out` isn't null, writes the
+// number of rollouts that the search used to it. Monte Carlo search stops
+// early when one card is clearly best, so this is often well below the
+// strategy's maximum.
+#[no_mangle]
+pub extern "C" fn card_to_play_with_stats_from_json(
+    s: *const u8,
+    len: u32,
+    num_rollouts_out: *mut u64,
+) -> i32 {
+    let r_str = string_from_ptr(s, len);
+    let (req, maybe_strat) = hearts_json::parse_card_to_play_request_and_strategy(&r_str).unwrap();
+    let ai_strat = maybe_strat.unwrap_or_else(default_card_to_play_strategy);
     let mut rng = thread_rng();
-    let ai_card = hearts_ai::choose_card(&req, &ai_strat, &mut rng);
+    let mut stats = hearts_ai::SearchStats::default();
+    let ai_card = hearts_ai::choose_card_with_stats(&req, &ai_strat, &mut rng, &mut stats);
+    if !num_rollouts_out.is_null() {
+        unsafe {
+            std::ptr::write_unaligned(num_rollouts_out, stats.num_rollouts);
+        }
+    }
     return match req.hand.iter().position(|&c| c == ai_card) {
         Some(i) => i as i32,
         None => -1,
@@ -150,3 +242,175 @@ pub extern "C" fn points_taken_from_json(
         }
     }
 }
+
+// Loads a match equity table from the `len` bytes at `s`, in the format that
+// the hearts_equity_table binary writes. Searches for rules that match the
+// table use it for the rest of the process instead of estimating equities
+// from scores. Returns 0 on success and -1 if the bytes aren't a valid table.
+#[no_mangle]
+pub extern "C" fn load_match_equity_table(s: *const u8, len: u32) -> i32 {
+    assert!(!s.is_null());
+    let bytes = unsafe { slice::from_raw_parts(s, len as usize) };
+    return match hearts_equity::MatchEquityTable::from_bytes(bytes) {
+        Ok(table) => {
+            hearts_equity::add_table(table);
+            0
+        }
+        Err(_) => -1,
+    };
+}
+
+// Loads a rollout policy from the `len` bytes at `s`, in the format that
+// hearts_policy::LinearPolicy::to_bytes writes. Strategies that use the
+// linear policy will use it instead of the built-in weights. Returns 0 on
+// success and -1 if the bytes aren't a valid policy.
+#[no_mangle]
+pub extern "C" fn load_rollout_policy(s: *const u8, len: u32) -> i32 {
+    assert!(!s.is_null());
+    let bytes = unsafe { slice::from_raw_parts(s, len as usize) };
+    return match hearts_policy::LinearPolicy::from_bytes(bytes) {
+        Ok(policy) => {
+            hearts_policy::set_linear_policy(policy);
+            0
+        }
+        Err(_) => -1,
+    };
+}
+
+// Parses `len` bytes of `s` as a JSON-encoded CardToPlayRequest, and writes
+// the rollout policy features of each legal play, for training the policy.
+// For the card at index i in the hand, features are written to
+// `features_out[i * n]` through `features_out[i * n + n - 1]`, where n is the
+// number of features, and are all 0 if the card isn't a legal play. The size
+// of `features_out` must be at least n times the number of cards in the hand.
+// Returns n, or -1 if the request isn't consistent.
+#[no_mangle]
+pub extern "C" fn play_features_from_json(
+    s: *const u8,
+    len: u32,
+    features_out: *mut f32,
+    out_len: u32,
+) -> i32 {
+    let req = card_to_play_req_from_json(s, len);
+    let n = hearts_policy::NUM_FEATURES;
+    if req.hand.len() * n > (out_len as usize) {
+        panic!(
+            "`out_len` is {} but hand has {} cards with {} features",
+            out_len,
+            req.hand.len(),
+            n
+        );
+    }
+    let plays = match hearts_policy::play_features_for_request(&req, thread_rng()) {
+        Ok(plays) => plays,
+        Err(_) => return -1,
+    };
+    for (i, card) in req.hand.iter().enumerate() {
+        let features = plays.iter().find(|(c, _)| c == card).map(|(_, f)| *f);
+        for j in 0..n {
+            let val = features.map_or(0.0, |f| f[j]);
+            unsafe {
+                std::ptr::write_unaligned(features_out.offset((i * n + j) as isize), val);
+            }
+        }
+    }
+    return n as i32;
+}
+
+// Simulates one round for each of `num_games` deals, for bulk analysis; see
+// hearts_bulk.rs. Arrays are owned by the caller and must be contiguous:
+// `deals` has 52 bytes per game, each the seat holding the card with that
+// index, `seeds` has a random seed per game, and `rules` has
+// hearts_bulk::RULES_BLOCK_SIZE values. Writes 4 values per game to
+// `points_out` and 1 to `shooters_out`, and if `plays_out` isn't null, 52
+// card indices per game in the order they were played. `strategy` is a
+// hearts_bulk::strategy_from_code code. Cards are passed in `pass_direction`
+// first if it's not 0. Returns 0 on success and -1 if the deals or strategy
+// aren't valid.
+#[no_mangle]
+pub extern "C" fn simulate_rounds(
+    deals: *const u8,
+    seeds: *const u64,
+    num_games: u32,
+    rules: *const i32,
+    strategy: i32,
+    p_random: f64,
+    pass_direction: u32,
+    num_threads: u32,
+    points_out: *mut i32,
+    shooters_out: *mut i8,
+    plays_out: *mut u8,
+) -> i32 {
+    let n = num_games as usize;
+    assert!(!deals.is_null() && !seeds.is_null() && !rules.is_null());
+    assert!(!points_out.is_null() && !shooters_out.is_null());
+    let deals = unsafe { slice::from_raw_parts(deals, n * hearts_bulk::DEAL_SIZE) };
+    let strategy = match hearts_bulk::strategy_from_code(strategy, p_random) {
+        Some(s) if hearts_bulk::are_deals_valid(deals) && pass_direction < 4 => s,
+        _ => return -1,
+    };
+    let rules = hearts_bulk::rules_from_block(unsafe {
+        slice::from_raw_parts(rules, hearts_bulk::RULES_BLOCK_SIZE)
+    });
+    let plays = if plays_out.is_null() {
+        None
+    } else {
+        Some(unsafe { slice::from_raw_parts_mut(plays_out, n * hearts_bulk::DEAL_SIZE) })
+    };
+    hearts_bulk::simulate_rounds(
+        &rules,
+        &strategy,
+        pass_direction,
+        deals,
+        unsafe { slice::from_raw_parts(seeds, n) },
+        unsafe { slice::from_raw_parts_mut(points_out, n * hearts_bulk::NUM_PLAYERS) },
+        unsafe { slice::from_raw_parts_mut(shooters_out, n) },
+        plays,
+        num_threads as usize,
+    );
+    return 0;
+}
+
+// Like simulate_rounds, but plays a match for each game, starting with the
+// game's deal. Writes the final scores, 4 values per game, to `scores_out`,
+// the number of rounds to `rounds_out`, and the number of times each player
+// shot the moon, 4 values per game, to `moon_shots_out`.
+#[no_mangle]
+pub extern "C" fn simulate_matches(
+    deals: *const u8,
+    seeds: *const u64,
+    num_games: u32,
+    rules: *const i32,
+    strategy: i32,
+    p_random: f64,
+    num_threads: u32,
+    scores_out: *mut i32,
+    rounds_out: *mut i32,
+    moon_shots_out: *mut i32,
+) -> i32 {
+    let n = num_games as usize;
+    assert!(!deals.is_null() && !seeds.is_null() && !rules.is_null());
+    assert!(!scores_out.is_null() && !rounds_out.is_null() && !moon_shots_out.is_null());
+    let deals = unsafe { slice::from_raw_parts(deals, n * hearts_bulk::DEAL_SIZE) };
+    let strategy = match hearts_bulk::strategy_from_code(strategy, p_random) {
+        Some(s) if hearts_bulk::are_deals_valid(deals) => s,
+        _ => return -1,
+    };
+    let rules = hearts_bulk::rules_from_block(unsafe {
+        slice::from_raw_parts(rules, hearts_bulk::RULES_BLOCK_SIZE)
+    });
+    if rules.point_limit == 0 {
+        return -1;
+    }
+    hearts_bulk::simulate_matches(
+        &rules,
+        &strategy,
+        deals,
+        unsafe { slice::from_raw_parts(seeds, n) },
+        unsafe { slice::from_raw_parts_mut(scores_out, n * hearts_bulk::NUM_PLAYERS) },
+        unsafe { slice::from_raw_parts_mut(rounds_out, n) },
+        unsafe { slice::from_raw_parts_mut(moon_shots_out, n * hearts_bulk::NUM_PLAYERS) },
+        num_threads as usize,
+    );
+    return 0;
+}
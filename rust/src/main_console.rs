@@ -1,6 +1,12 @@
 mod card;
 mod hearts;
 mod hearts_ai;
+mod hearts_deal_cache;
+mod hearts_endgame;
+mod hearts_equity;
+mod hearts_pass;
+mod hearts_policy;
+mod hearts_rollout;
 
 use std::io;
 
@@ -9,6 +15,7 @@ use rand::thread_rng;
 use card::*;
 use hearts_ai::CardToPlayStrategy;
 use hearts_ai::MonteCarloParams;
+use hearts_endgame::EndgameParams;
 
 // TODO: match with multiple rounds to 100 points
 
@@ -23,6 +30,12 @@ fn main() {
         MonteCarloParams {
             num_hands: 50,
             rollouts_per_hand: 20,
+            endgame: Some(EndgameParams {
+                max_hand_size: hearts_endgame::DEFAULT_MAX_HAND_SIZE,
+                num_hands: hearts_endgame::DEFAULT_NUM_HANDS,
+            }),
+            early_stopping: Some(hearts_ai::DEFAULT_EARLY_STOPPING),
+            reuse_deals: false,
         },
     );
     deck.shuffle(&mut rng);
@@ -53,6 +66,7 @@ fn main() {
         for i in 1..round.players.len() {
             let pass_req = hearts_ai::CardsToPassRequest {
                 rules: rules.clone(),
+                player_index: i,
                 hand: round.players[i].hand.clone(),
                 direction: pass_dir,
                 num_cards: 3,
@@ -0,0 +1,49 @@
+mod card;
+mod hearts;
+mod hearts_ai;
+mod hearts_deal_cache;
+mod hearts_endgame;
+mod hearts_equity;
+mod hearts_pass;
+mod hearts_policy;
+mod hearts_rollout;
+
+use rand::thread_rng;
+use std::env;
+use std::fs;
+
+// Computes a match equity table and writes it to a file that
+// load_match_equity_table in main_api.rs can read. Example:
+//   cargo run --bin hearts_equity_table --release -- --jd-minus-10 equity_table_jd.bin
+// Options:
+//   --point-limit N: match point limit, default 100.
+//   --jd-minus-10: the jack of diamonds subtracts 10 points.
+//   --shooting-disabled: shooting the moon isn't allowed.
+//   --step N: points between grid points, default 5.
+//   --rounds N: rounds to simulate for the distribution of points, default 1000000.
+
+fn main() {
+    let mut rules = hearts::RuleSet::default();
+    let mut step = 5;
+    let mut num_rounds = 1000000;
+    let mut output_path: Option<String> = None;
+    let mut args = env::args().skip(1);
+    while let Some(arg) = args.next() {
+        match arg.as_str() {
+            "--point-limit" => rules.point_limit = args.next().unwrap().parse().unwrap(),
+            "--jd-minus-10" => rules.jd_minus_10 = true,
+            "--shooting-disabled" => rules.moon_shooting = hearts::MoonShooting::Disabled,
+            "--step" => step = args.next().unwrap().parse().unwrap(),
+            "--rounds" => num_rounds = args.next().unwrap().parse().unwrap(),
+            _ => output_path = Some(arg),
+        }
+    }
+    let output_path = output_path.expect("Missing output path");
+    // With the jack of diamonds a player can take -10 points in a round, so
+    // scores can be negative. They rarely get far below 0.
+    let min_score = if rules.jd_minus_10 { -20 } else { 0 };
+    let table =
+        hearts_equity::MatchEquityTable::compute(&rules, min_score, step, num_rounds, thread_rng());
+    fs::write(&output_path, table.to_bytes()).unwrap();
+    println!("Wrote {}", output_path);
+}